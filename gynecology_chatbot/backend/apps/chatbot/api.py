@@ -1,127 +1,225 @@
-import os
-import time
+import asyncio
 import openai
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from django.conf import settings
+from utils.rate_limit import ProviderRateLimited
+from utils.chat_history import openai_view, gemini_view
+from .clients import provider_clients
 
 # Configure API clients
 openai.api_key = settings.OPENAI_API_KEY
 if settings.GEMINI_API_KEY:
     genai.configure(api_key=settings.GEMINI_API_KEY)
 
-# Keep the async functions but add synchronous versions
+# Async versions are used by the fan-out engine in utils.llm_utils; the
+# synchronous versions are kept for legacy callers and one-off fallbacks.
 
-async def get_openai_response(user_message, chat_history=None):
-    """Async version - kept for completeness but not used"""
-    return get_openai_response_sync(user_message, chat_history)
+def _build_openai_messages(user_message, chat_history=None):
+    """Build the OpenAI chat messages array with system prompt and history"""
+    messages = [{"role": "system", "content": settings.GYNECOLOGY_SYSTEM_PROMPT}]
 
-def get_openai_response_sync(user_message, chat_history=None):
+    # Add chat history if provided (cached history entries are already serialized)
+    messages.extend(openai_view(chat_history))
+
+    # Add current user message
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+GEMINI_CHAT_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 500,
+    "top_k": 40,
+    "top_p": 0.95,
+}
+
+def _gemini_chat_model():
+    """Get the shared Gemini model used for chat responses"""
+    return provider_clients.gemini_model(
+        settings.GEMINI_MODEL,
+        GEMINI_CHAT_CONFIG,
+        system_instruction=settings.GYNECOLOGY_SYSTEM_PROMPT
+    )
+
+def _build_gemini_history(chat_history=None):
+    """Format chat history for the Gemini chat API"""
+    return gemini_view(chat_history)
+
+def _gemini_request_options(timeout=None):
+    """Per-request options so a Gemini call can never outlive its deadline"""
+    return {"timeout": timeout or settings.LLM_PROVIDER_TIMEOUT}
+
+def _retry_after(error):
+    """Seconds the provider asked us to wait in a rate-limit error, if it said"""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _gemini_text(response):
+    """Extract the text from a Gemini response"""
+    if hasattr(response, 'text') and response.text:
+        return response.text
+    return "Error: Gemini returned an empty response."
+
+async def get_openai_response(user_message, chat_history=None, timeout=None):
+    """Async version for OpenAI response using AsyncOpenAI"""
+    if not settings.OPENAI_API_KEY:
+        print("OpenAI API key is missing!")
+        return "Error: OpenAI API key not configured."
+
+    try:
+        messages = _build_openai_messages(user_message, chat_history)
+
+        client = provider_clients.async_openai_client()
+        response = await client.chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=messages,
+            max_tokens=500,
+            temperature=0.7,
+            timeout=timeout or settings.LLM_PROVIDER_TIMEOUT
+        )
+
+        print("OpenAI response generated successfully")
+        return response.choices[0].message.content
+
+    except asyncio.CancelledError:
+        raise
+    except openai.RateLimitError as e:
+        raise ProviderRateLimited("openai", _retry_after(e), str(e))
+    except Exception as e:
+        print(f"OpenAI error: {str(e)}")
+        return f"Error generating response from ChatGPT: {str(e)}"
+
+async def stream_openai_response(user_message, chat_history=None, timeout=None):
+    """Async generator yielding OpenAI response tokens as they arrive"""
+    if not settings.OPENAI_API_KEY:
+        raise RuntimeError("OpenAI API key not configured.")
+
+    client = provider_clients.async_openai_client()
+    try:
+        stream = await client.chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=_build_openai_messages(user_message, chat_history),
+            max_tokens=500,
+            temperature=0.7,
+            timeout=timeout or settings.LLM_PROVIDER_TIMEOUT,
+            stream=True
+        )
+    except openai.RateLimitError as e:
+        raise ProviderRateLimited("openai", _retry_after(e), str(e))
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def get_openai_response_sync(user_message, chat_history=None, timeout=None):
     """Synchronous version for OpenAI response"""
     if not settings.OPENAI_API_KEY:
         print("OpenAI API key is missing!")
         return "Error: OpenAI API key not configured."
-    
+
     try:
         # Create messages array with system prompt
-        messages = [{"role": "system", "content": settings.GYNECOLOGY_SYSTEM_PROMPT}]
-        
-        # Add chat history if provided
-        if chat_history:
-            for msg in chat_history:
-                role = "user" if msg.message_type == "user" else "assistant"
-                messages.append({"role": role, "content": msg.content})
-        
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
-        
+        messages = _build_openai_messages(user_message, chat_history)
+
         # Call OpenAI API
-        client = openai.Client(api_key=settings.OPENAI_API_KEY)
+        client = provider_clients.openai_client()
         response = client.chat.completions.create(
             model=settings.OPENAI_MODEL,
             messages=messages,
             max_tokens=500,
-            temperature=0.7
+            temperature=0.7,
+            timeout=timeout or settings.LLM_PROVIDER_TIMEOUT
         )
-        
-        print(f"OpenAI response generated successfully")
+
+        print("OpenAI response generated successfully")
         return response.choices[0].message.content
-        
+
     except Exception as e:
         print(f"OpenAI error: {str(e)}")
         return f"Error generating response from ChatGPT: {str(e)}"
 
-async def get_gemini_response(user_message, chat_history=None):
-    """Async version - kept for completeness but not used"""
-    return get_gemini_response_sync(user_message, chat_history)
+async def get_gemini_response(user_message, chat_history=None, timeout=None):
+    """Async version for Gemini response using the async generate API"""
+    if not settings.GEMINI_API_KEY:
+        print("Gemini API key is missing!")
+        return "Error: Gemini API key not configured."
+
+    try:
+        model = _gemini_chat_model()
+        history = _build_gemini_history(chat_history)
+
+        if history:
+            chat = model.start_chat(history=history)
+            response = await chat.send_message_async(user_message, request_options=_gemini_request_options(timeout))
+        else:
+            response = await model.generate_content_async(user_message, request_options=_gemini_request_options(timeout))
+
+        print("Gemini response generated successfully")
+        return _gemini_text(response)
+
+    except asyncio.CancelledError:
+        raise
+    except google_exceptions.ResourceExhausted as e:
+        raise ProviderRateLimited("gemini", None, str(e))
+    except Exception as e:
+        print(f"Gemini error: {str(e)}")
+        return f"Error generating response from Gemini: {str(e)}"
+
+async def stream_gemini_response(user_message, chat_history=None, timeout=None):
+    """Async generator yielding Gemini response tokens as they arrive"""
+    if not settings.GEMINI_API_KEY:
+        raise RuntimeError("Gemini API key not configured.")
+
+    model = _gemini_chat_model()
+    history = _build_gemini_history(chat_history)
+    request_options = _gemini_request_options(timeout)
 
-def get_gemini_response_sync(user_message, chat_history=None):
+    try:
+        if history:
+            chat = model.start_chat(history=history)
+            response = await chat.send_message_async(user_message, stream=True, request_options=request_options)
+        else:
+            response = await model.generate_content_async(user_message, stream=True, request_options=request_options)
+    except google_exceptions.ResourceExhausted as e:
+        raise ProviderRateLimited("gemini", None, str(e))
+
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+def get_gemini_response_sync(user_message, chat_history=None, timeout=None):
     """Synchronous version for Gemini response with updated API"""
     if not settings.GEMINI_API_KEY:
         print("Gemini API key is missing!")
         return "Error: Gemini API key not configured."
-    
+
     try:
-        # Initialize the model with updated API
-        model = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL,
-            generation_config=genai.GenerationConfig(
-                temperature=0.7,
-                max_output_tokens=500,
-                top_k=40,
-                top_p=0.95,
-            ),
-            system_instruction=settings.GYNECOLOGY_SYSTEM_PROMPT
-        )
-        
+        # Get the shared model
+        model = _gemini_chat_model()
+
         # Format chat history for the new API
-        chat_messages = []
-        
-        # Add chat history if provided
-        if chat_history:
-            for msg in chat_history:
-                role = "user" if msg.message_type == "user" else "model"
-                chat_messages.append({
-                    "role": role,
-                    "parts": [msg.content]
-                })
-        
+        chat_messages = _build_gemini_history(chat_history)
+
         # Add current user message
         chat_messages.append({
-            "role": "user", 
+            "role": "user",
             "parts": [user_message]
         })
-        
+
         # Generate response using the updated API
         if chat_messages:
             # Start chat with history
             chat = model.start_chat(history=chat_messages[:-1])
-            response = chat.send_message(user_message)
+            response = chat.send_message(user_message, request_options=_gemini_request_options(timeout))
         else:
             # Single message
-            response = model.generate_content(user_message)
-        
-        print(f"Gemini response generated successfully")
-        
-        if hasattr(response, 'text') and response.text:
-            return response.text
-        else:
-            return "Error: Gemini returned an empty response."
-            
+            response = model.generate_content(user_message, request_options=_gemini_request_options(timeout))
+
+        print("Gemini response generated successfully")
+        return _gemini_text(response)
+
     except Exception as e:
         print(f"Gemini error: {str(e)}")
         return f"Error generating response from Gemini: {str(e)}"
-
-async def get_grok_response(user_message, chat_history=None):
-    """Async version - kept for completeness but not used"""
-    return get_grok_response_sync(user_message, chat_history)
-
-def get_grok_response_sync(user_message, chat_history=None):
-    """Synchronous version for simulated Grok response"""
-    # Simulate API delay
-    time.sleep(1) 
-    
-    return (
-        f"As your gynecology assistant, I understand you're asking about '{user_message[:30]}...'. "
-        f"While I don't have complete information, I can provide general guidance on this topic. "
-        f"Remember to consult with a healthcare provider for a proper evaluation of your specific situation."
-    )
@@ -0,0 +1,243 @@
+import asyncio
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Any, Optional
+from django.conf import settings
+from utils.llm_cache import request_key
+from utils.rate_limit import ProviderRateLimited
+from .providers import ProviderAdapter, ProviderRegistry
+
+class Cassette:
+    """
+    Recorded provider interactions in a gzip-compressed NDJSON file.
+
+    Each line is one interaction: {"p": provider, "op": "call" | "stream" |
+    "health", "k": request key, "c": [[seconds since the call started, text],
+    ...], "e": error or null, "r": "rate_limited" for provider 429s, "t":
+    total seconds}. A call is stored as a single chunk at its completion time,
+    so calls and streams can replay each other. Repeated requests with the
+    same key replay their recordings in order, then start over.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._recordings: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+        self._played: Dict[tuple, int] = defaultdict(int)
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        # Appended gzip members read back as one stream
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recordings[(entry["p"], entry["op"], entry["k"])].append(entry)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._recordings.values())
+
+    def find(self, provider: str, ops: List[str], key: str) -> Optional[Dict[str, Any]]:
+        """Next recording for the request, trying ops in order; None on a miss."""
+        with self._lock:
+            for op in ops:
+                entries = self._recordings.get((provider, op, key))
+                if entries:
+                    index = self._played[(provider, op, key)]
+                    self._played[(provider, op, key)] = index + 1
+                    self.hits += 1
+                    return entries[index % len(entries)]
+            self.misses += 1
+            return None
+
+    def add(self, entry: Dict[str, Any]):
+        with self._lock:
+            self._recordings[(entry["p"], entry["op"], entry["k"])].append(entry)
+            self._pending.append(entry)
+            self.recorded += 1
+            flush = len(self._pending) >= settings.LLM_CASSETTE['FLUSH_EVERY']
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Append recordings made since the last flush to the file."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                for entry in pending:
+                    f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"path": self.path, "hits": self.hits, "misses": self.misses, "recorded": self.recorded}
+
+class CassetteProvider(ProviderAdapter):
+    """
+    Wraps a provider adapter to record its interactions to a cassette or to
+    replay them instead of calling it.
+
+    mode 'record' calls the wrapped adapter and stores what it returned and
+    when. mode 'replay' answers from the cassette, sleeping the recorded
+    timings times latency_scale (0 replays as fast as possible); a request
+    that was never recorded goes to the wrapped adapter when passthrough is
+    on and fails like a provider error otherwise.
+    """
+
+    kind = "cassette"
+
+    def __init__(self, inner: ProviderAdapter, cassette: Cassette, mode: str,
+                 latency_scale: float = 1.0, passthrough: bool = False):
+        self.name = inner.name
+        self.inner = inner
+        self.cassette = cassette
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.passthrough = passthrough
+
+    @property
+    def simulated(self) -> bool:
+        return self.inner.simulated
+
+    def _key(self, user_message: str, chat_history: List[Any]) -> str:
+        return request_key(user_message, chat_history, self.name)
+
+    def _entry(self, op: str, key: str, chunks: List[list], started: float,
+               error: Optional[Exception] = None) -> Dict[str, Any]:
+        return {
+            "p": self.name,
+            "op": op,
+            "k": key,
+            "c": chunks,
+            "e": str(error) if error else None,
+            "r": "rate_limited" if isinstance(error, ProviderRateLimited) else None,
+            "t": round(time.monotonic() - started, 4),
+        }
+
+    def _raise_recorded(self, entry: Dict[str, Any]):
+        if entry["r"] == "rate_limited":
+            raise ProviderRateLimited(self.name, None, entry["e"])
+        raise RuntimeError(entry["e"])
+
+    async def _sleep_until(self, started: float, offset: float):
+        delay = offset * self.latency_scale - (time.monotonic() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _miss_error(self) -> str:
+        return f"Error generating response from {self.name}: no recording in {self.cassette.path}"
+
+    async def call(self, user_message, chat_history, timeout=None):
+        key = self._key(user_message, chat_history)
+        started = time.monotonic()
+
+        if self.mode == "replay":
+            entry = self.cassette.find(self.name, ["call", "stream"], key)
+            if entry is None:
+                if self.passthrough:
+                    return await self.inner.call(user_message, chat_history, timeout)
+                return self._miss_error()
+            await self._sleep_until(started, entry["t"])
+            if entry["e"]:
+                self._raise_recorded(entry)
+            return "".join(text for _, text in entry["c"])
+
+        try:
+            response = await self.inner.call(user_message, chat_history, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # The caller's deadline, not the provider's answer; nothing to replay
+            raise
+        except Exception as e:
+            self.cassette.add(self._entry("call", key, [], started, e))
+            raise
+        self.cassette.add(self._entry("call", key, [[round(time.monotonic() - started, 4), response]], started))
+        return response
+
+    async def stream(self, user_message, chat_history, timeout=None):
+        key = self._key(user_message, chat_history)
+        started = time.monotonic()
+
+        if self.mode == "replay":
+            entry = self.cassette.find(self.name, ["stream", "call"], key)
+            if entry is None:
+                if not self.passthrough:
+                    raise RuntimeError(self._miss_error())
+                async for chunk in self.inner.stream(user_message, chat_history, timeout):
+                    yield chunk
+                return
+            if entry["op"] == "call" and entry["c"] and entry["c"][0][1].startswith("Error"):
+                await self._sleep_until(started, entry["t"])
+                raise RuntimeError(entry["c"][0][1])
+            for offset, text in entry["c"]:
+                await self._sleep_until(started, offset)
+                yield text
+            if entry["e"]:
+                self._raise_recorded(entry)
+            return
+
+        chunks = []
+        try:
+            async for chunk in self.inner.stream(user_message, chat_history, timeout):
+                chunks.append([round(time.monotonic() - started, 4), chunk])
+                yield chunk
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            raise
+        except Exception as e:
+            self.cassette.add(self._entry("stream", key, chunks, started, e))
+            raise
+        self.cassette.add(self._entry("stream", key, chunks, started))
+
+    async def health(self, timeout=None):
+        started = time.monotonic()
+        if self.mode == "replay":
+            entry = self.cassette.find(self.name, ["health"], "")
+            if entry is None:
+                return await self.inner.health(timeout) if self.passthrough else True
+            await self._sleep_until(started, entry["t"])
+            return entry["e"] is None
+
+        healthy = await self.inner.health(timeout)
+        error = None if healthy else RuntimeError("health check failed")
+        self.cassette.add(self._entry("health", "", [], started, error))
+        return healthy
+
+    def describe(self):
+        return {
+            "kind": self.kind,
+            "mode": self.mode,
+            "latency_scale": self.latency_scale,
+            "wraps": self.inner.describe(),
+            "cassette": self.cassette.stats(),
+        }
+
+def use_cassette(registry: ProviderRegistry, path: str, mode: str,
+                 latency_scale: float = 1.0, passthrough: bool = False) -> Cassette:
+    """Wrap every registered provider to record to or replay from the cassette at path."""
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown cassette mode: {mode}")
+    if mode == "replay" and not os.path.exists(path):
+        raise FileNotFoundError(f"No cassette at {path}")
+
+    cassette = Cassette(path)
+    for name in registry.names():
+        adapter = registry.get(name)
+        if isinstance(adapter, CassetteProvider):
+            adapter = adapter.inner
+        registry.register(CassetteProvider(adapter, cassette, mode, latency_scale, passthrough))
+    if mode == "record":
+        atexit.register(cassette.flush)
+    return cassette
@@ -0,0 +1,115 @@
+import threading
+from typing import Dict, Any, Optional
+import httpx
+import openai
+import google.generativeai as genai
+from django.conf import settings
+
+class ProviderClientRegistry:
+    """
+    Process-wide registry of LLM provider clients.
+
+    Clients are created once and reused, so HTTP keep-alive connections and
+    the Gemini gRPC channel survive across chat turns instead of paying a TLS
+    handshake and object construction on every call. The async OpenAI client
+    is bound to the shared LLM event loop in utils.llm_utils and must only be
+    used from it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Any, Any] = {}
+        self._lookups: Dict[str, int] = {}
+        self._created: Dict[str, int] = {}
+        self._requests: Dict[str, int] = {}
+        self._connections: Dict[str, int] = {}
+
+    def _get(self, kind: str, key: Any, factory):
+        with self._lock:
+            self._lookups[kind] = self._lookups.get(kind, 0) + 1
+            client = self._clients.get(key)
+            if client is None:
+                client = factory()
+                self._clients[key] = client
+                self._created[kind] = self._created.get(kind, 0) + 1
+            return client
+
+    def _count(self, counter: Dict[str, int], kind: str):
+        with self._lock:
+            counter[kind] = counter.get(kind, 0) + 1
+
+    def _limits(self) -> httpx.Limits:
+        pool = settings.LLM_HTTP_POOL
+        return httpx.Limits(
+            max_connections=pool['max_connections'],
+            max_keepalive_connections=pool['max_keepalive_connections'],
+            keepalive_expiry=pool['keepalive_expiry'],
+        )
+
+    def _sync_hooks(self, kind: str):
+        """httpx event hooks counting requests and newly opened connections"""
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                self._count(self._connections, kind)
+
+        def on_request(request):
+            self._count(self._requests, kind)
+            request.extensions["trace"] = trace
+
+        return {"request": [on_request]}
+
+    def _async_hooks(self, kind: str):
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                self._count(self._connections, kind)
+
+        async def on_request(request):
+            self._count(self._requests, kind)
+            request.extensions["trace"] = trace
+
+        return {"request": [on_request]}
+
+    def openai_client(self) -> openai.OpenAI:
+        """Shared synchronous OpenAI client (thread-safe)"""
+        return self._get("openai", "openai", lambda: openai.OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=httpx.Client(limits=self._limits(), event_hooks=self._sync_hooks("openai")),
+        ))
+
+    def async_openai_client(self) -> openai.AsyncOpenAI:
+        """Shared AsyncOpenAI client for the LLM event loop"""
+        return self._get("async_openai", "async_openai", lambda: openai.AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(limits=self._limits(), event_hooks=self._async_hooks("async_openai")),
+        ))
+
+    def gemini_model(self, model_name: str, generation_config: Dict[str, Any],
+                     system_instruction: Optional[str] = None) -> genai.GenerativeModel:
+        """Shared Gemini model for a given model name, config and system instruction"""
+        key = ("gemini", model_name, tuple(sorted(generation_config.items())), system_instruction)
+        return self._get("gemini", key, lambda: genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=genai.GenerationConfig(**generation_config),
+            system_instruction=system_instruction,
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool configuration and reuse counters for the status endpoint"""
+        with self._lock:
+            stats = {"pool": dict(settings.LLM_HTTP_POOL), "clients": {}}
+            for kind, lookups in self._lookups.items():
+                created = self._created.get(kind, 0)
+                requests = self._requests.get(kind, 0)
+                connections = self._connections.get(kind, 0)
+                stats["clients"][kind] = {
+                    "instances": created,
+                    "lookups": lookups,
+                    "reused_lookups": lookups - created,
+                    "requests": requests,
+                    "connections_opened": connections,
+                    "connection_reuse_ratio": round(1 - connections / requests, 3) if requests else None,
+                }
+            return stats
+
+# Global instance
+provider_clients = ProviderClientRegistry()
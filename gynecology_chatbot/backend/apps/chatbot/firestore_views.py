@@ -2,11 +2,35 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
-from utils.firestore_client import firestore_client
-from utils.llm_utils import generate_ai_responses
+from utils.firestore_client import firestore_client, get_async_firestore_client
+from utils.llm_utils import generate_ai_responses, stream_ai_response, evaluate_responses_sync, run_sync
+from utils.context_window import prepare_context
+from utils.chat_history import load_firestore_history, history_cache
+from utils.rate_limit import RateLimitExceeded
+from utils.severity import score_severity_locally
+from utils.triage import record_patient_query
+from .streaming import ndjson_response
+from utils.turn_registry import TurnCancelled, TURN_CANCELLED_STATUS
+from .jobs import enqueue_firestore_turn, chat_job_accepted, idempotent_turn, track_turn
 from django.conf import settings
 import uuid
 from datetime import datetime
+import asyncio
+import concurrent.futures
+
+async def _message_counts(conversation_ids):
+    """Message count of each conversation, counted concurrently"""
+    client = get_async_firestore_client()
+    counts = await asyncio.gather(*(
+        client.count_documents('messages', filters=[('conversation_id', '==', conversation_id)])
+        for conversation_id in conversation_ids
+    ))
+    return dict(zip(conversation_ids, counts))
+
+async def _delete_messages(message_ids):
+    """Delete messages concurrently"""
+    client = get_async_firestore_client()
+    await asyncio.gather(*(client.delete_document('messages', message_id) for message_id in message_ids))
 
 @api_view(['GET', 'POST'])
 @permission_classes([AllowAny])  # For testing, make it open
@@ -27,20 +51,24 @@ def firestore_conversations(request):
             limit=50
         )
         
+        # Count every conversation's messages at once on the shared event loop
+        try:
+            message_counts = run_sync(
+                _message_counts([conv['id'] for conv in conversations]),
+                timeout=settings.FIRESTORE_SETTINGS['batch_timeout']
+            )
+        except concurrent.futures.TimeoutError:
+            return Response({'error': 'Timed out loading conversations. Please try again.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
         conversation_data = []
         for conv in conversations:
-            # Get message count for this conversation
-            messages = firestore_client.query_collection(
-                'messages',
-                filters=[('conversation_id', '==', conv['id'])]
-            )
-            
             conversation_data.append({
                 'id': conv['id'],
                 'title': conv.get('title', 'New Conversation'),
                 'created_at': conv.get('created_at'),
                 'updated_at': conv.get('updated_at'),
-                'message_count': len(messages)
+                'message_count': message_counts[conv['id']]
             })
         
         return Response(conversation_data)
@@ -112,66 +140,87 @@ def firestore_conversation_detail(request, conversation_id):
             filters=[('conversation_id', '==', conversation_id)]
         )
         
-        for message in messages:
-            firestore_client.delete_document('messages', message['id'])
+        try:
+            run_sync(
+                _delete_messages([message['id'] for message in messages]),
+                timeout=settings.FIRESTORE_SETTINGS['batch_timeout']
+            )
+            cleared = True
+        except concurrent.futures.TimeoutError:
+            cleared = False
         
+        # A new history version makes every worker rebuild its cached history,
+        # also after a partial clear
+        firestore_client.update_document('conversations', conversation_id, {
+            'summary': '',
+            'summary_message_count': 0,
+            'history_version': str(uuid.uuid4())
+        })
+        history_cache.invalidate(f"firestore:{conversation_id}")
+        
+        if not cleared:
+            return Response({'error': 'Timed out clearing the conversation. Please try again.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
         return Response({'message': 'Conversation cleared successfully'})
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def firestore_send_message(request, conversation_id):
-    """Send message and get AI response using Firestore"""
-    if request.user.is_authenticated:
-        user_id = str(request.user.id)
-    else:
-        user_id = "2"  # guest user
+def _conversation_context(conversation_id, conversation, user_message):
+    """History for the LLM providers: the rolling summary plus the recent messages."""
+    history = load_firestore_history(conversation_id, conversation)
+    base_count = conversation.get('summary_message_count', 0)
     
-    # Verify conversation exists
-    conversation = firestore_client.get_document('conversations', conversation_id)
-    if not conversation or conversation.get('user_id') != user_id:
-        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
-    
-    user_message = request.data.get('message', '').strip()
-    if not user_message:
-        return Response({'error': 'Message content is required'}, status=status.HTTP_400_BAD_REQUEST)
+    def save_summary(summary, summarized_count):
+        # Skip the write if another refresh or a clear changed the summary meanwhile
+        current = firestore_client.get_document('conversations', conversation_id)
+        if current and current.get('summary_message_count', 0) == base_count:
+            firestore_client.update_document('conversations', conversation_id, {
+                'summary': summary,
+                'summary_message_count': summarized_count,
+                'summary_updated_at': datetime.now()
+            })
     
+    return prepare_context(
+        f"firestore:{conversation_id}", history, user_message,
+        conversation.get('summary', ''), base_count, save_summary
+    )
+
+def _discard_user_message(conversation_id, message_id):
+    """Drop a user message whose turn failed or was rate limited so a retry starts clean"""
+    firestore_client.delete_document('messages', message_id)
+    history_cache.invalidate(f"firestore:{conversation_id}")
+
+def _turn_severity(conversation_id, user_id, user_message, model_name, content):
+    """Score the answer locally and queue it for the doctor triage queue; None for fallback apologies"""
+    if model_name == 'system':
+        return None
+    severity = score_severity_locally(content)
+    record_patient_query('firestore', user_id, conversation_id, user_message, content, severity)
+    return severity
+
+def complete_firestore_turn(conversation_id, conversation, user_message, user_msg_id, user, turn=None):
+    """
+    Generate and save the AI response to a saved user message.
+    Returns (response data, HTTP status); used by the send view and by chat jobs.
+    If turn is cancelled the response is discarded.
+    """
     try:
-        # Save user message
-        user_msg_data = {
-            'conversation_id': conversation_id,
-            'content': user_message,
-            'message_type': 'user'
-        }
-        user_msg_id = firestore_client.create_document('messages', user_msg_data)
-        
-        # Get conversation history for AI context (simplified for now)
-        messages = firestore_client.query_collection(
-            'messages',
-            filters=[('conversation_id', '==', conversation_id)],
-            order_by='created_at'
-        )
-        
-        # Convert messages to expected format for LLM
-        message_history = []
-        for msg in messages:
-            class MockMessage:
-                def __init__(self, content, message_type, model_name=None):
-                    self.content = content
-                    self.message_type = message_type
-                    self.model_name = model_name
-            
-            message_history.append(MockMessage(
-                msg.get('content', ''),
-                msg.get('message_type', 'user'),
-                msg.get('model_name', '')
-            ))
+        # Get conversation history for AI context
+        context = _conversation_context(conversation_id, conversation, user_message)
         
         # Generate AI responses
-        response_data = generate_ai_responses(user_message, message_history)
+        response_data = generate_ai_responses(user_message, context, user=user, turn=turn)
+        if response_data.get("rate_limited"):
+            _discard_user_message(conversation_id, user_msg_id)
+            return {
+                'error': 'The AI service is busy right now. Please try again shortly.',
+                'retry_after': response_data["rate_limited"]["retry_after"]
+            }, status.HTTP_429_TOO_MANY_REQUESTS
         
         best_model = response_data["best_model"]
         best_response = response_data["best_response"]
         explanation = response_data["explanation"]
+        if turn is not None:
+            turn.check()
+        severity = _turn_severity(conversation_id, conversation.get('user_id'), user_message, best_model, best_response)
         
         # Save AI response
         ai_msg_data = {
@@ -182,7 +231,9 @@ def firestore_send_message(request, conversation_id):
             'metadata': {
                 "explanation": explanation,
                 "evaluated": True,
-                "all_responses": response_data.get("all_responses", {})
+                "all_responses": response_data.get("all_responses", {}),
+                "timing": response_data.get("timing", {}),
+                "severity": severity
             }
         }
         ai_msg_id = firestore_client.create_document('messages', ai_msg_data)
@@ -192,17 +243,166 @@ def firestore_send_message(request, conversation_id):
             'updated_at': datetime.now()
         })
         
-        return Response({
+        return {
             "message_id": ai_msg_id,
             "content": best_response,
             "model_name": best_model,
-            "explanation": explanation
-        })
+            "explanation": explanation,
+            "severity": severity
+        }, status.HTTP_200_OK
         
+    except TurnCancelled:
+        return {'error': 'The request was cancelled.', 'cancelled': True}, TURN_CANCELLED_STATUS
     except Exception as e:
-        return Response({
-            'error': f'Error generating AI response: {str(e)}'
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # The idempotency key is released on failure, so a retry would save the message again
+        _discard_user_message(conversation_id, user_msg_id)
+        return {'error': f'Error generating AI response: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def firestore_send_message(request, conversation_id):
+    """
+    Send message and get AI response using Firestore.
+    With ?async=1 a signed-in user's turn is queued instead and 202 with a
+    job id is returned. A repeated Idempotency-Key header returns the stored result.
+    """
+    if request.user.is_authenticated:
+        user_id = str(request.user.id)
+    else:
+        user_id = "2"  # guest user
+    
+    # Verify conversation exists
+    conversation = firestore_client.get_document('conversations', conversation_id)
+    if not conversation or conversation.get('user_id') != user_id:
+        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    user_message = request.data.get('message', '').strip()
+    if not user_message:
+        return Response({'error': 'Message content is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    def handle():
+        try:
+            # Save user message
+            user_msg_data = {
+                'conversation_id': conversation_id,
+                'content': user_message,
+                'message_type': 'user'
+            }
+            user_msg_id = firestore_client.create_document('messages', user_msg_data)
+        except Exception as e:
+            return {'error': f'Error saving message: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+        
+        # Guests cannot poll or cancel jobs, so their turns always run inline
+        if request.user.is_authenticated and request.query_params.get('async') in ('1', 'true', 'True'):
+            job_id = enqueue_firestore_turn(request, conversation_id, user_msg_id, user_message)
+            return chat_job_accepted(request, job_id), status.HTTP_202_ACCEPTED
+        
+        with track_turn(request, user_id) as turn:
+            return complete_firestore_turn(conversation_id, conversation, user_message, user_msg_id, request.user, turn)
+    
+    return idempotent_turn(request, f"firestore:{user_id}", conversation_id, user_message, handle)
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def firestore_stream_message(request, conversation_id):
+    """Send message and stream the AI response as NDJSON events using Firestore"""
+    if request.user.is_authenticated:
+        user_id = str(request.user.id)
+    else:
+        user_id = "2"  # guest user
+    
+    # Verify conversation exists
+    conversation = firestore_client.get_document('conversations', conversation_id)
+    if not conversation or conversation.get('user_id') != user_id:
+        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    user_message = request.data.get('message', '').strip()
+    if not user_message:
+        return Response({'error': 'Message content is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Save user message
+    user_msg_id = firestore_client.create_document('messages', {
+        'conversation_id': conversation_id,
+        'content': user_message,
+        'message_type': 'user'
+    })
+    
+    context = _conversation_context(conversation_id, conversation, user_message)
+    
+    def events():
+        with track_turn(request, user_id) as turn:
+            yield from turn_events(turn)
+    
+    def turn_events(turn):
+        chunks = []
+        model_name = None
+        partial = False
+        cancelled = False
+        
+        try:
+            for model_name, chunk in stream_ai_response(user_message, context, user=request.user, turn=turn):
+                chunks.append(chunk)
+                yield {"type": "token", "content": chunk, "model_name": model_name}
+        except TurnCancelled:
+            # Keep what the user already saw, marked as cut short
+            if not chunks:
+                return
+            partial = cancelled = True
+        except RateLimitExceeded as e:
+            _discard_user_message(conversation_id, user_msg_id)
+            yield {
+                "type": "error",
+                "status": 429,
+                "error": "The AI service is busy right now. Please try again shortly.",
+                "retry_after": e.retry_after
+            }
+            return
+        except Exception as e:
+            print(f"Streaming error: {str(e)}")
+            yield {"type": "error", "error": f"Error generating AI response: {str(e)}"}
+            if not chunks:
+                return
+            partial = True
+        
+        if chunks:
+            content = "".join(chunks)
+            explanation = f"Streamed from {model_name}."
+        else:
+            model_name, content, explanation = evaluate_responses_sync({}, user_message)
+            yield {"type": "token", "content": content, "model_name": model_name}
+        
+        severity = None if partial else _turn_severity(conversation_id, user_id, user_message, model_name, content)
+        
+        # Persist the AI response once the stream completes
+        ai_msg_id = firestore_client.create_document('messages', {
+            'conversation_id': conversation_id,
+            'content': content,
+            'message_type': 'assistant',
+            'model_name': model_name,
+            'metadata': {
+                "explanation": explanation,
+                "evaluated": False,
+                "streamed": True,
+                "partial": partial,
+                "cancelled": cancelled,
+                "severity": severity
+            }
+        })
+        
+        firestore_client.update_document('conversations', conversation_id, {
+            'updated_at': datetime.now()
+        })
+        
+        yield {
+            "type": "done",
+            "message_id": ai_msg_id,
+            "content": content,
+            "model_name": model_name,
+            "explanation": explanation,
+            "severity": severity
+        }
+    
+    return ndjson_response(events())
 
 # Health check for Firestore
 @api_view(['GET'])
@@ -0,0 +1,151 @@
+import math
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from utils.job_queue import get_job_queue, enqueue_job, register_job_handler, JobFailed, DONE, FAILED
+from utils.idempotency import get_idempotency_store, request_fingerprint
+from utils.turn_registry import turn_registry
+
+def turn_response(data, status_code, replayed=False):
+    """Response for a completed chat turn, with Retry-After when it was rate limited"""
+    headers = {}
+    if 'retry_after' in data:
+        headers['Retry-After'] = str(math.ceil(data['retry_after']))
+    if replayed:
+        headers['Idempotent-Replayed'] = 'true'
+    return Response(data, status=status_code, headers=headers or None)
+
+def idempotent_turn(request, scope, conversation_id, user_message, handler):
+    """
+    Run handler() -> (data, status code) and respond. With an Idempotency-Key
+    header a repeated request gets the stored result instead of a second turn.
+    """
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if not idempotency_key:
+        return turn_response(*handler())
+    
+    data, status_code, replayed = get_idempotency_store().run(
+        scope, idempotency_key, request_fingerprint(conversation_id, user_message), handler
+    )
+    return turn_response(data, status_code, replayed)
+
+def track_turn(request, owner):
+    """Register the chat turn under the client's X-Turn-Id header so it can be cancelled"""
+    return turn_registry.track(owner, request.headers.get('X-Turn-Id'))
+
+def chat_job_accepted(request, job_id):
+    """Body of the 202 returned for a queued chat turn"""
+    return {
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': request.build_absolute_uri(f'/api/chatbot/jobs/{job_id}/')
+    }
+
+def enqueue_chat_turn(request, backend, conversation_id, message_id):
+    """Queue generation of the reply to a saved Django user message"""
+    return enqueue_job('chat_turn', {
+        'backend': backend,
+        'conversation_id': conversation_id,
+        'message_id': message_id,
+        'user_id': request.user.id,
+        'turn_id': request.headers.get('X-Turn-Id'),
+    }, owner=str(request.user.id))
+
+def enqueue_firestore_turn(request, conversation_id, message_id, user_message):
+    """Queue generation of the reply to a saved Firestore user message (signed-in users only)"""
+    return enqueue_job('chat_turn', {
+        'backend': 'firestore',
+        'conversation_id': conversation_id,
+        'message_id': message_id,
+        'message': user_message,
+        'user_id': request.user.id,
+        'turn_id': request.headers.get('X-Turn-Id'),
+    }, owner=str(request.user.id))
+
+def _job_user(user_id):
+    if user_id is None:
+        return None
+    return get_user_model().objects.filter(id=user_id).first()
+
+def run_chat_turn(payload):
+    """
+    Job handler: generate and save the reply exactly as send_message would
+    have, registered under the request's X-Turn-Id so cancel_turn reaches it.
+    """
+    user = _job_user(payload.get('user_id'))
+    with turn_registry.track(str(payload.get('user_id')), payload.get('turn_id')) as turn:
+        return _run_chat_turn(payload, user, turn)
+
+def _run_chat_turn(payload, user, turn):
+    if payload['backend'] == 'firestore':
+        from utils.firestore_client import firestore_client
+        from .firestore_views import complete_firestore_turn
+        conversation = firestore_client.get_document('conversations', payload['conversation_id'])
+        if not conversation:
+            raise JobFailed('Conversation not found', {'status_code': 404, 'response': {'error': 'Conversation not found'}})
+        data, status_code = complete_firestore_turn(
+            payload['conversation_id'], conversation, payload['message'], payload['message_id'], user, turn
+        )
+    else:
+        from .models import Message
+        from .views import complete_turn
+        message = Message.objects.select_related('conversation').filter(id=payload['message_id']).first()
+        if message is None:
+            raise JobFailed('Message not found', {'status_code': 404, 'response': {'error': 'Message not found'}})
+        data, status_code = complete_turn(message.conversation, message, user, turn)
+
+    result = {'status_code': status_code, 'response': data}
+    if status_code != status.HTTP_200_OK:
+        raise JobFailed(data.get('error', 'Chat turn failed'), result)
+    return result
+
+register_job_handler('chat_turn', run_chat_turn)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def chat_job_status(request, job_id):
+    """
+    Status of a queued chat turn. With ?wait=<seconds> the request is held
+    until the job finishes (long-poll, capped at MAX_LONG_POLL_SECONDS).
+    """
+    owner = str(request.user.id)
+
+    try:
+        wait = float(request.query_params.get('wait', 0))
+    except ValueError:
+        return Response({'error': 'wait must be a number of seconds'}, status=status.HTTP_400_BAD_REQUEST)
+    wait = max(0.0, min(wait, settings.LLM_JOB_QUEUE['MAX_LONG_POLL_SECONDS']))
+
+    queue = get_job_queue()
+    job = queue.wait(job_id, wait) if wait else queue.get(job_id)
+    if job is None or job['owner'] != owner:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    data = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    }
+    if job['status'] in (DONE, FAILED):
+        result = job['result'] or {}
+        data['status_code'] = result.get('status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
+        data['response'] = result.get('response', {'error': job['error']})
+    return Response(data)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def cancel_turn(request, turn_id):
+    """
+    Cancel a running chat turn sent with this X-Turn-Id: its outstanding
+    provider calls are stopped and the reply is not saved. A cancel that
+    arrives before the turn starts is remembered briefly. Signed-in users
+    only, since guests share one user id and could cancel each other's turns.
+    """
+    running = turn_registry.cancel(str(request.user.id), turn_id)
+    return Response({'turn_id': turn_id, 'status': 'cancelled' if running else 'not_running'})
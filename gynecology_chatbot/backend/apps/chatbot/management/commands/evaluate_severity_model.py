@@ -0,0 +1,79 @@
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from utils.severity import (
+    build_severity_classifier, holdout, llm_severity, labeled_from_django, labeled_from_firestore
+)
+
+class Command(BaseCommand):
+    help = (
+        'Offline evaluation of the local severity classifier against the LLM and doctor scores '
+        'on the rows held out from training'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=['django', 'firestore'],
+            default='firestore' if getattr(settings, 'USE_FIRESTORE', False) else 'django',
+            help='Where to read scored patient queries from'
+        )
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of rows to read')
+        parser.add_argument('--holdout', type=float, default=settings.LLM_SEVERITY['HOLDOUT'],
+                            help='Must match the fraction used for training')
+        parser.add_argument('--model', default=settings.LLM_SEVERITY['MODEL_PATH'], help='Model file to evaluate')
+        parser.add_argument('--threshold', type=float, default=settings.LLM_SEVERITY['CONFIDENCE_THRESHOLD'],
+                            help='Confidence below which a response would be escalated')
+        parser.add_argument('--rescore', type=int, default=0,
+                            help='Score this many held-out rows with the LLM now instead of using the stored score')
+    
+    def handle(self, *args, **options):
+        classifier = build_severity_classifier()
+        try:
+            classifier.load(options['model'])
+        except FileNotFoundError:
+            self.stdout.write(f"No model at {options['model']}; evaluating the phrase rules only")
+        
+        if options['source'] == 'firestore':
+            rows = labeled_from_firestore(options['limit'])
+        else:
+            rows = labeled_from_django(options['limit'])
+        rows = [(row_id, text, score) for row_id, text, score in rows if holdout(row_id, options['holdout'])]
+        if not rows:
+            raise CommandError('No held-out scored patient queries to evaluate')
+        
+        if options['rescore']:
+            rescored = []
+            for row_id, text, _ in rows[:options['rescore']]:
+                score = llm_severity(text)
+                if score is not None:
+                    rescored.append((row_id, text, score))
+            rows = rescored
+        
+        results = []
+        started = time.perf_counter()
+        for _, text, llm_score in rows:
+            score, confidence, method = classifier.predict(text)
+            results.append((score, confidence, method, llm_score))
+        per_row_us = (time.perf_counter() - started) / len(rows) * 1e6
+        
+        def report(label, subset):
+            if not subset:
+                self.stdout.write(f"{label}: no rows")
+                return
+            exact = sum(1 for score, _, _, llm in subset if score == llm) / len(subset)
+            within_one = sum(1 for score, _, _, llm in subset if abs(score - llm) <= 1) / len(subset)
+            booking = sum(1 for score, _, _, llm in subset if (score >= 4) == (llm >= 4)) / len(subset)
+            mae = sum(abs(score - llm) for score, _, _, llm in subset) / len(subset)
+            self.stdout.write(
+                f"{label}: {len(subset)} rows, exact {exact:.1%}, within one {within_one:.1%}, "
+                f"booking decision {booking:.1%}, mean abs error {mae:.2f}"
+            )
+        
+        confident = [result for result in results if result[1] >= options['threshold']]
+        self.stdout.write(f"Evaluated {len(rows)} held-out responses, {per_row_us:.0f}us per response")
+        report("All responses", results)
+        report(f"Confidence >= {options['threshold']}", confident)
+        self.stdout.write(f"Would escalate to the LLM: {1 - len(confident) / len(results):.1%}")
+        self.stdout.write(f"Methods: {dict(Counter(result[2] for result in results))}")
@@ -0,0 +1,155 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+SAMPLE_QUESTIONS = [
+    "What can cause irregular periods",
+    "Is it normal to have cramps between periods",
+    "What are the early signs of pregnancy",
+    "How often should I get a pap smear",
+    "What helps with heavy menstrual bleeding",
+    "Can stress delay my period",
+    "What are common symptoms of PCOS",
+    "Is spotting after intercourse something to worry about",
+]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the LLM chat path at a given concurrency, using the mock providers by default. '
+        'With --record the provider traffic is saved to a cassette that --replay serves back offline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Number of chat turns to run')
+        parser.add_argument('--concurrency', type=int, default=20, help='Turns in flight at once')
+        parser.add_argument('--mode', choices=['all', 'race'], default=settings.LLM_RESPONSE_MODE)
+        parser.add_argument('--stream', action='store_true', help='Use the streaming path instead')
+        parser.add_argument('--preferred', default=None,
+                            help='Simulate a user with model comparison off and this preferred model')
+        parser.add_argument('--seed', type=int, default=None, help='Mock provider seed')
+        parser.add_argument('--real', action='store_true', help='Call the configured providers instead of mocks')
+        parser.add_argument('--with-cache', action='store_true', help='Keep the response caches enabled')
+        parser.add_argument('--record', metavar='PATH', default=None, help='Record provider traffic to this cassette')
+        parser.add_argument('--replay', metavar='PATH', default=None, help='Replay provider traffic from this cassette')
+        parser.add_argument('--latency-scale', type=float, default=1.0,
+                            help='Multiplier for replayed timings (0 replays without delays)')
+        parser.add_argument('--max-p95-ms', type=float, default=None,
+                            help='Fail when the p95 turn latency is above this, e.g. as a regression check')
+
+    def handle(self, *args, **options):
+        from apps.chatbot.providers import provider_registry, use_mock_providers
+        from apps.chatbot.cassettes import use_cassette
+
+        if options['record'] and options['replay']:
+            raise CommandError('Use either --record or --replay')
+        if not options['real']:
+            use_mock_providers(provider_registry, options['seed'])
+
+        cassette = None
+        if options['record']:
+            cassette = use_cassette(provider_registry, options['record'], 'record')
+        elif options['replay']:
+            try:
+                cassette = use_cassette(provider_registry, options['replay'], 'replay', options['latency_scale'])
+            except FileNotFoundError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"Replaying {len(cassette)} recorded provider interactions")
+
+        overrides = {
+            # Keep load-test samples out of the persisted routing statistics
+            'LLM_ADAPTIVE_ROUTING': {**settings.LLM_ADAPTIVE_ROUTING, 'STATS_PATH': None},
+        }
+        if not options['with_cache']:
+            overrides['LLM_RESPONSE_CACHE'] = {**settings.LLM_RESPONSE_CACHE, 'ENABLED': False}
+            overrides['LLM_SEMANTIC_CACHE'] = {**settings.LLM_SEMANTIC_CACHE, 'ENABLED': False}
+
+        with override_settings(**overrides):
+            p95 = self._run(options, provider_registry)
+
+        if cassette:
+            cassette.flush()
+            self.stdout.write(f"Cassette: {cassette.stats()}")
+        if options['max_p95_ms'] is not None and p95 * 1000 > options['max_p95_ms']:
+            raise CommandError(f"p95 turn latency {p95 * 1000:.0f}ms is above {options['max_p95_ms']:.0f}ms")
+
+    def _run(self, options, provider_registry):
+        from utils.llm_utils import generate_ai_responses, stream_ai_response
+        from utils.circuit_breaker import circuit_breakers
+
+        user = None
+        if options['preferred']:
+            user = SimpleNamespace(
+                is_authenticated=True, show_all_models=False, preferred_model=options['preferred']
+            )
+
+        def one_turn(index):
+            message = f"{SAMPLE_QUESTIONS[index % len(SAMPLE_QUESTIONS)]}? (load test {index})"
+            started = time.monotonic()
+
+            if options['stream']:
+                first_chunk = None
+                model_name = "system"
+                for model_name, chunk in stream_ai_response(message, [], user=user):
+                    if first_chunk is None:
+                        first_chunk = time.monotonic() - started
+                return {
+                    "seconds": time.monotonic() - started,
+                    "first_chunk": first_chunk,
+                    "model": model_name if first_chunk is not None else "system",
+                    "step": "stream",
+                }
+
+            result = generate_ai_responses(message, [], mode=options['mode'], user=user)
+            return {
+                "seconds": time.monotonic() - started,
+                "first_chunk": None,
+                "model": result["best_model"],
+                "step": result["timing"]["step"],
+            }
+
+        providers = ", ".join(
+            f"{name} ({info['kind']})" for name, info in provider_registry.snapshot().items()
+        )
+        self.stdout.write(
+            f"Running {options['requests']} turns at concurrency {options['concurrency']} "
+            f"against {providers}"
+        )
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(one_turn, range(options['requests'])))
+        wall_seconds = time.monotonic() - started
+
+        latencies = [result["seconds"] for result in results]
+        failures = sum(1 for result in results if result["model"] == "system")
+        self.stdout.write(f"Wall time: {wall_seconds:.2f}s, throughput {len(results) / wall_seconds:.1f} turns/s")
+        self.stdout.write(
+            "Turn latency: p50 {:.0f}ms, p95 {:.0f}ms, p99 {:.0f}ms, max {:.0f}ms".format(
+                *(percentile(latencies, pct) * 1000 for pct in (50, 95, 99, 100))
+            )
+        )
+        first_chunks = [result["first_chunk"] for result in results if result["first_chunk"] is not None]
+        if first_chunks:
+            self.stdout.write(
+                "Time to first chunk: p50 {:.0f}ms, p95 {:.0f}ms".format(
+                    percentile(first_chunks, 50) * 1000, percentile(first_chunks, 95) * 1000
+                )
+            )
+        self.stdout.write(f"Failed turns: {failures} ({failures / len(results):.1%})")
+        self.stdout.write(f"Answered by: {dict(Counter(result['model'] for result in results))}")
+        self.stdout.write(f"Steps: {dict(Counter(result['step'] for result in results))}")
+        self.stdout.write(
+            f"Circuit breakers: { {name: snap['state'] for name, snap in circuit_breakers.snapshot().items()} }"
+        )
+        return percentile(latencies, 95)
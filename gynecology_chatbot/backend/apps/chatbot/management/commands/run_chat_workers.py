@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from utils.job_queue import JobQueue, JobWorkerPool
+import apps.chatbot.jobs  # noqa: F401 registers the chat_turn handler
+
+class Command(BaseCommand):
+    help = 'Run worker threads for chat turns queued with ?async=1'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.LLM_JOB_QUEUE['WORKERS'], help='Number of worker threads')
+    
+    def handle(self, *args, **options):
+        pool = JobWorkerPool(JobQueue(settings.LLM_JOB_QUEUE['PATH']), options['workers'])
+        pool.start()
+        self.stdout.write(self.style.SUCCESS(
+            f"Running {options['workers']} chat workers on {settings.LLM_JOB_QUEUE['PATH']}"
+        ))
+        
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping chat workers after their current jobs")
+            pool.stop()
+            pool.join()
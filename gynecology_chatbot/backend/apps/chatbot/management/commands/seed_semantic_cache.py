@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from utils.semantic_cache import build_semantic_cache, seed_from_django, seed_from_firestore
+
+class Command(BaseCommand):
+    help = 'Build the semantic answer cache index from evaluated first-turn answers'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=['django', 'firestore'],
+            default='firestore' if getattr(settings, 'USE_FIRESTORE', False) else 'django',
+            help='Where to read stored conversations from'
+        )
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of entries to index')
+        parser.add_argument('--output', default=settings.LLM_SEMANTIC_CACHE['PATH'], help='Index file to write')
+    
+    def handle(self, *args, **options):
+        cache = build_semantic_cache()
+        
+        if options['source'] == 'firestore':
+            seeded = seed_from_firestore(cache, options['limit'])
+        else:
+            seeded = seed_from_django(cache, options['limit'])
+        
+        cache.index.save(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {seeded} first-turn answers into {options['output']}"
+        ))
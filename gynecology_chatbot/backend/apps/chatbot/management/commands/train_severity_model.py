@@ -0,0 +1,40 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from utils.severity import build_severity_classifier, holdout, labeled_from_django, labeled_from_firestore
+
+class Command(BaseCommand):
+    help = 'Train the local severity classifier from LLM-scored and doctor-reviewed patient queries'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=['django', 'firestore'],
+            default='firestore' if getattr(settings, 'USE_FIRESTORE', False) else 'django',
+            help='Where to read scored patient queries from'
+        )
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of rows to read')
+        parser.add_argument('--holdout', type=float, default=settings.LLM_SEVERITY['HOLDOUT'],
+                            help='Fraction of rows kept out of training for evaluate_severity_model')
+        parser.add_argument('--epochs', type=int, default=60)
+        parser.add_argument('--output', default=settings.LLM_SEVERITY['MODEL_PATH'], help='Model file to write')
+    
+    def handle(self, *args, **options):
+        if options['source'] == 'firestore':
+            rows = labeled_from_firestore(options['limit'])
+        else:
+            rows = labeled_from_django(options['limit'])
+        
+        training = [(text, score) for row_id, text, score in rows if not holdout(row_id, options['holdout'])]
+        if not training:
+            raise CommandError('No LLM-scored or doctor-reviewed patient queries to train on')
+        
+        classifier = build_severity_classifier()
+        started = time.monotonic()
+        classifier.fit([text for text, _ in training], [score for _, score in training], epochs=options['epochs'])
+        classifier.save(options['output'])
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained on {len(training)} of {len(rows)} scored responses in "
+            f"{time.monotonic() - started:.1f}s, saved to {options['output']}"
+        ))
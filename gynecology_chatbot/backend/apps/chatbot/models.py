@@ -14,6 +14,12 @@ class Conversation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Rolling summary of the oldest summary_message_count messages, sent to
+    # the LLM providers in place of those messages
+    summary = models.TextField(blank=True, default="")
+    summary_message_count = models.PositiveIntegerField(default=0)
+    summary_updated_at = models.DateTimeField(null=True, blank=True)
+    
     def __str__(self):
         return f"{self.title} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
 
@@ -0,0 +1,219 @@
+import asyncio
+import itertools
+import random
+import threading
+from typing import Dict, List, Any, Callable, Awaitable, Optional, AsyncIterator
+from django.conf import settings
+from .api import (
+    get_openai_response, get_gemini_response,
+    stream_openai_response, stream_gemini_response
+)
+
+class ProviderAdapter:
+    """
+    Interface every LLM provider implements.
+
+    call returns the full response text; text starting with "Error" counts as
+    a failure. stream is an async generator of text chunks and raises on
+    failure. health is used by the circuit breaker probes. simulated
+    adapters answer without a real model; their text must never be stored
+    as a summary or a severity score.
+    """
+
+    name = ""
+    kind = "base"
+    simulated = False
+
+    async def call(self, user_message: str, chat_history: List[Any],
+                   timeout: Optional[float] = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, user_message: str, chat_history: List[Any],
+               timeout: Optional[float] = None) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    async def health(self, timeout: Optional[float] = None) -> bool:
+        response = await self.call(settings.LLM_CIRCUIT_BREAKER['PROBE_MESSAGE'], [], timeout)
+        return bool(response) and not response.startswith("Error")
+
+    def describe(self) -> Dict[str, Any]:
+        return {"kind": self.kind}
+
+class FunctionProvider(ProviderAdapter):
+    """Adapter over a pair of call/stream functions such as those in apps.chatbot.api."""
+
+    kind = "api"
+
+    def __init__(self, name: str,
+                 call: Callable[[str, List[Any], Optional[float]], Awaitable[str]],
+                 stream: Callable[..., AsyncIterator[str]]):
+        self.name = name
+        self._call = call
+        self._stream = stream
+
+    async def call(self, user_message, chat_history, timeout=None):
+        return await self._call(user_message, chat_history, timeout)
+
+    def stream(self, user_message, chat_history, timeout=None):
+        return self._stream(user_message, chat_history, timeout)
+
+MOCK_FILLER = (
+    "Many gynecological symptoms have common and treatable causes. Keep a note of "
+    "when they started, how often they happen and anything that makes them better "
+    "or worse, and please consult a healthcare provider for a proper evaluation."
+).split(" ")
+
+class MockProvider(ProviderAdapter):
+    """
+    Deterministic local provider for offline development and load testing.
+
+    Each call draws its time to first token from the LATENCY distribution,
+    fails with probability ERROR_RATE (or hangs until its deadline with
+    probability TIMEOUT_RATE) and emits RESPONSE_TOKENS words at
+    TOKENS_PER_SECOND. Draws come from a generator seeded with the seed,
+    provider name and call number, so a run replays identically.
+
+    LATENCY is one of ('fixed', s), ('uniform', low, high),
+    ('normal', mean, sd) or ('lognormal', median, sigma), in seconds.
+    """
+
+    kind = "mock"
+    simulated = True
+
+    def __init__(self, name: str, profile: Dict[str, Any], seed: int = 0):
+        self.name = name
+        self.profile = profile
+        self.seed = seed
+        self._calls = itertools.count()
+
+    def _rng(self) -> random.Random:
+        return random.Random(f"{self.seed}:{self.name}:{next(self._calls)}")
+
+    def _latency(self, rng: random.Random) -> float:
+        distribution, *params = self.profile.get('LATENCY', ('fixed', 0.5))
+        if distribution == 'fixed':
+            return params[0]
+        if distribution == 'uniform':
+            return rng.uniform(*params)
+        if distribution == 'normal':
+            return max(0.0, rng.gauss(*params))
+        if distribution == 'lognormal':
+            median, sigma = params
+            return rng.lognormvariate(0.0, sigma) * median
+        raise ValueError(f"Unknown mock latency distribution: {distribution}")
+
+    def _text(self, user_message: str) -> str:
+        template = self.profile.get('TEMPLATE')
+        if template:
+            return template.format(message=user_message[:30], name=self.name)
+
+        count = self.profile.get('RESPONSE_TOKENS', 80)
+        words = [f"[mock {self.name}]"]
+        words += [MOCK_FILLER[i % len(MOCK_FILLER)] for i in range(count - 1)]
+        return " ".join(words)
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.profile.get('TOKENS_PER_SECOND', 50)
+
+    async def _wait_first_token(self, rng: random.Random, timeout: Optional[float]):
+        """Sleep the drawn latency; raise for a simulated error or timeout."""
+        roll = rng.random()
+        latency = self._latency(rng)
+        if roll < self.profile.get('TIMEOUT_RATE', 0.0):
+            await asyncio.sleep(timeout or settings.LLM_PROVIDER_TIMEOUT)
+            raise asyncio.TimeoutError(f"Mock {self.name} timed out")
+
+        await asyncio.sleep(latency)
+        if roll < self.profile.get('TIMEOUT_RATE', 0.0) + self.profile.get('ERROR_RATE', 0.0):
+            raise RuntimeError(f"Mock {self.name} simulated provider error")
+
+    async def call(self, user_message, chat_history, timeout=None):
+        rng = self._rng()
+        try:
+            await self._wait_first_token(rng, timeout)
+        except (RuntimeError, asyncio.TimeoutError) as e:
+            return f"Error generating response from {self.name}: {str(e)}"
+
+        text = self._text(user_message)
+        await asyncio.sleep(len(text.split(" ")) * self._token_delay())
+        return text
+
+    async def stream(self, user_message, chat_history, timeout=None):
+        rng = self._rng()
+        await self._wait_first_token(rng, timeout)
+
+        delay = self._token_delay()
+        for index, word in enumerate(self._text(user_message).split(" ")):
+            yield word if index == 0 else " " + word
+            await asyncio.sleep(delay)
+
+    async def health(self, timeout=None):
+        rng = self._rng()
+        try:
+            await self._wait_first_token(rng, timeout)
+        except (RuntimeError, asyncio.TimeoutError):
+            return False
+        return True
+
+    def describe(self):
+        return {"kind": self.kind, "seed": self.seed, "profile": dict(self.profile)}
+
+class ProviderRegistry:
+    """Provider adapters by name, in registration order."""
+
+    def __init__(self):
+        self._adapters: Dict[str, ProviderAdapter] = {}
+        self._lock = threading.Lock()
+
+    def register(self, adapter: ProviderAdapter):
+        """Register an adapter, replacing any existing one with the same name."""
+        with self._lock:
+            self._adapters[adapter.name] = adapter
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._adapters.pop(name, None)
+
+    def get(self, name: str) -> ProviderAdapter:
+        return self._adapters[name]
+
+    def names(self) -> List[str]:
+        return list(self._adapters)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._adapters
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: adapter.describe() for name, adapter in self._adapters.items()}
+
+def mock_provider(name: str, seed: Optional[int] = None) -> MockProvider:
+    """Mock adapter for name using its LLM_MOCK_PROFILES entry."""
+    profile = settings.LLM_MOCK_PROFILES.get(name, {})
+    return MockProvider(name, profile, settings.LLM_MOCK_SEED if seed is None else seed)
+
+def use_mock_providers(registry: "ProviderRegistry", seed: Optional[int] = None):
+    """Replace every registered provider with its mock, e.g. for a load test."""
+    for name in registry.names():
+        registry.register(mock_provider(name, seed))
+
+def build_provider_registry() -> ProviderRegistry:
+    registry = ProviderRegistry()
+    registry.register(FunctionProvider("openai", get_openai_response, stream_openai_response))
+    registry.register(FunctionProvider("gemini", get_gemini_response, stream_gemini_response))
+    # There is no Grok client yet; it is served by its mock profile
+    registry.register(mock_provider("grok"))
+
+    if settings.LLM_MOCK_PROVIDERS:
+        print("LLM_MOCK_PROVIDERS is on: all LLM providers are served by local mocks")
+        use_mock_providers(registry)
+
+    cassette = settings.LLM_CASSETTE
+    if cassette['MODE']:
+        from .cassettes import use_cassette
+        print(f"LLM providers are wrapped by a cassette: {cassette['MODE']} {cassette['PATH']}")
+        use_cassette(registry, cassette['PATH'], cassette['MODE'], cassette['LATENCY_SCALE'], cassette['PASSTHROUGH'])
+    return registry
+
+# Global instance
+provider_registry = build_provider_registry()
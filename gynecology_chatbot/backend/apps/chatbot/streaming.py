@@ -0,0 +1,18 @@
+import json
+from django.http import StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+
+def ndjson_event(event):
+    """Encode one streaming event as a newline-delimited JSON line"""
+    return json.dumps(event, cls=DjangoJSONEncoder) + "\n"
+
+def ndjson_response(events):
+    """Wrap an iterator of event dicts in an unbuffered NDJSON streaming response"""
+    response = StreamingHttpResponse(
+        (ndjson_event(event) for event in events),
+        content_type='application/x-ndjson'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies (nginx) from buffering the token stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,480 @@
+import asyncio
+import threading
+import time
+import uuid
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from apps.chatbot.providers import provider_registry, FunctionProvider, MockProvider
+from utils.chat_history import HistoryEntry
+from utils.circuit_breaker import circuit_breakers
+from utils.semantic_cache import SemanticCache, SemanticIndex, guard_terms
+
+
+def function_provider(name, text=None, error="Error: provider down", latency=0.0):
+    """Provider answering text after latency seconds, or the error reply when text is None."""
+    async def call(user_message, chat_history, timeout=None):
+        await asyncio.sleep(latency)
+        return text if text is not None else error
+
+    async def stream(user_message, chat_history, timeout=None):
+        if text is None:
+            raise RuntimeError(error)
+        yield text
+
+    return FunctionProvider(name, call, stream)
+
+
+def mock_provider(name, latency=0.0, **profile):
+    return MockProvider(name, {'LATENCY': ('fixed', latency), 'RESPONSE_TOKENS': 5,
+                               'TOKENS_PER_SECOND': 10000, **profile})
+
+
+class ProviderTestCase(SimpleTestCase):
+    """Runs each test against its own provider adapters, restoring the registry afterwards."""
+
+    providers = ()
+
+    def setUp(self):
+        from utils import provider_router
+
+        # Keep mock latencies out of the persisted routing statistics, as load_test_llm does
+        routing = override_settings(LLM_ADAPTIVE_ROUTING={**settings.LLM_ADAPTIVE_ROUTING, 'STATS_PATH': None})
+        routing.enable()
+        self.addCleanup(routing.disable)
+        saved_router, provider_router._router = provider_router._router, None
+        self.addCleanup(setattr, provider_router, '_router', saved_router)
+
+        self._saved_adapters = [provider_registry.get(name) for name in provider_registry.names()]
+        for name in provider_registry.names():
+            provider_registry.unregister(name)
+        for adapter in self.providers_for_test():
+            provider_registry.register(adapter)
+        circuit_breakers._breakers.clear()
+
+    def tearDown(self):
+        for name in provider_registry.names():
+            provider_registry.unregister(name)
+        for adapter in self._saved_adapters:
+            provider_registry.register(adapter)
+        circuit_breakers._breakers.clear()
+
+    def providers_for_test(self):
+        return list(self.providers)
+
+
+class SemanticCacheTests(SimpleTestCase):
+    """Seeded answers are reused only for true paraphrases."""
+
+    def setUp(self):
+        self.cache = SemanticCache(threshold=0.97, max_entries=100, n_features=4096)
+        self.cache.remember("Is it normal to bleed during pregnancy?", {"best_model": "gemini", "best_response": "A"})
+        self.cache.remember("Is it normal to have pain during periods?", {"best_model": "gemini", "best_response": "B"})
+
+    def test_paraphrase_hits(self):
+        match = self.cache.lookup("is it normal to bleed during pregnancy", [])
+        self.assertIsNotNone(match)
+        self.assertEqual(match["best_response"], "A")
+
+    def test_negated_question_misses(self):
+        question = "Is it normal to not bleed during pregnancy?"
+        # Similar enough for the vectorizer alone to call it a duplicate
+        similarity = float(
+            self.cache.vectorizer.transform(question.lower())
+            @ self.cache.vectorizer.transform("is it normal to bleed during pregnancy?")
+        )
+        self.assertGreater(similarity, 0.85)
+        self.assertIsNone(self.cache.lookup(question, []))
+        self.assertIsNone(self.cache.lookup("Isn't it normal to bleed during pregnancy?", []))
+
+    def test_different_clinical_term_misses(self):
+        self.assertIsNone(self.cache.lookup("Is it normal to have pain during pregnancy?", []))
+        self.assertIsNone(self.cache.lookup("Is it normal to have cramps during periods?", []))
+
+    def test_follow_up_question_is_not_looked_up(self):
+        history = [HistoryEntry(1, "user", "Hi"), HistoryEntry(2, "assistant", "Hello")]
+        self.assertIsNone(self.cache.lookup("Is it normal to bleed during pregnancy?", history))
+
+    def test_guard_terms(self):
+        self.assertEqual(guard_terms("Can I get pregnant without a period?"), frozenset({"neg", "pregnan", "period"}))
+        self.assertEqual(guard_terms("I don't have cramps"), frozenset({"neg", "cramp"}))
+
+
+class SemanticIndexTests(SimpleTestCase):
+
+    def test_grows_lazily_and_evicts_oldest(self):
+        index = SemanticIndex(dimensions=8, max_entries=100)
+        self.assertLess(index._vectors.shape[0], 100)
+
+        small = SemanticIndex(dimensions=8, max_entries=3)
+        for i in range(5):
+            small.add(np.eye(8, dtype=np.float32)[i], {"i": i})
+        self.assertEqual(len(small), 3)
+        score, entry = small.search(np.eye(8, dtype=np.float32)[4])[0]
+        self.assertEqual(entry["i"], 4)
+        self.assertEqual(small.search(np.eye(8, dtype=np.float32)[0])[0][0], 0.0)
+
+
+class RealProviderLadderTests(ProviderTestCase):
+    """Summaries and severity scores are stored, so mock providers must never produce them."""
+
+    def providers_for_test(self):
+        return [function_provider('gemini'), function_provider('openai'), mock_provider('grok', TEMPLATE="7 canned reply")]
+
+    def test_summary_skips_mock_provider(self):
+        from utils.context_window import summarize_messages
+
+        messages = [HistoryEntry(1, "user", "I have cramps"), HistoryEntry(2, "assistant", "Try heat")]
+        self.assertIsNone(summarize_messages("", messages))
+
+    def test_summary_from_real_provider(self):
+        from utils.context_window import summarize_messages
+
+        provider_registry.register(function_provider('openai', "Patient reported cramps."))
+        messages = [HistoryEntry(1, "user", "I have cramps")]
+        self.assertEqual(summarize_messages("", messages), "Patient reported cramps.")
+
+    def test_severity_skips_mock_provider(self):
+        from utils.severity import llm_severity
+
+        self.assertIsNone(llm_severity("Go to the emergency room now."))
+        provider_registry.register(function_provider('gemini', "8"))
+        self.assertEqual(llm_severity("Go to the emergency room now."), 8)
+
+
+class SeverityEndpointTests(SimpleTestCase):
+    """The severity endpoint can reach a paid LLM, so it is closed to anonymous and oversized requests."""
+
+    def setUp(self):
+        from rest_framework.test import APIRequestFactory
+
+        self.factory = APIRequestFactory()
+
+    def _post(self, text, user=None):
+        from rest_framework.test import force_authenticate
+        from apps.chatbot.views import severity_assessment
+
+        request = self.factory.post('/api/chatbot/severity/', {'text': text}, format='json')
+        if user is not None:
+            force_authenticate(request, user=user)
+        return severity_assessment(request)
+
+    def test_requires_authentication(self):
+        self.assertIn(self._post("Mild cramps are common.").status_code, (401, 403))
+
+    def test_rejects_oversized_text(self):
+        from django.contrib.auth import get_user_model
+
+        user = get_user_model()(id=1)
+        text = "x" * (settings.LLM_SEVERITY['MAX_TEXT_CHARS'] + 1)
+        self.assertEqual(self._post(text, user).status_code, 400)
+
+
+class PatientQueryWriterTests(ProviderTestCase):
+    """Escalations run on their own pool, so one slow provider does not hold up the writer."""
+
+    def providers_for_test(self):
+        async def call(user_message, chat_history, timeout=None):
+            await asyncio.sleep(0.3)
+            return "8" if "Bleeding" in user_message else "2"
+
+        async def stream(user_message, chat_history, timeout=None):
+            yield await call(user_message, chat_history)
+
+        return [FunctionProvider('gemini', call, stream)]
+
+    def setUp(self):
+        super().setUp()
+        from unittest import mock
+        from utils.severity import get_severity_assessor
+
+        # Escalation only starts once a model is trained
+        classifier = get_severity_assessor().classifier
+        trained = mock.patch.object(classifier, 'weights', np.zeros((classifier.vectorizer.n_features, 10)))
+        trained.start()
+        self.addCleanup(trained.stop)
+
+    def test_escalates_concurrently_and_drops_routine_scores(self):
+        from unittest import mock
+        from utils.triage import PatientQueryWriter
+
+        written = []
+        writer = PatientQueryWriter(batch_size=100, flush_interval=3600, min_score=4, escalation_workers=4)
+        uncertain = {"score": 3, "confidence": 0.0, "method": "default"}
+        started = time.monotonic()
+        for text in ("Bleeding 1", "Bleeding 2", "Bleeding 3", "A routine answer"):
+            writer.add({"backend": "django", "patient_id": 1, "conversation_id": 1,
+                        "query_text": "?", "ai_response": text, "severity": dict(uncertain)})
+        with mock.patch('utils.triage._write_django', written.extend):
+            writer.close()
+
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(sorted(record["ai_response"] for record in written), ["Bleeding 1", "Bleeding 2", "Bleeding 3"])
+        self.assertTrue(all(record["severity"]["method"] == "llm" for record in written))
+        self.assertEqual(writer.stats()["written"], 3)
+        self.assertEqual(writer.stats()["escalating"], 0)
+
+
+class SeverityAssessorTests(SimpleTestCase):
+
+    def test_untrained_model_does_not_escalate(self):
+        from utils.severity import SeverityAssessor, SeverityClassifier
+
+        assessor = SeverityAssessor(SeverityClassifier(64), threshold=0.6, escalate=True)
+        assessment = assessor.score_locally("Some general information.")
+        self.assertEqual(assessment["method"], "default")
+        self.assertFalse(assessor.needs_escalation(assessment))
+
+        assessor.classifier.weights = np.zeros((64, 10))
+        self.assertTrue(assessor.needs_escalation(assessment))
+
+
+class AdaptiveRouterTests(SimpleTestCase):
+    """A provider without samples has unknown latency, not zero."""
+
+    def setUp(self):
+        from utils.provider_router import AdaptiveRouter
+
+        circuit_breakers._breakers.clear()
+        self.router = AdaptiveRouter({
+            'ALPHA': 1.0, 'QUALITY': {'openai': 0.9, 'gemini': 0.85}, 'QUALITY_FLOOR': 0.5,
+            'MIN_SUCCESS_RATE': 0.8, 'PREFERENCE_SLACK': 2.0, 'EXPLORE_RATE': 0.0, 'STATS_PATH': None,
+        })
+
+    def test_unmeasured_provider_keeps_preference(self):
+        self.router.observe('gemini', True, 1.0)
+        self.assertEqual(self.router.rank(['openai', 'gemini'], preferred='gemini')[0], 'gemini')
+
+    def test_slow_preference_loses_to_measured_provider(self):
+        self.router.observe('gemini', True, 5.0)
+        self.router.observe('openai', True, 1.0)
+        self.assertEqual(self.router.rank(['openai', 'gemini'], preferred='gemini'), ['openai', 'gemini'])
+
+
+class LlmStatusAccessTests(SimpleTestCase):
+    """The status endpoint shows provider errors, so only staff and monitoring may read it."""
+
+    def _request(self, **headers):
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+
+        request = RequestFactory().get('/api/llm/status/', **headers)
+        request.user = AnonymousUser()
+        return request
+
+    def test_anonymous_is_forbidden(self):
+        from utils.views import llm_status
+
+        self.assertEqual(llm_status(self._request()).status_code, 403)
+
+    def test_status_token(self):
+        from utils.views import _can_view_status
+
+        with override_settings(LLM_STATUS_TOKEN='s3cret'):
+            self.assertTrue(_can_view_status(self._request(HTTP_X_STATUS_TOKEN='s3cret')))
+            self.assertFalse(_can_view_status(self._request(HTTP_X_STATUS_TOKEN='wrong')))
+        with override_settings(LLM_STATUS_TOKEN=''):
+            self.assertFalse(_can_view_status(self._request(HTTP_X_STATUS_TOKEN='')))
+
+
+class RunSyncTests(SimpleTestCase):
+    """Blocking calls onto the shared LLM event loop honour timeouts, deadlines and cancellation."""
+
+    def test_timeout_cancels_coroutine(self):
+        import concurrent.futures
+        from utils.llm_utils import run_sync
+
+        cancelled = threading.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            run_sync(slow(), timeout=0.05)
+        self.assertTrue(cancelled.wait(1))
+
+    def test_cancelled_turn_raises(self):
+        from utils.llm_utils import run_sync
+        from utils.turn_registry import Turn, TurnCancelled
+
+        turn = Turn("t1", "1")
+        threading.Timer(0.05, turn.cancel).start()
+        started = time.monotonic()
+        with self.assertRaises(TurnCancelled):
+            run_sync(asyncio.sleep(5), timeout=2, turn=turn)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_deadline(self):
+        from utils.llm_utils import Deadline
+
+        deadline = Deadline(0.05)
+        self.assertLessEqual(deadline.provider_timeout(), settings.LLM_PROVIDER_TIMEOUT)
+        time.sleep(0.06)
+        self.assertEqual(deadline.remaining(), 0.0)
+        self.assertEqual(deadline.provider_timeout(), 0.0)
+        self.assertEqual(Deadline(1000).provider_timeout(), settings.LLM_PROVIDER_TIMEOUT)
+
+
+class RaceAndLadderTests(ProviderTestCase):
+    """Hedged race and fallback ladder; the mock provider may only answer after every real one failed."""
+
+    def providers_for_test(self):
+        return [
+            function_provider('gemini', "gemini answer", latency=0.3),
+            function_provider('openai', "openai answer"),
+            mock_provider('grok', TEMPLATE="canned answer"),
+        ]
+
+    def test_race_waits_grace_for_preferred_provider(self):
+        from utils.llm_utils import race_responses, run_sync
+
+        responses = run_sync(race_responses("Hi", [], timeout=2, grace=1.0), timeout=3)
+        self.assertEqual(responses["gemini"], "gemini answer")
+
+    def test_race_returns_fallback_after_grace(self):
+        from utils.llm_utils import race_responses, run_sync
+
+        started = time.monotonic()
+        responses = run_sync(race_responses("Hi", [], timeout=2, grace=0.05), timeout=3)
+        self.assertEqual(responses, {"openai": "openai answer"})
+        self.assertLess(time.monotonic() - started, 0.3)
+
+    def test_mock_provider_never_wins_the_race(self):
+        from utils.llm_utils import race_responses, run_sync
+
+        provider_registry.register(function_provider('gemini', "gemini answer", latency=0.2))
+        provider_registry.register(function_provider('openai', "openai answer", latency=0.2))
+        self.assertNotIn("grok", run_sync(race_responses("Hi", [], timeout=2, grace=0.05), timeout=3))
+
+    def test_mock_provider_answers_after_real_providers_fail(self):
+        from utils.llm_utils import race_responses, run_sync
+
+        provider_registry.register(function_provider('gemini'))
+        provider_registry.register(function_provider('openai'))
+        self.assertEqual(run_sync(race_responses("Hi", [], timeout=2), timeout=3), {"grok": "canned answer"})
+
+    def test_ladder_skips_failing_step(self):
+        from utils.llm_utils import Deadline, run_fallback_ladder, run_sync
+
+        provider_registry.register(function_provider('gemini'))
+        responses, step, _ = run_sync(run_fallback_ladder("Hi", [], Deadline(5), ['gemini', 'openai']), timeout=6)
+        self.assertEqual(responses, {"openai": "openai answer"})
+        self.assertEqual(step, 1)
+
+    def test_ladder_stops_when_budget_is_spent(self):
+        from utils.llm_utils import Deadline, run_fallback_ladder, run_sync
+
+        self.assertEqual(run_sync(run_fallback_ladder("Hi", [], Deadline(0), ['openai']), timeout=1), ({}, None, 0.0))
+
+
+class ResponseCacheTests(ProviderTestCase):
+    """A repeated question in the same context is answered from the exact-match cache."""
+
+    def providers_for_test(self):
+        return [function_provider('gemini', "gemini answer"), function_provider('openai', "openai answer")]
+
+    def test_response_cache_hit_and_miss(self):
+        from utils.llm_utils import generate_ai_responses
+
+        question = f"Is spotting normal? {uuid.uuid4().hex}"
+        first = generate_ai_responses(question, [], mode="all")
+        self.assertEqual(first["best_model"], "gemini")
+        self.assertNotIn("cached", first)
+
+        second = generate_ai_responses(question, [], mode="all")
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["best_response"], "gemini answer")
+
+        history = [HistoryEntry(1, "user", "Hi"), HistoryEntry(2, "assistant", "Hello"), HistoryEntry(3, "user", question)]
+        self.assertNotIn("cached", generate_ai_responses(question, history, mode="all"))
+
+    def test_mock_answer_is_not_cached(self):
+        from utils.llm_utils import generate_ai_responses
+
+        provider_registry.unregister('gemini')
+        provider_registry.unregister('openai')
+        provider_registry.register(mock_provider('grok', TEMPLATE="canned answer to {message}"))
+        question = f"Is spotting normal? {uuid.uuid4().hex}"
+        self.assertEqual(generate_ai_responses(question, [], mode="all")["best_model"], "grok")
+        self.assertNotIn("cached", generate_ai_responses(question, [], mode="all"))
+
+
+class IdempotencyTests(SimpleTestCase):
+    """A retried request gets the stored result instead of a second turn."""
+
+    def setUp(self):
+        from utils.idempotency import IdempotencyStore
+
+        self.store = IdempotencyStore('default', ttl=60, pending_ttl=5, wait_seconds=0.2, poll_interval=0.01)
+        self.calls = 0
+        self.key = uuid.uuid4().hex
+
+    def handler(self, status_code=200):
+        def handle():
+            self.calls += 1
+            return {"content": f"answer {self.calls}"}, status_code
+        return handle
+
+    def test_replays_stored_result(self):
+        first = self.store.run("django:1", self.key, "fp", self.handler())
+        second = self.store.run("django:1", self.key, "fp", self.handler())
+        self.assertEqual(first, ({"content": "answer 1"}, 200, False))
+        self.assertEqual(second, ({"content": "answer 1"}, 200, True))
+        self.assertEqual(self.calls, 1)
+
+    def test_key_reused_for_other_request_is_refused(self):
+        self.store.run("django:1", self.key, "fp", self.handler())
+        self.assertEqual(self.store.run("django:1", self.key, "other", self.handler())[1], 422)
+
+    def test_failure_is_not_stored(self):
+        self.store.run("django:1", self.key, "fp", self.handler(status_code=429))
+        data, status_code, replayed = self.store.run("django:1", self.key, "fp", self.handler())
+        self.assertEqual((status_code, replayed, self.calls), (200, False, 2))
+
+
+class TurnRegistryTests(SimpleTestCase):
+
+    def test_cancel_stops_attached_work(self):
+        from utils.llm_utils import get_event_loop
+        from utils.turn_registry import TurnRegistry, TurnCancelled
+
+        registry = TurnRegistry()
+        with registry.track("1", "t1") as turn:
+            future = asyncio.run_coroutine_threadsafe(asyncio.sleep(5), get_event_loop())
+            turn.attach(future)
+            self.assertFalse(registry.cancel("2", "t1"))
+            self.assertTrue(registry.cancel("1", "t1"))
+            self.assertTrue(future.cancelled())
+            with self.assertRaises(TurnCancelled):
+                turn.check()
+        self.assertEqual(registry.stats()["running"], 0)
+
+    def test_cancel_before_start_is_remembered(self):
+        from utils.turn_registry import TurnRegistry
+
+        registry = TurnRegistry()
+        self.assertFalse(registry.cancel("1", "t2"))
+        with registry.track("1", "t2") as turn:
+            self.assertTrue(turn.cancelled)
+        with registry.track("1", "t3") as turn:
+            self.assertFalse(turn.cancelled)
+
+
+class FailedTurnTests(SimpleTestCase):
+    """A failed turn releases its idempotency key, so the saved user message must go too."""
+
+    def test_failed_firestore_turn_discards_user_message(self):
+        from unittest import mock
+        from apps.chatbot import firestore_views
+
+        with mock.patch.object(firestore_views, '_conversation_context', return_value=[]), \
+                mock.patch.object(firestore_views, 'generate_ai_responses', side_effect=RuntimeError("down")), \
+                mock.patch.object(firestore_views, '_discard_user_message') as discard:
+            data, status_code = firestore_views.complete_firestore_turn("c1", {}, "hello", "m1", None)
+
+        self.assertEqual(status_code, 500)
+        discard.assert_called_once_with("c1", "m1")
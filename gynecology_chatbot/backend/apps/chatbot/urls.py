@@ -1,5 +1,7 @@
 from django.urls import path, include
 from django.conf import settings
+from .jobs import chat_job_status, cancel_turn
+from .views import severity_assessment
 
 # Conditional URL routing based on USE_FIRESTORE setting
 if getattr(settings, 'USE_FIRESTORE', False):
@@ -11,6 +13,10 @@ if getattr(settings, 'USE_FIRESTORE', False):
         path('conversations/', firestore_views.firestore_conversations, name='firestore-conversations'),
         path('conversations/<str:conversation_id>/', firestore_views.firestore_conversation_detail, name='firestore-conversation-detail'),
         path('conversations/<str:conversation_id>/send_message/', firestore_views.firestore_send_message, name='firestore-send-message'),
+        path('conversations/<str:conversation_id>/stream_message/', firestore_views.firestore_stream_message, name='firestore-stream-message'),
+        path('jobs/<str:job_id>/', chat_job_status, name='chat-job-status'),
+        path('turns/<str:turn_id>/cancel/', cancel_turn, name='cancel-turn'),
+        path('severity/', severity_assessment, name='severity-assessment'),
         
         # Health check
         path('health/', firestore_views.firestore_health, name='firestore-health'),
@@ -27,6 +33,9 @@ else:
     messages_router.register(r'messages', MessageViewSet, basename='conversation-messages')
 
     urlpatterns = [
+        path('jobs/<str:job_id>/', chat_job_status, name='chat-job-status'),
+        path('turns/<str:turn_id>/cancel/', cancel_turn, name='cancel-turn'),
+        path('severity/', severity_assessment, name='severity-assessment'),
         path('', include(router.urls)),
         path('', include(messages_router.urls)),
     ]
@@ -1,12 +1,109 @@
 from rest_framework import viewsets, status, permissions
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes, throttle_classes
+from rest_framework.throttling import UserRateThrottle
+from django.conf import settings
 from rest_framework.response import Response
+from django.utils import timezone
 from .models import Conversation, Message
 from .serializers import (
     ConversationSerializer, ConversationListSerializer,
     MessageSerializer, ChatInputSerializer
 )
-from utils.llm_utils import generate_ai_responses
+from utils.llm_utils import generate_ai_responses, stream_ai_response, evaluate_responses_sync
+from utils.context_window import prepare_context
+from utils.chat_history import load_django_history, history_cache
+from utils.rate_limit import RateLimitExceeded
+from utils.severity import assess_severity, score_severity_locally
+from utils.triage import record_patient_query
+from .streaming import ndjson_response
+from utils.turn_registry import TurnCancelled, TURN_CANCELLED_STATUS
+from .jobs import enqueue_chat_turn, chat_job_accepted, idempotent_turn, track_turn
+
+def _conversation_context(conversation, user_message):
+    """History for the LLM providers: the rolling summary plus the recent messages."""
+    history = load_django_history(conversation)
+    base_count = conversation.summary_message_count
+    
+    def save_summary(summary, summarized_count):
+        # Skip the write if another refresh or a clear changed the summary meanwhile
+        Conversation.objects.filter(id=conversation.id, summary_message_count=base_count).update(
+            summary=summary,
+            summary_message_count=summarized_count,
+            summary_updated_at=timezone.now()
+        )
+    
+    return prepare_context(
+        f"django:{conversation.id}", history, user_message, conversation.summary, base_count, save_summary
+    )
+
+def _turn_severity(conversation, user, user_message, model_name, content):
+    """Score the answer locally and queue it for the doctor triage queue; None for fallback apologies."""
+    if model_name == 'system':
+        return None
+    severity = score_severity_locally(content)
+    patient_id = user.id if user is not None and user.is_authenticated else None
+    record_patient_query('django', patient_id, conversation.id, user_message, content, severity)
+    return severity
+
+def _discard_user_message(conversation, message):
+    """Drop a user message whose turn failed so a retry starts clean."""
+    message.delete()
+    history_cache.invalidate(f"django:{conversation.id}")
+
+def complete_turn(conversation, message, user, turn=None):
+    """
+    Generate and save the assistant reply to a saved user message.
+    Returns (response data, HTTP status); used by send_message and by chat jobs.
+    If turn is cancelled the reply is discarded.
+    """
+    user_message = message.content
+    try:
+        context = _conversation_context(conversation, user_message)
+        response_data = generate_ai_responses(user_message, context, user=user, turn=turn)
+        if response_data.get("rate_limited"):
+            _discard_user_message(conversation, message)
+            return {
+                'error': 'The AI service is busy right now. Please try again shortly.',
+                'retry_after': response_data["rate_limited"]["retry_after"]
+            }, status.HTTP_429_TOO_MANY_REQUESTS
+        
+        # Extract the best response and metadata
+        best_model = response_data["best_model"]
+        best_response = response_data["best_response"]
+        explanation = response_data["explanation"]
+        if turn is not None:
+            turn.check()
+        severity = _turn_severity(conversation, user, user_message, best_model, best_response)
+        
+        # Save assistant message with the best response
+        assistant_message = Message.objects.create(
+            conversation=conversation,
+            content=best_response,
+            message_type='assistant',
+            model_name=best_model,
+            metadata={
+                "explanation": explanation,
+                "evaluated": True,
+                "timing": response_data.get("timing", {}),
+                "severity": severity
+            }
+        )
+        
+        return {
+            "message_id": assistant_message.id,
+            "content": best_response,
+            "model_name": best_model,
+            "explanation": explanation,
+            "severity": severity
+        }, status.HTTP_200_OK
+    
+    except TurnCancelled:
+        return {'error': 'The request was cancelled.', 'cancelled': True}, TURN_CANCELLED_STATUS
+    except Exception as e:
+        # The idempotency key is released on failure, so a retry would save the message again
+        _discard_user_message(conversation, message)
+        return {'error': f'Error generating AI responses: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
 
 class ConversationViewSet(viewsets.ModelViewSet):
     """ViewSet for chat conversations."""
@@ -29,65 +126,139 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def send_message(self, request, pk=None):
-        """Send a message in a conversation and get the best AI response."""
+        """
+        Send a message in a conversation and get the best AI response.
+        With ?async=1 the turn is queued instead and 202 with a job id is returned.
+        A repeated Idempotency-Key header returns the stored result.
+        """
         conversation = self.get_object()
         serializer = ChatInputSerializer(data=request.data)
         
         if serializer.is_valid():
             user_message = serializer.validated_data['message']
             
-            # Save user message
-            message = Message.objects.create(
-                conversation=conversation,
-                content=user_message,
-                message_type='user'
-            )
-            
-            # Get conversation history
-            history = Message.objects.filter(conversation=conversation).order_by('created_at')
-            
-            # Generate AI responses and evaluate the best one
-            try:
-                response_data = generate_ai_responses(user_message, history)
-                
-                # Extract the best response and metadata
-                best_model = response_data["best_model"]
-                best_response = response_data["best_response"]
-                explanation = response_data["explanation"]
-                
-                # Save assistant message with the best response
-                assistant_message = Message.objects.create(
+            def handle():
+                # Save user message
+                message = Message.objects.create(
                     conversation=conversation,
-                    content=best_response,
-                    message_type='assistant',
-                    model_name=best_model,
-                    metadata={
-                        "explanation": explanation,
-                        "evaluated": True
-                    }
+                    content=user_message,
+                    message_type='user'
                 )
                 
-                # Return response data
-                return Response({
-                    "message_id": assistant_message.id,
-                    "content": best_response,
-                    "model_name": best_model,
-                    "explanation": explanation
-                })
+                if request.query_params.get('async') in ('1', 'true', 'True'):
+                    job_id = enqueue_chat_turn(request, 'django', conversation.id, message.id)
+                    return chat_job_accepted(request, job_id), status.HTTP_202_ACCEPTED
+                
+                # Generate AI responses and evaluate the best one
+                with track_turn(request, str(request.user.id)) as turn:
+                    return complete_turn(conversation, message, request.user, turn)
             
-            except Exception as e:
-                return Response(
-                    {'error': f'Error generating AI responses: {str(e)}'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+            return idempotent_turn(request, f"django:{request.user.id}", conversation.id, user_message, handle)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=True, methods=['post'])
+    def stream_message(self, request, pk=None):
+        """Send a message and stream the AI response back as NDJSON events."""
+        conversation = self.get_object()
+        serializer = ChatInputSerializer(data=request.data)
+        
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        user_message = serializer.validated_data['message']
+        
+        # Save user message
+        message = Message.objects.create(
+            conversation=conversation,
+            content=user_message,
+            message_type='user'
+        )
+        
+        context = _conversation_context(conversation, user_message)
+        
+        def events():
+            with track_turn(request, str(request.user.id)) as turn:
+                yield from turn_events(turn)
+        
+        def turn_events(turn):
+            chunks = []
+            model_name = None
+            partial = False
+            cancelled = False
+            
+            try:
+                for model_name, chunk in stream_ai_response(user_message, context, user=request.user, turn=turn):
+                    chunks.append(chunk)
+                    yield {"type": "token", "content": chunk, "model_name": model_name}
+            except TurnCancelled:
+                # Keep what the user already saw, marked as cut short
+                if not chunks:
+                    return
+                partial = cancelled = True
+            except RateLimitExceeded as e:
+                message.delete()
+                history_cache.invalidate(f"django:{conversation.id}")
+                yield {
+                    "type": "error",
+                    "status": 429,
+                    "error": "The AI service is busy right now. Please try again shortly.",
+                    "retry_after": e.retry_after
+                }
+                return
+            except Exception as e:
+                print(f"Streaming error: {str(e)}")
+                yield {"type": "error", "error": f"Error generating AI response: {str(e)}"}
+                if not chunks:
+                    return
+                partial = True
+            
+            if chunks:
+                content = "".join(chunks)
+                explanation = f"Streamed from {model_name}."
+            else:
+                model_name, content, explanation = evaluate_responses_sync({}, user_message)
+                yield {"type": "token", "content": content, "model_name": model_name}
+            
+            severity = None if partial else _turn_severity(conversation, request.user, user_message, model_name, content)
+            
+            # Persist the assistant message once the stream completes
+            assistant_message = Message.objects.create(
+                conversation=conversation,
+                content=content,
+                message_type='assistant',
+                model_name=model_name,
+                metadata={
+                    "explanation": explanation,
+                    "evaluated": False,
+                    "streamed": True,
+                    "partial": partial,
+                    "cancelled": cancelled,
+                    "severity": severity
+                }
+            )
+            
+            yield {
+                "type": "done",
+                "message_id": assistant_message.id,
+                "content": content,
+                "model_name": model_name,
+                "explanation": explanation,
+                "severity": severity
+            }
+        
+        return ndjson_response(events())
+    
     @action(detail=True, methods=['delete'])
     def clear(self, request, pk=None):
         """Clear all messages in a conversation."""
         conversation = self.get_object()
         conversation.messages.all().delete()
+        # Bumping updated_at makes every worker rebuild its cached history
+        Conversation.objects.filter(id=conversation.id).update(
+            summary="", summary_message_count=0, summary_updated_at=None, updated_at=timezone.now()
+        )
+        history_cache.invalidate(f"django:{conversation.id}")
         return Response({"message": "Conversation cleared successfully"})
 
 class MessageViewSet(viewsets.ReadOnlyModelViewSet):
@@ -102,3 +273,23 @@ class MessageViewSet(viewsets.ReadOnlyModelViewSet):
             conversation_id=conversation_id,
             conversation__user=self.request.user
         ).order_by('created_at')
+
+class SeverityRateThrottle(UserRateThrottle):
+    scope = 'severity'
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@throttle_classes([SeverityRateThrottle])
+def severity_assessment(request):
+    """
+    Severity (1-10) of an assistant response. Scored locally; only
+    low-confidence responses are sent to an LLM, queued behind chat traffic
+    at background priority. Signed-in users only, throttled per user.
+    """
+    text = request.data.get('text', '').strip()
+    if not text:
+        return Response({'error': 'Text is required'}, status=status.HTTP_400_BAD_REQUEST)
+    max_chars = settings.LLM_SEVERITY['MAX_TEXT_CHARS']
+    if len(text) > max_chars:
+        return Response({'error': f'Text must be at most {max_chars} characters'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(assess_severity(text))
@@ -15,6 +15,6 @@ class AppointmentAdmin(admin.ModelAdmin):
 
 @admin.register(PatientQuery)
 class PatientQueryAdmin(admin.ModelAdmin):
-    list_display = ['patient', 'severity_score', 'doctor_reviewed', 'created_at']
-    list_filter = ['severity_score', 'doctor_reviewed']
+    list_display = ['patient', 'severity_score', 'severity_method', 'doctor_reviewed', 'created_at']
+    list_filter = ['severity_score', 'severity_method', 'doctor_reviewed']
     search_fields = ['patient__username', 'query_text']
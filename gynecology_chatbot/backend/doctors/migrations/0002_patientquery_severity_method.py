@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientquery',
+            name='severity_method',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='patientquery',
+            name='severity_confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
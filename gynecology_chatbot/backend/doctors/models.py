@@ -145,6 +145,10 @@ class PatientQuery(models.Model):
     query_text = models.TextField()
     ai_response = models.TextField()
     severity_score = models.IntegerField(choices=SEVERITY_CHOICES, default=3)
+    # How the score was produced ('llm', 'model', 'rules' or 'default'); only
+    # LLM and doctor-reviewed scores are used to train the severity model
+    severity_method = models.CharField(max_length=20, blank=True)
+    severity_confidence = models.FloatField(null=True, blank=True)
     
     doctor_reviewed = models.BooleanField(default=False)
     doctor_response = models.TextField(blank=True)
@@ -152,6 +152,9 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    'DEFAULT_THROTTLE_RATES': {
+        'severity': os.environ.get('SEVERITY_THROTTLE_RATE', '30/min'),
+    },
 }
 
 # JWT settings
@@ -180,6 +183,236 @@ OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4o')
 GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
 GROK_MODEL = os.environ.get('GROK_MODEL', 'grok-2')
 
+# LLM fan-out engine: per-provider deadline in seconds
+LLM_PROVIDER_TIMEOUT = float(os.environ.get('LLM_PROVIDER_TIMEOUT', '20'))
+
+# Response mode: 'all' waits for every provider, 'race' returns the first
+# acceptable answer, waiting up to LLM_HEDGE_GRACE_SECONDS for a preferred one
+LLM_RESPONSE_MODE = os.environ.get('LLM_RESPONSE_MODE', 'all')
+LLM_PROVIDER_PRIORITY = ['gemini', 'openai', 'grok']
+LLM_HEDGE_GRACE_SECONDS = float(os.environ.get('LLM_HEDGE_GRACE_SECONDS', '0.5'))
+
+# End-to-end budget per chat turn. The fan-out may use LLM_FANOUT_BUDGET_SHARE
+# of it; the rest is left for the fallback ladder, tried in order while at
+# least LLM_MIN_STEP_SECONDS remain
+LLM_TURN_DEADLINE = float(os.environ.get('LLM_TURN_DEADLINE', '25'))
+LLM_FANOUT_BUDGET_SHARE = 0.6
+LLM_FALLBACK_LADDER = ['gemini', 'grok']
+LLM_MIN_STEP_SECONDS = 1.0
+
+# Concurrent identical chat turns in one process share a single generation
+LLM_SINGLE_FLIGHT = os.environ.get('LLM_SINGLE_FLIGHT', 'True') == 'True'
+
+# Keep-alive HTTP connection pool shared by the pooled provider clients
+LLM_HTTP_POOL = {
+    'max_connections': int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', '100')),
+    'max_keepalive_connections': 20,
+    'keepalive_expiry': 30.0,
+}
+
+# Exact-match cache of chat answers ('memory' per process, or 'django' to use
+# the Django cache named by CACHE_ALIAS and share entries between workers)
+LLM_RESPONSE_CACHE = {
+    'ENABLED': os.environ.get('LLM_RESPONSE_CACHE_ENABLED', 'True') == 'True',
+    'BACKEND': os.environ.get('LLM_RESPONSE_CACHE_BACKEND', 'memory'),
+    'CACHE_ALIAS': 'default',
+    'TTL': 6 * 60 * 60,
+    'MAX_ENTRIES': 2000,
+}
+
+# Semantic cache for paraphrased first-turn questions. The index is built by
+# `manage.py seed_semantic_cache` from evaluated answers and loaded from PATH
+# on first use; live answers are never added. A match needs THRESHOLD cosine
+# similarity and the same negations and clinical terms as the seeded question
+LLM_SEMANTIC_CACHE = {
+    'ENABLED': os.environ.get('LLM_SEMANTIC_CACHE_ENABLED', 'True') == 'True',
+    'PATH': os.path.join(BASE_DIR, 'semantic_cache.npz'),
+    'THRESHOLD': float(os.environ.get('LLM_SEMANTIC_CACHE_THRESHOLD', '0.97')),
+    'MAX_ENTRIES': 5000,
+    'N_FEATURES': 4096,
+}
+
+# Per-provider circuit breakers: open when the error rate or mean latency over
+# the rolling window crosses a threshold, then probe again after the cooldown
+LLM_CIRCUIT_BREAKER = {
+    'WINDOW_SECONDS': 60,
+    'MIN_CALLS': 5,
+    'ERROR_RATE_THRESHOLD': 0.5,
+    'LATENCY_THRESHOLD_SECONDS': 15.0,
+    'COOLDOWN_SECONDS': 30,
+    'PROBE_MESSAGE': 'Hello',
+}
+
+# /api/llm/status/ exposes provider internals and error messages: it is
+# served to staff users and to monitoring that sends this value in the
+# X-Status-Token header (empty disables token access)
+LLM_STATUS_TOKEN = os.environ.get('LLM_STATUS_TOKEN', '')
+
+# Per-provider token buckets (requests and estimated tokens per minute; None
+# or a missing provider means unlimited). Calls over the limit wait in a
+# priority queue of at most MAX_DEPTH for up to MAX_WAIT_SECONDS; with 0 they
+# fail fast and the chat API answers 429 with Retry-After
+LLM_RATE_LIMITS = {
+    'openai': {
+        'RPM': int(os.environ.get('OPENAI_RPM', '500')),
+        'TPM': int(os.environ.get('OPENAI_TPM', '30000')),
+    },
+    'gemini': {
+        'RPM': int(os.environ.get('GEMINI_RPM', '1000')),
+        'TPM': int(os.environ.get('GEMINI_TPM', '1000000')),
+    },
+}
+LLM_RATE_LIMIT_QUEUE = {
+    'MAX_DEPTH': 100,
+    'MAX_WAIT_SECONDS': float(os.environ.get('LLM_RATE_LIMIT_MAX_WAIT', '5')),
+    'RESPONSE_TOKENS': 500,
+    'DEFAULT_RETRY_AFTER': 10.0,
+}
+
+# Adaptive routing for single-provider turns: EWMA latency/success per
+# provider, persisted to STATS_PATH. The fastest eligible provider is chosen
+# unless the user's preferred one is within PREFERENCE_SLACK times its latency
+# (None always keeps the preference when it is eligible)
+LLM_ADAPTIVE_ROUTING = {
+    'ENABLED': os.environ.get('LLM_ADAPTIVE_ROUTING', 'True') == 'True',
+    'ALPHA': 0.2,
+    'QUALITY': {'openai': 0.9, 'gemini': 0.85, 'grok': 0.3},
+    'QUALITY_FLOOR': 0.5,
+    'MIN_SUCCESS_RATE': 0.8,
+    'PREFERENCE_SLACK': 2.0,
+    'EXPLORE_RATE': 0.05,
+    'STATS_PATH': os.path.join(BASE_DIR, 'provider_stats.json'),
+    'SAVE_INTERVAL_SECONDS': 30,
+}
+
+# Per-process cache of serialized conversation history; each turn only
+# fetches the messages added since the previous one
+LLM_HISTORY_CACHE = {
+    'MAX_CONVERSATIONS': 1000,
+    'IDLE_TTL': 30 * 60,
+}
+
+# Durable queue for chat turns sent with ?async=1: the request returns 202
+# with a job id and WORKERS threads generate the reply. With IN_PROCESS off
+# no workers run in the web process; start them with `manage.py run_chat_workers`.
+# Jobs left running longer than STALE_AFTER_SECONDS by a lost worker are
+# retried up to MAX_ATTEMPTS times
+LLM_JOB_QUEUE = {
+    'PATH': os.path.join(BASE_DIR, 'chat_jobs.sqlite3'),
+    'IN_PROCESS': os.environ.get('LLM_JOB_QUEUE_IN_PROCESS', 'True') == 'True',
+    'WORKERS': int(os.environ.get('LLM_JOB_WORKERS', '4')),
+    'POLL_INTERVAL': 0.5,
+    'STALE_AFTER_SECONDS': 120,
+    'MAX_ATTEMPTS': 2,
+    'RETENTION_HOURS': 24,
+    'MAX_LONG_POLL_SECONDS': 30,
+}
+
+# Conversation context sent to the providers: the newest messages are kept
+# verbatim within MAX_TOKENS (estimated at about four characters per token)
+# and older turns are folded into a rolling summary stored on the
+# conversation. The summary is refreshed in the background once more than
+# KEEP_TURNS + FOLD_TURNS turns are unsummarized
+LLM_CONTEXT_WINDOW = {
+    'KEEP_TURNS': int(os.environ.get('LLM_CONTEXT_KEEP_TURNS', '4')),
+    'FOLD_TURNS': 2,
+    'MAX_TOKENS': int(os.environ.get('LLM_CONTEXT_MAX_TOKENS', '1500')),
+    'SUMMARY_MAX_WORDS': 150,
+    'SUMMARY_TIMEOUT': 30,
+}
+
+# Provider adapters are registered in apps.chatbot.providers. Grok has no
+# real client yet and is always served by its mock profile. With
+# LLM_MOCK_PROVIDERS on, every provider uses its mock profile so the chat path
+# can be load-tested offline (`manage.py load_test_llm`). LATENCY is the time
+# to first token: ('fixed', s), ('uniform', low, high), ('normal', mean, sd)
+# or ('lognormal', median, sigma)
+LLM_MOCK_PROVIDERS = os.environ.get('LLM_MOCK_PROVIDERS', 'False') == 'True'
+LLM_MOCK_SEED = int(os.environ.get('LLM_MOCK_SEED', '0'))
+LLM_MOCK_PROFILES = {
+    'openai': {
+        'LATENCY': ('lognormal', 1.2, 0.4),
+        'ERROR_RATE': 0.02,
+        'TIMEOUT_RATE': 0.005,
+        'TOKENS_PER_SECOND': 60,
+        'RESPONSE_TOKENS': 120,
+    },
+    'gemini': {
+        'LATENCY': ('lognormal', 0.8, 0.35),
+        'ERROR_RATE': 0.02,
+        'TIMEOUT_RATE': 0.005,
+        'TOKENS_PER_SECOND': 90,
+        'RESPONSE_TOKENS': 120,
+    },
+    'grok': {
+        'LATENCY': ('fixed', 1.0),
+        'ERROR_RATE': 0.0,
+        'TOKENS_PER_SECOND': 100,
+        'TEMPLATE': (
+            "As your gynecology assistant, I understand you're asking about '{message}...'. "
+            "While I don't have complete information, I can provide general guidance on this topic. "
+            "Remember to consult with a healthcare provider for a proper evaluation of your specific situation."
+        ),
+    },
+}
+
+# Severity of assistant responses (utils.severity): phrase rules plus a
+# linear model trained by `manage.py train_severity_model` from the
+# PatientQuery scores given by the LLM or reviewed by a doctor. Answers
+# scored below CONFIDENCE_THRESHOLD are sent to an LLM when ESCALATE is on,
+# but only once a model is trained (until then the rules alone are used).
+# The severity endpoint takes at most MAX_TEXT_CHARS and is throttled per
+# user by the 'severity' throttle rate
+LLM_SEVERITY = {
+    'MODEL_PATH': os.path.join(BASE_DIR, 'severity_model.npz'),
+    'N_FEATURES': 4096,
+    'CONFIDENCE_THRESHOLD': float(os.environ.get('LLM_SEVERITY_CONFIDENCE', '0.6')),
+    'ESCALATE': os.environ.get('LLM_SEVERITY_ESCALATE', 'True') == 'True',
+    'LLM_TIMEOUT': 10,
+    'HOLDOUT': 0.2,
+    'MAX_TEXT_CHARS': 4000,
+}
+
+# Every answered chat turn is scored and written to the doctor triage queue
+# (PatientQuery) in bulk by a background writer, at most FLUSH_INTERVAL
+# seconds later. Uncertain scores are first escalated to the LLM by up to
+# ESCALATION_WORKERS threads; turns whose final score is below MIN_SCORE
+# (routine answers) are not recorded
+LLM_TRIAGE = {
+    'ENABLED': os.environ.get('LLM_TRIAGE_ENABLED', 'True') == 'True',
+    'MIN_SCORE': int(os.environ.get('LLM_TRIAGE_MIN_SCORE', '4')),
+    'BATCH_SIZE': 50,
+    'FLUSH_INTERVAL': 5.0,
+    'ESCALATION_WORKERS': 4,
+}
+
+# Record/replay of provider traffic (apps.chatbot.cassettes). MODE 'record'
+# stores every provider request with its timings in the gzip NDJSON file at
+# PATH; 'replay' answers from it without network access, sleeping the
+# recorded timings times LATENCY_SCALE (0 for no delay). Requests missing
+# from the cassette fail unless PASSTHROUGH sends them to the real provider
+LLM_CASSETTE = {
+    'MODE': os.environ.get('LLM_CASSETTE_MODE', ''),
+    'PATH': os.environ.get('LLM_CASSETTE_PATH', os.path.join(BASE_DIR, 'cassettes', 'llm.ndjson.gz')),
+    'LATENCY_SCALE': float(os.environ.get('LLM_CASSETTE_LATENCY_SCALE', '1.0')),
+    'PASSTHROUGH': os.environ.get('LLM_CASSETTE_PASSTHROUGH', 'False') == 'True',
+    'FLUSH_EVERY': 20,
+}
+
+# Chat requests sent with an Idempotency-Key header (utils.idempotency).
+# Successful results are kept for TTL seconds so a retried request is
+# answered from the cache instead of generating a second reply. A retry that
+# arrives while the first request is running waits up to WAIT_SECONDS for
+# it; PENDING_TTL frees the key if that request never finishes. The default
+# cache is per process, so configure a shared CACHES backend (e.g. Redis)
+# when running several workers
+LLM_IDEMPOTENCY = {
+    'CACHE_ALIAS': os.environ.get('LLM_IDEMPOTENCY_CACHE', 'default'),
+    'TTL': int(os.environ.get('LLM_IDEMPOTENCY_TTL', str(24 * 60 * 60))),
+    'PENDING_TTL': LLM_TURN_DEADLINE + 30,
+    'WAIT_SECONDS': LLM_TURN_DEADLINE + 5,
+}
+
 # System Prompt for Gynecology Chatbot
 GYNECOLOGY_SYSTEM_PROMPT = """
 You are a virtual gynecology assistant providing supportive, concise guidance for gynecological concerns. Your responses must be brief yet impactful. In every response:
@@ -213,7 +446,10 @@ FIRESTORE_SETTINGS = {
         'doctors': 'doctors',
         'appointments': 'appointments',
         'patient_queries': 'patient_queries',
-    }
+    },
+    # Seconds a request waits for a concurrent batch (message counts, clearing
+    # a conversation) on the shared event loop before answering 503
+    'batch_timeout': float(os.environ.get('FIRESTORE_BATCH_TIMEOUT', '10')),
 }
 
 # Add logging for Firestore operations
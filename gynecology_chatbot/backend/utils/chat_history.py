@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Optional, Tuple
+from django.conf import settings
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token for English text)."""
+    return len(text or "") // 4 + 1
+
+def openai_message(msg) -> Dict[str, str]:
+    """One history message in OpenAI chat format."""
+    if msg.message_type == "summary":
+        return {"role": "system", "content": f"Summary of the earlier conversation: {msg.content}"}
+    role = "user" if msg.message_type == "user" else "assistant"
+    return {"role": role, "content": msg.content}
+
+def gemini_message(msg) -> Dict[str, Any]:
+    """One history message in Gemini chat format."""
+    if msg.message_type == "summary":
+        # Gemini history has no system role; the summary opens the chat as context
+        return {"role": "user", "parts": [f"Summary of our earlier conversation: {msg.content}"]}
+    role = "user" if msg.message_type == "user" else "model"
+    return {"role": role, "parts": [msg.content]}
+
+class HistoryEntry:
+    """A conversation message serialized once for every provider format."""
+
+    __slots__ = ("id", "message_type", "content", "model_name", "tokens", "openai", "gemini")
+
+    def __init__(self, id: Any, message_type: str, content: str, model_name: Optional[str] = None):
+        self.id = id
+        self.message_type = message_type
+        self.content = content
+        self.model_name = model_name
+        self.tokens = estimate_tokens(content)
+        self.openai = openai_message(self)
+        self.gemini = gemini_message(self)
+
+def openai_view(chat_history: List[Any]) -> List[Dict[str, str]]:
+    """OpenAI messages for a history, reusing the serialized form of cached entries."""
+    return [msg.openai if isinstance(msg, HistoryEntry) else openai_message(msg) for msg in chat_history or []]
+
+def gemini_view(chat_history: List[Any]) -> List[Dict[str, Any]]:
+    """Gemini chat history, reusing the serialized form of cached entries."""
+    return [msg.gemini if isinstance(msg, HistoryEntry) else gemini_message(msg) for msg in chat_history or []]
+
+class ConversationHistory:
+    """Serialized messages of one conversation; new rows are appended, never rebuilt."""
+
+    def __init__(self, version: Any):
+        self.version = version
+        self.entries: List[HistoryEntry] = []
+        self.cursor = None
+        self.ids = set()
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def append(self, rows: List[HistoryEntry], cursor: Any):
+        for entry in rows:
+            if entry.id not in self.ids:
+                self.ids.add(entry.id)
+                self.entries.append(entry)
+        if cursor is not None:
+            self.cursor = cursor
+
+class HistoryCache:
+    """
+    Per-conversation serialized history, kept per process.
+
+    Each turn only the rows newer than the cached cursor are fetched. A
+    conversation is rebuilt when its version token changes (for example after
+    it was cleared) and dropped after IDLE_TTL seconds without use.
+    """
+
+    def __init__(self, max_conversations: int, idle_ttl: float):
+        self.max_conversations = max_conversations
+        self.idle_ttl = idle_ttl
+        self._conversations: "OrderedDict[str, ConversationHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.rebuilds = 0
+        self.rows_fetched = 0
+
+    def _conversation(self, key: str, version: Any) -> ConversationHistory:
+        now = time.monotonic()
+        with self._lock:
+            history = self._conversations.get(key)
+            fresh = history is None or history.version != version or now - history.last_used > self.idle_ttl
+            if fresh:
+                history = ConversationHistory(version)
+                self._conversations[key] = history
+                self.rebuilds += 1
+            else:
+                self.hits += 1
+            history.last_used = now
+            self._conversations.move_to_end(key)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        return history
+
+    def load(self, key: str, version: Any,
+             fetch_since: Callable[[Any], Tuple[List[HistoryEntry], Any]]) -> List[HistoryEntry]:
+        """
+        Return the conversation's entries after appending the rows that
+        fetch_since(cursor) reports as new; cursor is None on a rebuild.
+        """
+        history = self._conversation(key, version)
+        with history.lock:
+            rows, cursor = fetch_since(history.cursor)
+            history.append(rows, cursor)
+            with self._lock:
+                self.rows_fetched += len(rows)
+            return list(history.entries)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._conversations.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "hits": self.hits,
+                "rebuilds": self.rebuilds,
+                "rows_fetched": self.rows_fetched,
+            }
+
+def _django_rows_since(conversation):
+    from apps.chatbot.models import Message
+
+    def fetch_since(cursor):
+        rows = Message.objects.filter(conversation=conversation)
+        if cursor is not None:
+            rows = rows.filter(id__gt=cursor)
+        rows = rows.order_by('id').values_list('id', 'message_type', 'content', 'model_name')
+        entries = [HistoryEntry(*row) for row in rows]
+        return entries, entries[-1].id if entries else cursor
+
+    return fetch_since
+
+def _firestore_rows_since(conversation_id):
+    from utils.firestore_client import firestore_client
+
+    def fetch_since(cursor):
+        filters = [('conversation_id', '==', conversation_id)]
+        if cursor is not None:
+            # >= because timestamps may tie; already cached ids are skipped
+            filters.append(('created_at', '>=', cursor))
+        docs = firestore_client.query_collection('messages', filters=filters, order_by='created_at')
+        entries = [
+            HistoryEntry(doc['id'], doc.get('message_type', 'user'), doc.get('content', ''), doc.get('model_name', ''))
+            for doc in docs
+        ]
+        return entries, docs[-1].get('created_at') if docs else cursor
+
+    return fetch_since
+
+def load_django_history(conversation) -> List[HistoryEntry]:
+    """Serialized history of a Django conversation, fetching only new messages."""
+    return history_cache.load(
+        f"django:{conversation.id}", conversation.updated_at, _django_rows_since(conversation)
+    )
+
+def load_firestore_history(conversation_id: str, conversation: Dict[str, Any]) -> List[HistoryEntry]:
+    """Serialized history of a Firestore conversation, fetching only new messages."""
+    return history_cache.load(
+        f"firestore:{conversation_id}", conversation.get('history_version'), _firestore_rows_since(conversation_id)
+    )
+
+# Global instance
+history_cache = HistoryCache(
+    settings.LLM_HISTORY_CACHE['MAX_CONVERSATIONS'],
+    settings.LLM_HISTORY_CACHE['IDLE_TTL'],
+)
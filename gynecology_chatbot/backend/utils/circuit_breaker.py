@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Any, Optional
+from django.conf import settings
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker for one LLM provider.
+
+    Outcomes are kept for a rolling window. The breaker opens when the error
+    rate or the mean latency over that window crosses its threshold. While
+    open, live traffic skips the provider; a background probe moves it to
+    half-open and either closes it again or re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window_seconds: float, min_calls: int,
+                 error_rate_threshold: float, latency_threshold: float,
+                 on_open: Optional[Callable[[str], None]] = None):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.latency_threshold = latency_threshold
+        self.on_open = on_open
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.last_error = None
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _window(self):
+        calls = len(self._calls)
+        if not calls:
+            return 0, 0.0, 0.0
+        errors = sum(1 for _, ok, _ in self._calls if not ok)
+        latency = sum(latency for _, _, latency in self._calls) / calls
+        return calls, errors / calls, latency
+
+    def allow_request(self) -> bool:
+        """Whether live traffic may use this provider."""
+        return self.state == self.CLOSED
+
+    def record(self, ok: bool, latency: float, error: Optional[str] = None):
+        """Record the outcome of a live call and trip the breaker if needed."""
+        tripped = False
+        with self._lock:
+            now = time.monotonic()
+            self._calls.append((now, ok, latency))
+            self._prune(now)
+            if not ok:
+                self.last_error = error
+
+            calls, error_rate, mean_latency = self._window()
+            if self.state == self.CLOSED and calls >= self.min_calls and (
+                error_rate >= self.error_rate_threshold or mean_latency >= self.latency_threshold
+            ):
+                self._open()
+                tripped = True
+
+        if tripped:
+            print(f"Circuit breaker opened for {self.name}: error rate {error_rate:.0%}, mean latency {mean_latency:.1f}s")
+            if self.on_open:
+                self.on_open(self.name)
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+    def begin_probe(self):
+        with self._lock:
+            self.state = self.HALF_OPEN
+
+    def probe_result(self, ok: bool, error: Optional[str] = None):
+        """Close the breaker after a successful probe, or re-open it."""
+        with self._lock:
+            if ok:
+                self.state = self.CLOSED
+                self.opened_at = None
+                self._calls.clear()
+            else:
+                self.last_error = error
+                self._open()
+
+        if ok:
+            print(f"Circuit breaker closed for {self.name} after successful probe")
+        elif self.on_open:
+            self.on_open(self.name)
+
+    def health_score(self) -> float:
+        """1.0 for a healthy provider, falling with error rate and latency."""
+        with self._lock:
+            self._prune(time.monotonic())
+            calls, error_rate, mean_latency = self._window()
+        if self.state != self.CLOSED:
+            return 0.0
+        if not calls:
+            return 1.0
+        latency_factor = max(0.0, 1 - mean_latency / self.latency_threshold)
+        return round((1 - error_rate) * (0.5 + 0.5 * latency_factor), 3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune(time.monotonic())
+            calls, error_rate, mean_latency = self._window()
+            opened_for = time.monotonic() - self.opened_at if self.opened_at else None
+        return {
+            "state": self.state,
+            "health": self.health_score(),
+            "window_calls": calls,
+            "error_rate": round(error_rate, 3),
+            "mean_latency_ms": int(mean_latency * 1000),
+            "open_for_seconds": round(opened_for, 1) if opened_for is not None else None,
+            "last_error": self.last_error,
+        }
+
+class CircuitBreakerRegistry:
+    """Lazily created breakers, one per provider name."""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self.on_open: Optional[Callable[[str], None]] = None
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                config = settings.LLM_CIRCUIT_BREAKER
+                breaker = CircuitBreaker(
+                    name,
+                    window_seconds=config['WINDOW_SECONDS'],
+                    min_calls=config['MIN_CALLS'],
+                    error_rate_threshold=config['ERROR_RATE_THRESHOLD'],
+                    latency_threshold=config['LATENCY_THRESHOLD_SECONDS'],
+                    on_open=self._notify_open,
+                )
+                self._breakers[name] = breaker
+            return breaker
+
+    def _notify_open(self, name: str):
+        if self.on_open:
+            self.on_open(name)
+
+    def allow(self, name: str) -> bool:
+        return self.get(name).allow_request()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.snapshot() for name, breaker in breakers.items()}
+
+# Global instance
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,138 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Any, Optional, Tuple
+from django.conf import settings
+from django.db import close_old_connections
+from utils.llm_utils import Deadline, run_sync, run_fallback_ladder, real_provider_priority
+from utils.llm_cache import prior_history
+from utils.chat_history import HistoryEntry, estimate_tokens
+from utils.rate_limit import PRIORITY_BACKGROUND
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a patient and a gynecology assistant.
+Keep the patient's symptoms, their duration and severity, relevant medical history, and the advice already given.
+Reply with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+def build_context(history: List[Any], summary: str = "", summarized_count: int = 0,
+                  reserved_tokens: int = 0) -> Tuple[List[Any], Optional[int]]:
+    """
+    Build the history sent to the providers: the stored summary followed by
+    the newest unsummarized messages that fit in the token budget, less
+    reserved_tokens for the question itself.
+
+    history is the ordered message list before the current question; its
+    first summarized_count messages are covered by summary. Returns
+    (context, fold_to) where fold_to is the number of leading messages the
+    summary should cover after a refresh, or None when no refresh is needed yet.
+    """
+    config = settings.LLM_CONTEXT_WINDOW
+    keep_messages = config['KEEP_TURNS'] * 2
+    max_messages = (config['KEEP_TURNS'] + config['FOLD_TURNS']) * 2
+
+    unsummarized = len(history) - summarized_count
+    summary_entry = HistoryEntry(None, "summary", summary) if summary else None
+    budget = config['MAX_TOKENS'] - reserved_tokens - (summary_entry.tokens if summary_entry else 0)
+
+    # Walk back from the newest message only as far as the window reaches
+    kept = []
+    for index in range(len(history) - 1, summarized_count - 1, -1):
+        msg = history[index]
+        cost = msg.tokens if isinstance(msg, HistoryEntry) else estimate_tokens(msg.content)
+        if cost > budget or len(kept) >= max_messages:
+            break
+        kept.append(msg)
+        budget -= cost
+    kept.reverse()
+
+    context = ([summary_entry] if summary_entry else []) + kept
+
+    fold_to = None
+    if unsummarized > max_messages or len(kept) < unsummarized:
+        fold_to = len(history) - min(keep_messages, len(kept))
+    return context, fold_to
+
+def summarize_messages(summary: str, messages: List[Any]) -> Optional[str]:
+    """
+    Fold messages into summary with the first real provider that answers,
+    or None. Mock providers are skipped: the summary replaces the messages.
+    """
+    ladder = real_provider_priority()
+    if not ladder:
+        return None
+    config = settings.LLM_CONTEXT_WINDOW
+    lines = []
+    for msg in messages:
+        if msg.message_type == "user":
+            lines.append(f"Patient: {msg.content}")
+        elif msg.message_type == "assistant":
+            lines.append(f"Assistant: {msg.content}")
+
+    prompt = SUMMARY_PROMPT.format(
+        max_words=config['SUMMARY_MAX_WORDS'],
+        summary=summary or "(none yet)",
+        messages="\n".join(lines),
+    )
+    deadline = Deadline(config['SUMMARY_TIMEOUT'])
+    responses, _, _ = run_sync(
+        run_fallback_ladder(prompt, [], deadline, ladder, priority=PRIORITY_BACKGROUND),
+        timeout=deadline.remaining() + 1
+    )
+    return next(iter(responses.values()), None)
+
+# Summaries are refreshed off the request path, at most once at a time per conversation
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def _refresh_summary(key: str, summary: str, messages: List[Any], fold_to: int,
+                     save: Callable[[str, int], None]):
+    try:
+        new_summary = summarize_messages(summary, messages)
+        if new_summary:
+            save(new_summary.strip(), fold_to)
+        else:
+            print(f"No provider produced a summary for conversation {key}")
+    except Exception as e:
+        print(f"Error refreshing conversation summary for {key}: {str(e)}")
+    finally:
+        close_old_connections()
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+def schedule_summary_refresh(key: str, history: List[Any], summary: str, summarized_count: int,
+                             fold_to: int, save: Callable[[str, int], None]) -> bool:
+    """
+    Fold history[summarized_count:fold_to] into the summary in the background.
+    save(summary, fold_to) persists the result; it should only apply if the
+    stored summary still covers summarized_count messages.
+    """
+    with _refreshing_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+
+    messages = list(history[summarized_count:fold_to])
+    _summary_executor.submit(_refresh_summary, key, summary, messages, fold_to, save)
+    return True
+
+def prepare_context(key: str, history: List[Any], user_message: str, summary: str,
+                    summarized_count: int, save: Callable[[str, int], None]) -> List[Any]:
+    """
+    Build the provider context for a turn and schedule a summary refresh if
+    it is due. The current question, already saved to history by the views,
+    is left out: the providers append it themselves.
+    """
+    history = prior_history(history, user_message)
+    if summarized_count > len(history):
+        # Messages were deleted since the summary was written
+        summary, summarized_count = "", 0
+
+    context, fold_to = build_context(history, summary, summarized_count, estimate_tokens(user_message))
+    if fold_to is not None:
+        schedule_summary_refresh(key, history, summary, summarized_count, fold_to, save)
+    return context
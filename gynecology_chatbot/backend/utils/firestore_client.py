@@ -1,10 +1,32 @@
+import asyncio
 import os
+import threading
+import weakref
 from google.cloud import firestore
 from django.conf import settings
 from typing import Dict, List, Any, Optional
 import uuid
 from datetime import datetime
 
+def _set_credentials():
+    if hasattr(settings, 'GOOGLE_APPLICATION_CREDENTIALS'):
+        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = settings.GOOGLE_APPLICATION_CREDENTIALS
+
+def _build_query(query, filters: List = None, order_by: str = None, limit: int = None):
+    """Apply (field, operator, value) filters, ordering and a limit to a collection query"""
+    if filters:
+        for filter_item in filters:
+            if len(filter_item) == 3:
+                field, operator, value = filter_item
+                query = query.where(field, operator, value)
+    
+    if order_by:
+        query = query.order_by(order_by)
+    
+    if limit:
+        query = query.limit(limit)
+    return query
+
 class FirestoreClient:
     _instance = None
     _client = None
@@ -22,8 +44,7 @@ class FirestoreClient:
         """Initialize Firestore client"""
         try:
             # Set credentials path
-            if hasattr(settings, 'GOOGLE_APPLICATION_CREDENTIALS'):
-                os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = settings.GOOGLE_APPLICATION_CREDENTIALS
+            _set_credentials()
             
             # Initialize client
             self._client = firestore.Client(project=settings.GOOGLE_CLOUD_PROJECT)
@@ -57,6 +78,24 @@ class FirestoreClient:
             print(f"Error creating document: {e}")
             raise
     
+    def batch_create(self, collection: str, documents: List[Dict[str, Any]]) -> List[str]:
+        """Create documents with batched writes (at most 500 per commit)"""
+        try:
+            doc_ids = []
+            for start in range(0, len(documents), 500):
+                batch = self._client.batch()
+                for data in documents[start:start + 500]:
+                    doc_ref = self._client.collection(collection).document()
+                    data['created_at'] = firestore.SERVER_TIMESTAMP
+                    data['updated_at'] = firestore.SERVER_TIMESTAMP
+                    batch.set(doc_ref, data)
+                    doc_ids.append(doc_ref.id)
+                batch.commit()
+            return doc_ids
+        except Exception as e:
+            print(f"Error creating documents in batch: {e}")
+            raise
+    
     def get_document(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
         """Get a document from Firestore"""
         try:
@@ -97,20 +136,7 @@ class FirestoreClient:
                         order_by: str = None, limit: int = None) -> List[Dict[str, Any]]:
         """Query a collection with optional filters"""
         try:
-            query = self._client.collection(collection)
-            
-            if filters:
-                for filter_item in filters:
-                    if len(filter_item) == 3:
-                        field, operator, value = filter_item
-                        query = query.where(field, operator, value)
-            
-            if order_by:
-                query = query.order_by(order_by)
-            
-            if limit:
-                query = query.limit(limit)
-            
+            query = _build_query(self._client.collection(collection), filters, order_by, limit)
             docs = query.stream()
             results = []
             
@@ -123,6 +149,126 @@ class FirestoreClient:
         except Exception as e:
             print(f"Error querying collection: {e}")
             return []
+    
+    def count_documents(self, collection: str, filters: List = None) -> int:
+        """Count matching documents with an aggregation query, without reading them"""
+        try:
+            query = _build_query(self._client.collection(collection), filters)
+            return query.count().get()[0][0].value
+        except Exception as e:
+            print(f"Error counting documents: {e}")
+            return 0
 
 # Global instance
 firestore_client = FirestoreClient()
+
+class AsyncFirestoreClient:
+    """
+    FirestoreClient on firestore.AsyncClient, for async views and for reads
+    run concurrently with asyncio.gather. Its gRPC channel belongs to the
+    event loop it was created on, so get one per loop with
+    get_async_firestore_client(). Errors are handled as in FirestoreClient.
+    """
+    
+    def __init__(self):
+        try:
+            _set_credentials()
+            self._client = firestore.AsyncClient(project=settings.GOOGLE_CLOUD_PROJECT)
+        except Exception as e:
+            print(f"Error initializing async Firestore client: {e}")
+            raise
+    
+    @property
+    def client(self):
+        """Get async Firestore client"""
+        return self._client
+    
+    async def create_document(self, collection: str, data: Dict[str, Any], doc_id: str = None) -> str:
+        """Create a document in Firestore"""
+        try:
+            if doc_id:
+                doc_ref = self._client.collection(collection).document(doc_id)
+            else:
+                doc_ref = self._client.collection(collection).document()
+            
+            # Add timestamps
+            data['created_at'] = firestore.SERVER_TIMESTAMP
+            data['updated_at'] = firestore.SERVER_TIMESTAMP
+            
+            await doc_ref.set(data)
+            return doc_ref.id
+        except Exception as e:
+            print(f"Error creating document: {e}")
+            raise
+    
+    async def get_document(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Get a document from Firestore"""
+        try:
+            doc = await self._client.collection(collection).document(doc_id).get()
+            
+            if doc.exists:
+                data = doc.to_dict()
+                data['id'] = doc.id
+                return data
+            return None
+        except Exception as e:
+            print(f"Error getting document: {e}")
+            return None
+    
+    async def update_document(self, collection: str, doc_id: str, data: Dict[str, Any]) -> bool:
+        """Update a document in Firestore"""
+        try:
+            data['updated_at'] = firestore.SERVER_TIMESTAMP
+            await self._client.collection(collection).document(doc_id).update(data)
+            return True
+        except Exception as e:
+            print(f"Error updating document: {e}")
+            return False
+    
+    async def delete_document(self, collection: str, doc_id: str) -> bool:
+        """Delete a document from Firestore"""
+        try:
+            await self._client.collection(collection).document(doc_id).delete()
+            return True
+        except Exception as e:
+            print(f"Error deleting document: {e}")
+            return False
+    
+    async def query_collection(self, collection: str, filters: List = None,
+                               order_by: str = None, limit: int = None) -> List[Dict[str, Any]]:
+        """Query a collection with optional filters"""
+        try:
+            query = _build_query(self._client.collection(collection), filters, order_by, limit)
+            results = []
+            
+            async for doc in query.stream():
+                data = doc.to_dict()
+                data['id'] = doc.id
+                results.append(data)
+            
+            return results
+        except Exception as e:
+            print(f"Error querying collection: {e}")
+            return []
+    
+    async def count_documents(self, collection: str, filters: List = None) -> int:
+        """Count matching documents with an aggregation query, without reading them"""
+        try:
+            query = _build_query(self._client.collection(collection), filters)
+            results = await query.count().get()
+            return results[0][0].value
+        except Exception as e:
+            print(f"Error counting documents: {e}")
+            return 0
+
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+def get_async_firestore_client() -> AsyncFirestoreClient:
+    """Return the async client of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = _async_clients[loop] = AsyncFirestoreClient()
+    return client
@@ -191,6 +191,8 @@ class FirestorePatientQuery(FirestoreBaseModel):
         self.query_text = kwargs.get('query_text', '')
         self.ai_response = kwargs.get('ai_response', '')
         self.severity_score = kwargs.get('severity_score', 3)
+        self.severity_method = kwargs.get('severity_method', '')
+        self.severity_confidence = kwargs.get('severity_confidence')
         self.doctor_reviewed = kwargs.get('doctor_reviewed', False)
         self.doctor_response = kwargs.get('doctor_response', '')
         self.doctor_recommendation = kwargs.get('doctor_recommendation', '')
@@ -0,0 +1,99 @@
+import hashlib
+import time
+from typing import Callable, Dict, Any, Optional, Tuple
+from django.conf import settings
+from django.core.cache import caches
+
+PENDING = "pending"
+DONE = "done"
+
+class IdempotencyStore:
+    """
+    Results of chat requests sent with an Idempotency-Key header, kept in a
+    Django cache so a retried request gets the stored result instead of a
+    second generation.
+
+    The first request for a key claims it atomically (cache.add). A retry
+    that arrives while the first is still running waits for its result for
+    up to WAIT_SECONDS. Only successful results are stored; after an error
+    the key is released so the retry runs normally. Keys are scoped by the
+    caller and remember a hash of the request body, so reusing a key for a
+    different message is refused. Use a shared cache backend in CACHES when
+    running more than one worker process.
+    """
+
+    key_prefix = "chat-idempotency:"
+
+    def __init__(self, alias: str, ttl: float, pending_ttl: float, wait_seconds: float,
+                 poll_interval: float = 0.2):
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+
+    def _key(self, scope: str, idempotency_key: str) -> str:
+        digest = hashlib.sha256(f"{scope}|{idempotency_key}".encode("utf-8")).hexdigest()
+        return self.key_prefix + digest
+
+    def run(self, scope: str, idempotency_key: str, fingerprint: str,
+            handler: Callable[[], Tuple[Dict[str, Any], int]]) -> Tuple[Dict[str, Any], int, bool]:
+        """
+        Return (data, status code, replayed). handler runs at most once per
+        key while its result is stored; replayed is True for a stored result.
+        """
+        key = self._key(scope, idempotency_key)
+        while not self.cache.add(key, {"state": PENDING, "fingerprint": fingerprint}, timeout=self.pending_ttl):
+            entry = self._wait(key, fingerprint)
+            if entry is None:
+                # The first request failed and released the key; claim it again
+                continue
+            if entry["fingerprint"] != fingerprint:
+                return {'error': 'This Idempotency-Key was already used for a different request.'}, 422, False
+            if entry["state"] == PENDING:
+                return {'error': 'A request with this Idempotency-Key is still being processed.'}, 409, False
+            return entry["data"], entry["status"], True
+
+        try:
+            data, status_code = handler()
+        except Exception:
+            self.cache.delete(key)
+            raise
+
+        if 200 <= status_code < 300:
+            self.cache.set(key, {
+                "state": DONE, "fingerprint": fingerprint, "data": data, "status": status_code
+            }, timeout=self.ttl)
+        else:
+            self.cache.delete(key)
+        return data, status_code, False
+
+    def _wait(self, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Wait while the entry for the same request is pending. Returns the
+        finished entry, the still-pending entry after WAIT_SECONDS, or None
+        if it was released.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            entry = self.cache.get(key)
+            if entry is None or entry["state"] == DONE or entry["fingerprint"] != fingerprint:
+                return entry
+            if time.monotonic() >= deadline:
+                return entry
+            time.sleep(self.poll_interval)
+
+def request_fingerprint(conversation_id: Any, message: str) -> str:
+    """Hash of what a chat request asks for, to detect a key reused for another message."""
+    return hashlib.sha256(f"{conversation_id}|{message}".encode("utf-8")).hexdigest()
+
+_store = None
+
+def get_idempotency_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        config = settings.LLM_IDEMPOTENCY
+        _store = IdempotencyStore(
+            config['CACHE_ALIAS'], config['TTL'], config['PENDING_TTL'], config['WAIT_SECONDS']
+        )
+    return _store
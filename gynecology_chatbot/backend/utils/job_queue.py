@@ -0,0 +1,264 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Any, Optional
+from django.conf import settings
+from django.db import close_old_connections
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    owner TEXT,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+class JobFailed(Exception):
+    """Raised by a job handler to fail the job while still storing a result for the client."""
+
+    def __init__(self, message: str, result: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.result = result
+
+class JobQueue:
+    """
+    Durable FIFO of background jobs in a SQLite file.
+
+    Jobs survive restarts: anything still queued is picked up again, and jobs
+    left running by a worker that died are re-queued once they are older than
+    STALE_AFTER_SECONDS (up to MAX_ATTEMPTS). Safe to share between threads
+    and between processes using the same file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._finished = threading.Condition()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], owner: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        self._connection().execute(
+            "INSERT INTO jobs (id, kind, payload, owner, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), owner, QUEUED, time.time())
+        )
+        return job_id
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest queued job, or return None."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            started_at = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, started_at, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        job = self._decode(row)
+        job.update(status=RUNNING, started_at=started_at, attempts=row["attempts"] + 1)
+        return job
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+        )
+        with self._finished:
+            self._finished.notify_all()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._decode(row) if row else None
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Long-poll: return the job once it has finished or timeout has passed.
+        Jobs finished in this process wake the waiter at once; jobs finished
+        by another process are noticed within POLL_INTERVAL.
+        """
+        deadline = time.monotonic() + timeout
+        poll_interval = settings.LLM_JOB_QUEUE['POLL_INTERVAL']
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in (DONE, FAILED) or remaining <= 0:
+                return job
+            with self._finished:
+                self._finished.wait(min(poll_interval, remaining))
+
+    def requeue_stale(self, stale_after: float, max_attempts: int) -> int:
+        """Re-queue jobs whose worker disappeared; fail them after max_attempts."""
+        conn = self._connection()
+        cutoff = time.time() - stale_after
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+            "WHERE status = ? AND started_at < ? AND attempts >= ?",
+            (FAILED, "Worker lost while running the job", time.time(), RUNNING, cutoff, max_attempts)
+        )
+        return conn.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ? AND started_at < ?",
+            (QUEUED, RUNNING, cutoff)
+        ).rowcount
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs older than older_than seconds."""
+        return self._connection().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (DONE, FAILED, time.time() - older_than)
+        ).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connection()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        timing = conn.execute(
+            "SELECT AVG(started_at - created_at), AVG(finished_at - started_at) FROM jobs "
+            "WHERE status = ? AND finished_at > ?",
+            (DONE, time.time() - 3600)
+        ).fetchone()
+        return {
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "done": counts.get(DONE, 0),
+            "failed": counts.get(FAILED, 0),
+            "mean_queue_wait_ms": int((timing[0] or 0) * 1000),
+            "mean_run_ms": int((timing[1] or 0) * 1000),
+        }
+
+    def _decode(self, row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+# Job handlers by kind: handler(payload) returns the result stored for the client
+_handlers: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+
+def register_job_handler(kind: str, handler: Callable[[Dict[str, Any]], Dict[str, Any]]):
+    _handlers[kind] = handler
+
+class JobWorkerPool:
+    """Threads that claim jobs from a JobQueue and run their handlers."""
+
+    def __init__(self, queue: JobQueue, workers: int):
+        self.queue = queue
+        self.workers = workers
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        config = settings.LLM_JOB_QUEUE
+        requeued = self.queue.requeue_stale(config['STALE_AFTER_SECONDS'], config['MAX_ATTEMPTS'])
+        if requeued:
+            print(f"Re-queued {requeued} chat jobs left running by a previous worker")
+        self.queue.purge(config['RETENTION_HOURS'] * 3600)
+
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"chat-job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        """Wake an idle worker after a job was enqueued in this process."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        poll_interval = settings.LLM_JOB_QUEUE['POLL_INTERVAL']
+        while not self._stopping.is_set():
+            try:
+                job = self.queue.claim()
+            except sqlite3.OperationalError as e:
+                print(f"Error claiming chat job: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wake.wait(poll_interval)
+                self._wake.clear()
+                continue
+
+            self._execute(job)
+
+    def _execute(self, job: Dict[str, Any]):
+        handler = _handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise JobFailed(f"No handler for job kind {job['kind']}")
+            self.queue.finish(job["id"], DONE, handler(job["payload"]))
+        except JobFailed as e:
+            self.queue.finish(job["id"], FAILED, e.result, str(e))
+        except Exception as e:
+            print(f"Chat job {job['id']} failed: {str(e)}")
+            self.queue.finish(job["id"], FAILED, None, str(e))
+        finally:
+            close_old_connections()
+
+_job_queue = None
+_worker_pool = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, starting in-process workers if configured."""
+    global _job_queue, _worker_pool
+    with _job_queue_lock:
+        if _job_queue is None:
+            config = settings.LLM_JOB_QUEUE
+            _job_queue = JobQueue(config['PATH'])
+            if config['IN_PROCESS']:
+                _worker_pool = JobWorkerPool(_job_queue, config['WORKERS'])
+                _worker_pool.start()
+    return _job_queue
+
+def enqueue_job(kind: str, payload: Dict[str, Any], owner: Optional[str] = None) -> str:
+    job_id = get_job_queue().enqueue(kind, payload, owner)
+    if _worker_pool:
+        _worker_pool.notify()
+    return job_id
+
+def job_queue_stats() -> Optional[Dict[str, Any]]:
+    """Queue counts for the status endpoint, or None if this process has not used the queue."""
+    return _job_queue.stats() if _job_queue else None
@@ -0,0 +1,157 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+from django.conf import settings
+from django.core.cache import caches
+
+def normalize_message(text: str) -> str:
+    """Normalize a user message so trivially different phrasings share a cache key."""
+    text = re.sub(r"\s+", " ", (text or "").strip().lower())
+    return text.rstrip("?!. ")
+
+def prompt_version() -> str:
+    """Short fingerprint of the system prompt; editing the prompt invalidates the cache."""
+    return hashlib.sha256(settings.GYNECOLOGY_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+def prior_history(chat_history: List[Any], user_message: str) -> List[Any]:
+    """History without the current user message, which the views save before generating."""
+    chat_history = list(chat_history or [])
+    if chat_history:
+        last = chat_history[-1]
+        if last.message_type == "user" and last.content == user_message:
+            return chat_history[:-1]
+    return chat_history
+
+def history_hash(chat_history: List[Any]) -> str:
+    """Stable hash of the conversation so far."""
+    digest = hashlib.sha256()
+    for msg in chat_history:
+        digest.update(f"{msg.message_type}:{msg.content}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def request_key(user_message: str, chat_history: List[Any], scope: str = "") -> str:
+    """
+    Key identifying one question in one conversation context. scope separates
+    answers produced under different provider routing.
+    """
+    history = prior_history(chat_history, user_message)
+    raw = f"{prompt_version()}|{scope}|{history_hash(history)}|{normalize_message(user_message)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class InProcessBackend:
+    """Thread-safe LRU dictionary with per-entry expiry."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self._entries)
+
+class DjangoCacheBackend:
+    """Backend on a configured Django cache, shared between worker processes."""
+
+    key_prefix = "llm-response:"
+
+    def __init__(self, alias: str):
+        self.cache = caches[alias]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.cache.get(self.key_prefix + key)
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float):
+        self.cache.set(self.key_prefix + key, value, timeout=ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+    def size(self) -> Optional[int]:
+        # Not cheaply available for most Django cache backends
+        return None
+
+class ResponseCache:
+    """
+    Exact-match cache of generated chat answers.
+
+    Keys combine the normalized user message, the system prompt version and
+    a hash of the prior conversation, so a cached answer is only reused for
+    the same question asked in the same context.
+    """
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, user_message: str, chat_history: List[Any], scope: str = "") -> str:
+        return request_key(user_message, chat_history, scope)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        self.backend.set(key, value, self.ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the configured response cache, or None when it is disabled."""
+    global _response_cache
+    config = settings.LLM_RESPONSE_CACHE
+    if not config.get('ENABLED', True):
+        return None
+
+    with _response_cache_lock:
+        if _response_cache is None:
+            if config.get('BACKEND', 'memory') == 'django':
+                backend = DjangoCacheBackend(config.get('CACHE_ALIAS', 'default'))
+            else:
+                backend = InProcessBackend(config.get('MAX_ENTRIES', 1000))
+            _response_cache = ResponseCache(backend, config.get('TTL', 3600))
+    return _response_cache
@@ -1,60 +1,374 @@
 import asyncio
-from typing import Dict, List, Any, Tuple
+import concurrent.futures
+import contextvars
+import queue
+from typing import Dict, List, Any, Tuple, Optional, AsyncIterator, Iterator
 import google.generativeai as genai
 from django.conf import settings
 import threading
 import time
-from apps.chatbot.api import get_openai_response_sync, get_gemini_response_sync, get_grok_response_sync
+from utils.llm_cache import get_response_cache, request_key
+from utils.single_flight import single_flight
+from utils.chat_history import HistoryEntry, estimate_tokens
+from utils.rate_limit import (
+    rate_limiters, RateLimitExceeded, ProviderRateLimited, PRIORITY_INTERACTIVE
+)
+from utils.semantic_cache import get_semantic_cache
+from utils.circuit_breaker import circuit_breakers
+from utils.provider_router import get_router
+from utils.turn_registry import Turn, TurnCancelled
+from apps.chatbot.providers import provider_registry
 
 # Configure Gemini for evaluation with new API
 if settings.GEMINI_API_KEY:
     genai.configure(api_key=settings.GEMINI_API_KEY)
 
-def generate_all_responses_sync(user_message: str, chat_history: List[Any]) -> Dict[str, str]:
-    """Generate responses from all AI models using threads."""
-    # Initialize response dictionary
-    response_dict = {}
-    
-    # Define functions to run in threads
-    def get_openai():
-        try:
-            response = get_openai_response_sync(user_message, chat_history)
-            if response and not response.startswith("Error"):
-                response_dict["openai"] = response
-        except Exception as e:
-            print(f"OpenAI thread error: {str(e)}")
-    
-    def get_gemini():
+class Deadline:
+    """End-to-end time budget for one chat turn, shared by every provider step."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def provider_timeout(self, share: float = 1.0) -> float:
+        """Timeout for the next provider call: its own cap or a share of what is left."""
+        return min(settings.LLM_PROVIDER_TIMEOUT, self.remaining() * share)
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide LLM event loop, starting it on first use."""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None or _event_loop.is_closed():
+            _event_loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=_event_loop.run_forever,
+                name="llm-event-loop",
+                daemon=True
+            )
+            thread.start()
+    return _event_loop
+
+def run_sync(coro, timeout: Optional[float] = None, turn: Optional[Turn] = None):
+    """
+    Run a coroutine on the shared LLM event loop and wait for its result.
+    On timeout the coroutine is cancelled before the error is raised. With a
+    turn, cancelling the turn cancels the coroutine and raises TurnCancelled.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    if turn is not None:
+        turn.attach(future)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+    except concurrent.futures.CancelledError:
+        if turn is not None:
+            turn.check()
+        raise
+    finally:
+        if turn is not None:
+            turn.detach(future)
+
+_STREAM_END = object()
+
+def iterate_sync(agen: AsyncIterator[Any], deadline: "Deadline",
+                 turn: Optional[Turn] = None) -> Iterator[Any]:
+    """
+    Drive an async generator on the shared LLM event loop and yield its items
+    to the calling thread. Closing the returned iterator early (for example
+    when the HTTP client disconnects) cancels the async side, and so does
+    cancelling the turn, which then raises TurnCancelled.
+    """
+    items = queue.Queue()
+
+    async def pump():
         try:
-            response = get_gemini_response_sync(user_message, chat_history)
-            if response and not response.startswith("Error"):
-                response_dict["gemini"] = response
+            async for item in agen:
+                items.put(item)
         except Exception as e:
-            print(f"Gemini thread error: {str(e)}")
-    
-    def get_grok():
-        try:
-            response = get_grok_response_sync(user_message, chat_history)
+            items.put(e)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+    # Also fires if the pump is cancelled before it starts
+    future.add_done_callback(lambda _: items.put(_STREAM_END))
+    if turn is not None:
+        turn.attach(future)
+    try:
+        while True:
+            try:
+                item = items.get(timeout=deadline.remaining() + 1)
+            except queue.Empty:
+                raise TimeoutError("Turn deadline exceeded while streaming")
+            if item is _STREAM_END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        if turn is not None:
+            turn.check()
+    finally:
+        future.cancel()
+        if turn is not None:
+            turn.detach(future)
+
+# Providers that turned a call away for rate limiting during the current
+# turn, with their retry-after seconds (a dict shared by the turn's tasks)
+_rate_limited = contextvars.ContextVar("rate_limited", default=None)
+
+def _request_tokens(user_message: str, chat_history: List[Any]) -> int:
+    """Estimated prompt plus completion tokens of one provider call, for the TPM bucket."""
+    prompt = estimate_tokens(user_message) + sum(
+        msg.tokens if isinstance(msg, HistoryEntry) else estimate_tokens(msg.content)
+        for msg in chat_history
+    )
+    return prompt + settings.LLM_RATE_LIMIT_QUEUE['RESPONSE_TOKENS']
+
+def _note_rate_limited(name: str, retry_after: Optional[float]):
+    limited = _rate_limited.get()
+    if limited is not None:
+        limited[name] = retry_after or settings.LLM_RATE_LIMIT_QUEUE['DEFAULT_RETRY_AFTER']
+
+async def _admit(name: str, user_message: str, chat_history: List[Any], timeout: float,
+                 priority: int) -> Optional[float]:
+    """
+    Wait for the provider's rate limiter. Returns the timeout left for the
+    call itself, or None if the limiter turned the call away.
+    """
+    started = time.monotonic()
+    try:
+        await rate_limiters.get(name).acquire(_request_tokens(user_message, chat_history), priority, timeout)
+    except RateLimitExceeded as e:
+        print(f"{name} call turned away: {str(e)}")
+        _note_rate_limited(name, e.retry_after)
+        return None
+    return timeout - (time.monotonic() - started)
+
+async def _call_provider(name: str, user_message: str, chat_history: List[Any],
+                         timeout: float, record: bool = True,
+                         priority: int = PRIORITY_INTERACTIVE) -> Optional[str]:
+    """
+    Call one provider under its deadline, returning None on failure.
+    The call first waits for the provider's rate limiter. The outcome is fed
+    to the provider's circuit breaker unless record is False; rate limiting
+    is not counted as a provider failure.
+    """
+    timeout = await _admit(name, user_message, chat_history, timeout, priority)
+    if timeout is None:
+        return None
+    if timeout <= 0:
+        print(f"{name} deadline used up waiting for the rate limiter")
+        return None
+
+    started = time.monotonic()
+    error = None
+    response = None
+    try:
+        provider = provider_registry.get(name)
+        response = await asyncio.wait_for(provider.call(user_message, chat_history, timeout), timeout)
+        if not response or response.startswith("Error"):
+            error = (response or "Empty response")[:200]
+            response = None
+    except asyncio.TimeoutError:
+        print(f"{name} timed out after {timeout:.1f}s")
+        error = f"Timed out after {timeout:.1f}s"
+    except ProviderRateLimited as e:
+        print(f"{name} returned a rate-limit error: {str(e)}")
+        rate_limiters.get(name).penalize(e.retry_after)
+        _note_rate_limited(name, e.retry_after)
+        return None
+    except Exception as e:
+        print(f"{name} provider error: {str(e)}")
+        error = str(e)[:200]
+
+    if record:
+        _record_outcome(name, error is None, time.monotonic() - started, error)
+    return response
+
+def _record_outcome(name: str, ok: bool, latency: float, error: Optional[str] = None):
+    """Feed a live call's outcome to the provider's circuit breaker and the router."""
+    circuit_breakers.get(name).record(ok, latency, error)
+    router = get_router()
+    if router:
+        router.observe(name, ok, latency)
+
+def available_providers(names: List[str]) -> List[str]:
+    """Providers from names whose circuit breaker lets live traffic through."""
+    return [name for name in names if circuit_breakers.allow(name)]
+
+def _schedule_probe(name: str):
+    """Probe an open provider in the background once its cooldown has passed."""
+    loop = get_event_loop()
+    cooldown = settings.LLM_CIRCUIT_BREAKER['COOLDOWN_SECONDS']
+    loop.call_soon_threadsafe(
+        loop.call_later, cooldown, lambda: loop.create_task(_probe_provider(name))
+    )
+
+async def _probe_provider(name: str):
+    breaker = circuit_breakers.get(name)
+    breaker.begin_probe()
+    timeout = settings.LLM_PROVIDER_TIMEOUT
+    try:
+        healthy = await asyncio.wait_for(provider_registry.get(name).health(timeout), timeout)
+        error = None if healthy else "Probe failed"
+    except Exception as e:
+        healthy = False
+        error = f"Probe failed: {str(e) or type(e).__name__}"
+    breaker.probe_result(healthy, error)
+
+circuit_breakers.on_open = _schedule_probe
+
+async def generate_all_responses(user_message: str, chat_history: List[Any],
+                                 timeout: Optional[float] = None) -> Dict[str, str]:
+    """
+    Fan out to all providers concurrently on the running event loop.
+    Each provider gets its own deadline; if the caller is cancelled the
+    outstanding provider calls are cancelled with it.
+    """
+    timeout = timeout or settings.LLM_PROVIDER_TIMEOUT
+    tasks = {
+        name: asyncio.ensure_future(_call_provider(name, user_message, chat_history, timeout))
+        for name in available_providers(provider_registry.names())
+    }
+
+    if not tasks:
+        return {}
+
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            if not task.done():
+                task.cancel()
+
+    return {name: task.result() for name, task in tasks.items() if task.result()}
+
+def generate_all_responses_sync(user_message: str, chat_history: List[Any]) -> Dict[str, str]:
+    """Generate responses from all AI models on the shared event loop."""
+    # Materialize querysets here: the ORM must not be touched from the loop thread
+    chat_history = list(chat_history or [])
+    timeout = settings.LLM_PROVIDER_TIMEOUT
+    return run_sync(
+        generate_all_responses(user_message, chat_history, timeout),
+        timeout=timeout + 1
+    )
+
+def provider_priority() -> List[str]:
+    """Return the configured provider preference order, most preferred first."""
+    names = provider_registry.names()
+    priority = [name for name in settings.LLM_PROVIDER_PRIORITY if name in names]
+    return priority + [name for name in names if name not in priority]
+
+def real_provider_priority() -> List[str]:
+    """provider_priority without simulated (mock) adapters, for output that is stored."""
+    return [name for name in provider_priority() if not provider_registry.get(name).simulated]
+
+def route_providers(user=None) -> Optional[List[str]]:
+    """
+    Routing stage for a chat turn. Returns the single-provider ladder for
+    users who turned off model comparison, or None to run the comparison
+    fan-out. The ladder starts with the user's preferred provider; with
+    adaptive routing on, the router may put a much faster healthy provider
+    first instead. The remaining providers are only used as fallbacks.
+    """
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return None
+    if getattr(user, 'show_all_models', True):
+        return None
+
+    priority = provider_priority()
+    preferred = getattr(user, 'preferred_model', None)
+    if preferred not in priority:
+        return None
+
+    router = get_router()
+    if router:
+        return router.rank(priority, preferred)
+    return [preferred] + [name for name in priority if name != preferred]
+
+async def race_responses(user_message: str, chat_history: List[Any],
+                         timeout: Optional[float] = None,
+                         grace: Optional[float] = None) -> Dict[str, str]:
+    """
+    Hedged fan-out: return as soon as the first acceptable answer is settled.
+
+    An answer wins immediately once no higher-priority provider is still
+    running. A lower-priority answer waits at most `grace` seconds for a
+    preferred provider to finish. Stragglers are cancelled. Only real
+    providers race; simulated (mock) ones are asked in turn, and only when
+    every real provider failed. With mocks only (LLM_MOCK_PROVIDERS), the
+    mocks race.
+    """
+    timeout = timeout or settings.LLM_PROVIDER_TIMEOUT
+    grace = settings.LLM_HEDGE_GRACE_SECONDS if grace is None else grace
+    priority = available_providers(real_provider_priority() or provider_priority())
+    simulated = [name for name in available_providers(provider_priority()) if name not in priority]
+    loop = asyncio.get_running_loop()
+
+    tasks = {
+        asyncio.ensure_future(_call_provider(name, user_message, chat_history, timeout)): name
+        for name in priority
+    }
+    pending = set(tasks)
+    responses = {}
+    grace_deadline = None
+
+    try:
+        while pending:
+            wait_timeout = None
+            if grace_deadline is not None:
+                wait_timeout = max(0.0, grace_deadline - loop.time())
+
+            done, pending = await asyncio.wait(
+                pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                # Grace window expired before a preferred provider answered
+                break
+
+            for task in done:
+                if task.result():
+                    responses[tasks[task]] = task.result()
+
+            if not responses:
+                continue
+
+            best_rank = min(priority.index(name) for name in responses)
+            if all(priority.index(tasks[task]) > best_rank for task in pending):
+                break
+            if grace_deadline is None:
+                grace_deadline = loop.time() + grace
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if not responses:
+        for name in simulated:
+            response = await _call_provider(name, user_message, chat_history, timeout)
             if response:
-                response_dict["grok"] = response
-        except Exception as e:
-            print(f"Grok thread error: {str(e)}")
-    
-    # Create and start threads
-    threads = [
-        threading.Thread(target=get_openai),
-        threading.Thread(target=get_gemini),
-        threading.Thread(target=get_grok)
-    ]
-    
-    for thread in threads:
-        thread.start()
-    
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
-    
-    return response_dict
+                responses[name] = response
+                break
+
+    return responses
+
+def race_responses_sync(user_message: str, chat_history: List[Any]) -> Dict[str, str]:
+    """Hedged counterpart of generate_all_responses_sync."""
+    chat_history = list(chat_history or [])
+    timeout = settings.LLM_PROVIDER_TIMEOUT
+    return run_sync(
+        race_responses(user_message, chat_history, timeout),
+        timeout=timeout + 1
+    )
 
 def evaluate_responses_sync(responses: Dict[str, str], user_message: str) -> Tuple[str, str, str]:
     """
@@ -71,14 +385,13 @@ def evaluate_responses_sync(responses: Dict[str, str], user_message: str) -> Tup
         return "system", "I'm sorry, all AI models are currently unavailable. Please try again later.", ""
     
     try:
-        # If Gemini API key is not available or evaluation fails, return Gemini first (if available), then others
-        if "gemini" in responses:
-            return "gemini", responses["gemini"], "Gemini response selected as default."
-        elif "openai" in responses:
-            return "openai", responses["openai"], "OpenAI response selected."
-        else:
-            model_name = list(responses.keys())[0]
-            return model_name, responses[model_name], "Default response selected."
+        # Pick by configured provider priority (Gemini first by default)
+        for model_name in provider_priority():
+            if model_name in responses:
+                return model_name, responses[model_name], f"{model_name} response selected by provider priority."
+
+        model_name = list(responses.keys())[0]
+        return model_name, responses[model_name], "Default response selected."
         
     except Exception as e:
         # Prioritize Gemini in the fallback case too
@@ -93,45 +406,293 @@ def evaluate_responses_sync(responses: Dict[str, str], user_message: str) -> Tup
             default_model = list(responses.keys())[0]
             return default_model, responses[default_model], f"Evaluation error: {str(e)}"
 
-def generate_ai_responses(user_message: str, chat_history: List[Any]) -> Dict[str, Any]:
+async def run_fallback_ladder(user_message: str, chat_history: List[Any],
+                              deadline: Deadline,
+                              ladder: Optional[List[str]] = None,
+                              priority: int = PRIORITY_INTERACTIVE) -> Tuple[Dict[str, str], Optional[int], float]:
     """
-    Generate responses from multiple models and select the best one.
-    This is a fully synchronous implementation with Gemini as the preferred fallback.
+    Try providers one at a time in ladder order while the turn budget lasts.
+    Returns (responses, index of the step that answered, seconds that step used).
+    priority orders the calls in the providers' rate-limit queues.
     """
-    try:
-        # Get responses from all models
-        all_responses = generate_all_responses_sync(user_message, chat_history)
-        
-        # Evaluate and select the best response
-        best_model, best_response, explanation = evaluate_responses_sync(all_responses, user_message)
-        
-        return {
-            "all_responses": all_responses,
-            "best_model": best_model,
-            "best_response": best_response,
-            "explanation": explanation
+    ladder = ladder or settings.LLM_FALLBACK_LADDER
+
+    for index, name in enumerate(ladder):
+        if name not in provider_registry or not circuit_breakers.allow(name):
+            continue
+        if deadline.remaining() < settings.LLM_MIN_STEP_SECONDS:
+            print(f"Turn budget exhausted before fallback step {index} ({name})")
+            break
+
+        step_started = time.monotonic()
+        response = await _call_provider(
+            name, user_message, chat_history, deadline.provider_timeout(), priority=priority
+        )
+        if response:
+            return {name: response}, index, time.monotonic() - step_started
+
+    return {}, None, 0.0
+
+async def _generate_turn(user_message: str, chat_history: List[Any], mode: str,
+                         deadline: Deadline, ladder: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Fan out within part of the budget, then walk the fallback ladder if nothing
+    answered. With a routed ladder only its first provider is called, the rest
+    only on failure. If nothing answered and providers turned calls away for
+    rate limiting, the result carries "rate_limited" with a retry-after hint.
+    """
+    limited = {}
+    _rate_limited.set(limited)
+
+    if ladder:
+        all_responses, fallback_step, step_seconds = await run_fallback_ladder(
+            user_message, chat_history, deadline, ladder
+        )
+        step = "preferred" if fallback_step == 0 else "fallback"
+    else:
+        timeout = deadline.provider_timeout(settings.LLM_FANOUT_BUDGET_SHARE)
+        step_started = time.monotonic()
+
+        if mode == "race":
+            all_responses = await race_responses(user_message, chat_history, timeout)
+        else:
+            all_responses = await generate_all_responses(user_message, chat_history, timeout)
+
+        step = mode
+        fallback_step = None
+        step_seconds = time.monotonic() - step_started
+
+    if not all_responses and not ladder:
+        print("No provider answered in the fan-out, walking the fallback ladder")
+        all_responses, fallback_step, step_seconds = await run_fallback_ladder(
+            user_message, chat_history, deadline
+        )
+        step = "fallback"
+
+    # Evaluate and select the best response
+    best_model, best_response, explanation = evaluate_responses_sync(all_responses, user_message)
+
+    result = {
+        "all_responses": all_responses,
+        "best_model": best_model,
+        "best_response": best_response,
+        "explanation": explanation,
+        "timing": {
+            "step": step,
+            "fallback_step": fallback_step,
+            "step_ms": int(step_seconds * 1000),
+            "total_ms": int(deadline.elapsed() * 1000),
+            "budget_ms": int(deadline.seconds * 1000),
         }
-    except Exception as e:
-        print(f"Error in generate_ai_responses: {str(e)}")
-        
-        # Try Gemini first as fallback
+    }
+    if not all_responses and limited:
+        result["rate_limited"] = {
+            "providers": sorted(limited),
+            "retry_after": round(min(limited.values()), 1),
+        }
+    return result
+
+def _cacheable(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a turn result worth caching (timing is per request)."""
+    return {
+        "all_responses": result["all_responses"],
+        "best_model": result["best_model"],
+        "best_response": result["best_response"],
+        "explanation": result["explanation"],
+    }
+
+def _cached_result(cached: Dict[str, Any], deadline: Deadline, step: str = "cache") -> Dict[str, Any]:
+    """Turn a cache entry back into a full generate_ai_responses result."""
+    result = dict(cached)
+    result["cached"] = True
+    result["timing"] = {
+        "step": step,
+        "fallback_step": None,
+        "step_ms": int(deadline.elapsed() * 1000),
+        "total_ms": int(deadline.elapsed() * 1000),
+        "budget_ms": int(deadline.seconds * 1000),
+    }
+    return result
+
+def generate_ai_responses(user_message: str, chat_history: List[Any],
+                          mode: Optional[str] = None, user=None,
+                          turn: Optional[Turn] = None) -> Dict[str, Any]:
+    """
+    Generate responses from multiple models and select the best one.
+
+    mode is "all" (wait for every provider) or "race" (first acceptable
+    answer wins); it defaults to settings.LLM_RESPONSE_MODE. When user has
+    show_all_models off, only their preferred_model is called, with the
+    other providers as fallbacks. The whole turn, fallbacks included, is
+    capped by settings.LLM_TURN_DEADLINE. Identical concurrent turns share
+    one generation; the followers' results are marked "coalesced".
+    Cancelling turn stops the outstanding provider calls and raises
+    TurnCancelled.
+    """
+    mode = mode or settings.LLM_RESPONSE_MODE
+    deadline = Deadline(settings.LLM_TURN_DEADLINE)
+    # Materialize querysets here: the ORM must not be touched from the loop thread
+    chat_history = list(chat_history or [])
+    ladder = route_providers(user)
+    scope = f"preferred:{ladder[0]}" if ladder else "compare"
+
+    cache = get_response_cache()
+    cache_key = cache.make_key(user_message, chat_history, scope) if cache else None
+    if cache:
+        cached = cache.get(cache_key)
+        if cached:
+            return _cached_result(cached, deadline)
+
+    semantic_cache = get_semantic_cache()
+    if semantic_cache:
+        match = semantic_cache.lookup(user_message, chat_history)
+        if match and (not ladder or match["best_model"] == ladder[0]):
+            return _cached_result(match, deadline, step="semantic_cache")
+
+    def generate():
         try:
-            gemini_response = get_gemini_response_sync(user_message, chat_history)
-            if gemini_response and not gemini_response.startswith("Error"):
-                return {
-                    "all_responses": {"gemini": gemini_response},
-                    "best_model": "gemini",
-                    "best_response": gemini_response,
-                    "explanation": f"Fallback to Gemini due to error: {str(e)}"
+            result = run_sync(
+                _generate_turn(user_message, chat_history, mode, deadline, ladder),
+                timeout=deadline.remaining() + 1,
+                turn=turn
+            )
+            # The semantic cache only serves seeded answers; live answers are not added to it.
+            # Mock answers are never cached: they embed the asker's question text
+            if cache and result["best_model"] in real_provider_priority():
+                cache.set(cache_key, _cacheable(result))
+            return result
+        except TurnCancelled:
+            raise
+        except Exception as e:
+            print(f"Error in generate_ai_responses: {str(e)}")
+
+            best_model, best_response, explanation = evaluate_responses_sync({}, user_message)
+            return {
+                "all_responses": {},
+                "best_model": best_model,
+                "best_response": best_response,
+                "explanation": f"Turn deadline exceeded or generation failed: {str(e)}",
+                "timing": {
+                    "step": "failed",
+                    "fallback_step": None,
+                    "step_ms": 0,
+                    "total_ms": int(deadline.elapsed() * 1000),
+                    "budget_ms": int(deadline.seconds * 1000),
                 }
-        except Exception as gemini_error:
-            print(f"Gemini fallback error: {str(gemini_error)}")
-        
-        # If Gemini fails, use Grok as the final fallback
-        grok_response = get_grok_response_sync(user_message, chat_history)
-        return {
-            "all_responses": {"grok": grok_response},
-            "best_model": "grok",
-            "best_response": grok_response,
-            "explanation": f"Fallback to Grok after both evaluation and Gemini fallback failed."
-        }
+            }
+
+    if not settings.LLM_SINGLE_FLIGHT:
+        return generate()
+
+    # Identical concurrent turns (same question, context, mode and providers) share one generation
+    providers = ladder or available_providers(provider_priority())
+    flight_key = request_key(user_message, chat_history, f"{mode}|{','.join(providers)}")
+    result, shared = single_flight.do(
+        flight_key, generate, timeout=deadline.remaining() + 1, rerun_on=(TurnCancelled,)
+    )
+    if shared:
+        result = dict(result)
+        result["coalesced"] = True
+    return result
+
+async def stream_response(user_message: str, chat_history: List[Any], deadline: Deadline,
+                          order: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Stream from the first provider, in order (priority order by default),
+    that starts answering. Yields (provider, chunk) pairs. A provider that
+    fails before its first chunk is skipped; once chunks have been sent the
+    stream is committed. Raises RateLimitExceeded if nothing was streamed
+    because providers turned the call away for rate limiting.
+    """
+    limited = {}
+    _rate_limited.set(limited)
+
+    for name in available_providers(order or provider_priority()):
+        if name not in provider_registry:
+            continue
+        if deadline.remaining() < settings.LLM_MIN_STEP_SECONDS:
+            print(f"Turn budget exhausted before streaming from {name}")
+            break
+        if await _admit(name, user_message, chat_history, deadline.provider_timeout(), PRIORITY_INTERACTIVE) is None:
+            continue
+
+        stream = provider_registry.get(name).stream(user_message, chat_history, deadline.provider_timeout())
+        stream_started = time.monotonic()
+        started = False
+        try:
+            while True:
+                # Time to first chunk is capped per provider, later chunks by the turn budget
+                timeout = deadline.remaining() if started else deadline.provider_timeout()
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                started = True
+                yield name, chunk
+        except ProviderRateLimited as e:
+            if started:
+                raise
+            print(f"{name} returned a rate-limit error: {str(e)}")
+            rate_limiters.get(name).penalize(e.retry_after)
+            _note_rate_limited(name, e.retry_after)
+            continue
+        except Exception as e:
+            _record_outcome(name, False, time.monotonic() - stream_started, str(e)[:200])
+            if started:
+                raise
+            print(f"{name} stream failed before first token: {str(e) or type(e).__name__}")
+            continue
+        finally:
+            await stream.aclose()
+
+        _record_outcome(name, started, time.monotonic() - stream_started, None if started else "Empty stream")
+        if started:
+            return
+
+    if limited:
+        name, retry_after = min(limited.items(), key=lambda item: item[1])
+        raise RateLimitExceeded(name, retry_after, "no provider has capacity")
+
+def stream_ai_response(user_message: str, chat_history: List[Any], user=None,
+                       turn: Optional[Turn] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Blocking iterator of (provider, chunk) pairs for one chat turn, capped
+    by settings.LLM_TURN_DEADLINE. Streams from the user's preferred provider
+    first when they turned off model comparison. Yields nothing if no
+    provider answered; raises TurnCancelled if turn is cancelled.
+    """
+    deadline = Deadline(settings.LLM_TURN_DEADLINE)
+    # Materialize querysets here: the ORM must not be touched from the loop thread
+    chat_history = list(chat_history or [])
+    ladder = route_providers(user)
+    scope = f"preferred:{ladder[0]}" if ladder else "compare"
+
+    cache = get_response_cache()
+    cache_key = cache.make_key(user_message, chat_history, scope) if cache else None
+    if cache:
+        cached = cache.get(cache_key)
+        if cached:
+            yield cached["best_model"], cached["best_response"]
+            return
+
+    semantic_cache = get_semantic_cache()
+    if semantic_cache:
+        match = semantic_cache.lookup(user_message, chat_history)
+        if match and (not ladder or match["best_model"] == ladder[0]):
+            yield match["best_model"], match["best_response"]
+            return
+
+    chunks = []
+    model_name = None
+    for model_name, chunk in iterate_sync(stream_response(user_message, chat_history, deadline, ladder), deadline, turn):
+        chunks.append(chunk)
+        yield model_name, chunk
+
+    if cache and chunks:
+        content = "".join(chunks)
+        cache.set(cache_key, {
+            "all_responses": {model_name: content},
+            "best_model": model_name,
+            "best_response": content,
+            "explanation": f"Streamed from {model_name}.",
+        })
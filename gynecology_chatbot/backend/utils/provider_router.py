@@ -0,0 +1,160 @@
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Any, Optional
+from django.conf import settings
+from utils.circuit_breaker import circuit_breakers
+
+class ProviderStats:
+    """Exponentially weighted moving averages of one provider's latency and success."""
+
+    def __init__(self, latency: Optional[float] = None, success: float = 1.0, samples: int = 0):
+        self.latency = latency
+        self.success = success
+        self.samples = samples
+
+    def observe(self, ok: bool, latency: float, alpha: float):
+        self.samples += 1
+        self.success = alpha * (1.0 if ok else 0.0) + (1 - alpha) * self.success
+        # Failed calls often return early, so only successes update latency
+        if ok:
+            self.latency = latency if self.latency is None else alpha * latency + (1 - alpha) * self.latency
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"latency": self.latency, "success": self.success, "samples": self.samples}
+
+class AdaptiveRouter:
+    """
+    Latency-aware ordering of providers for single-provider chat turns.
+
+    Providers are eligible when their circuit breaker is closed, their EWMA
+    success rate is above MIN_SUCCESS_RATE and their configured quality score
+    meets QUALITY_FLOOR. Eligible providers are ordered fastest first; the
+    others follow as a last-resort fallback. Statistics are saved to a small
+    JSON file so routing survives process restarts.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.alpha = config['ALPHA']
+        self.quality = config['QUALITY']
+        self.quality_floor = config['QUALITY_FLOOR']
+        self.min_success = config['MIN_SUCCESS_RATE']
+        self.preference_slack = config['PREFERENCE_SLACK']
+        self.explore_rate = config.get('EXPLORE_RATE', 0.0)
+        self.stats_path = config.get('STATS_PATH')
+        self.save_interval = config.get('SAVE_INTERVAL_SECONDS', 30)
+        self._stats: Dict[str, ProviderStats] = {}
+        self._lock = threading.Lock()
+        self._last_save = time.monotonic()
+        self._dirty = False
+        self.load()
+
+    def observe(self, name: str, ok: bool, latency: float):
+        with self._lock:
+            self._stats.setdefault(name, ProviderStats()).observe(ok, latency, self.alpha)
+            self._dirty = True
+            due = time.monotonic() - self._last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def is_eligible(self, name: str) -> bool:
+        stats = self._stats.get(name)
+        return (
+            circuit_breakers.allow(name)
+            and self.quality.get(name, 0.0) >= self.quality_floor
+            and (stats is None or stats.success >= self.min_success)
+        )
+
+    def rank(self, candidates: List[str], preferred: Optional[str] = None) -> List[str]:
+        """
+        Order candidates fastest healthy first. A preferred provider keeps the
+        first slot while it is eligible and no slower than PREFERENCE_SLACK
+        times the fastest one. A small share of turns (EXPLORE_RATE) keeps the
+        preference regardless, so slower providers' statistics stay current.
+        """
+        with self._lock:
+            eligible = [name for name in candidates if self.is_eligible(name)]
+            # Providers without samples sort first so they get measured
+            eligible.sort(key=lambda name: (self._latency(name) is not None, self._latency(name) or 0.0))
+            measured = [self._latency(name) for name in eligible if self._latency(name) is not None]
+            fastest = min(measured) if measured else None
+
+            if preferred in eligible:
+                latency = self._latency(preferred)
+                # Without measurements on both sides there is nothing to beat the preference
+                keep_preference = (
+                    self.preference_slack is None
+                    or latency is None
+                    or fastest is None
+                    or latency <= fastest * self.preference_slack
+                    or random.random() < self.explore_rate
+                )
+                if keep_preference:
+                    eligible.remove(preferred)
+                    eligible.insert(0, preferred)
+
+        return eligible + [name for name in candidates if name not in eligible]
+
+    def _latency(self, name: str) -> Optional[float]:
+        """EWMA latency of successful calls, or None before the first one."""
+        stats = self._stats.get(name)
+        return stats.latency if stats else None
+
+    def load(self):
+        if not self.stats_path or not os.path.exists(self.stats_path):
+            return
+        try:
+            with open(self.stats_path) as f:
+                data = json.load(f)
+            self._stats = {name: ProviderStats(**values) for name, values in data.items()}
+        except Exception as e:
+            print(f"Error loading provider router stats: {str(e)}")
+
+    def save(self):
+        """Write the statistics atomically; safe to call from any thread."""
+        with self._lock:
+            self._last_save = time.monotonic()
+            if not self.stats_path or not self._dirty:
+                return
+            data = {name: stats.to_dict() for name, stats in self._stats.items()}
+            self._dirty = False
+
+        try:
+            tmp_path = f"{self.stats_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.stats_path)
+        except Exception as e:
+            print(f"Error saving provider router stats: {str(e)}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                name: {
+                    "latency_ms": int(stats.latency * 1000) if stats.latency is not None else None,
+                    "success_rate": round(stats.success, 3),
+                    "samples": stats.samples,
+                    "quality": self.quality.get(name, 0.0),
+                    "eligible": self.is_eligible(name),
+                }
+                for name, stats in self._stats.items()
+            }
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_router() -> Optional[AdaptiveRouter]:
+    """Return the process-wide router, or None when adaptive routing is disabled."""
+    global _router
+    config = settings.LLM_ADAPTIVE_ROUTING
+    if not config.get('ENABLED', True):
+        return None
+
+    with _router_lock:
+        if _router is None:
+            _router = AdaptiveRouter(config)
+            atexit.register(_router.save)
+    return _router
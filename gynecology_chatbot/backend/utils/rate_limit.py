@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, List, Any, Optional
+from django.conf import settings
+
+# Admission priorities: lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+class RateLimitExceeded(Exception):
+    """A call was turned away locally because the provider's limits are used up."""
+
+    def __init__(self, provider: str, retry_after: float, reason: str):
+        super().__init__(f"{provider} rate limit: {reason}")
+        self.provider = provider
+        self.retry_after = retry_after
+        self.reason = reason
+
+class ProviderRateLimited(Exception):
+    """The provider itself answered with a rate-limit error (HTTP 429)."""
+
+    def __init__(self, provider: str, retry_after: Optional[float] = None, message: str = ""):
+        super().__init__(message or f"{provider} returned a rate-limit error")
+        self.provider = provider
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 units per second up to per_minute."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount units are available (0 if they are now)."""
+        self._refill(time.monotonic())
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def pause(self, seconds: float):
+        """Empty the bucket so nothing is admitted for about seconds."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def available(self) -> int:
+        elapsed = time.monotonic() - self.updated
+        return int(min(self.capacity, self.tokens + elapsed * self.rate))
+
+class ProviderLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets for one provider with a
+    bounded priority queue in front of them.
+
+    A call is admitted at once when nothing is queued and both buckets have
+    room. Otherwise it waits in the queue, served by priority then arrival,
+    for at most MAX_WAIT_SECONDS (or its own timeout); a full queue or a
+    zero wait budget turns it away immediately. Must only be used from the
+    shared LLM event loop.
+    """
+
+    def __init__(self, name: str, rpm: Optional[float], tpm: Optional[float],
+                 max_depth: int, max_wait: float):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_depth = max_depth
+        self.max_wait = max_wait
+        self._queue: List[list] = []
+        self._seq = itertools.count()
+        self._timer = None
+        self._stats_lock = threading.Lock()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.provider_429s = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def _take(self, tokens: int):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+
+    def _record_admission(self, waited: float):
+        with self._stats_lock:
+            self.admitted += 1
+            self.total_wait += waited
+            self.max_wait_seen = max(self.max_wait_seen, waited)
+
+    def _dispatch(self):
+        """Admit queued calls while the buckets allow, then sleep until the head fits."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queue:
+            _, _, tokens, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            wait = self._wait_time(tokens)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self._take(tokens)
+            future.set_result(None)
+
+    def _remove(self, entry: list):
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE,
+                      timeout: Optional[float] = None):
+        """Wait for room for one request of about tokens tokens, or raise RateLimitExceeded."""
+        if not self.requests and not self.tokens:
+            return
+        if not self._queue and self._wait_time(tokens) == 0:
+            self._take(tokens)
+            self._record_admission(0.0)
+            return
+
+        wait_budget = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        if wait_budget <= 0 or len(self._queue) >= self.max_depth:
+            with self._stats_lock:
+                self.rejected += 1
+            reason = "queue full" if wait_budget > 0 else "limit reached"
+            raise RateLimitExceeded(self.name, self._wait_time(tokens), reason)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), tokens, future]
+        heapq.heappush(self._queue, entry)
+        with self._stats_lock:
+            self.queued += 1
+        self._dispatch()
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, wait_budget)
+        except asyncio.TimeoutError:
+            self._remove(entry)
+            with self._stats_lock:
+                self.timed_out += 1
+            raise RateLimitExceeded(self.name, self._wait_time(tokens), f"queued longer than {wait_budget:.1f}s")
+        except asyncio.CancelledError:
+            self._remove(entry)
+            raise
+        self._record_admission(time.monotonic() - started)
+
+    def penalize(self, retry_after: Optional[float]):
+        """Back off after the provider itself returned a 429."""
+        seconds = retry_after or settings.LLM_RATE_LIMIT_QUEUE['DEFAULT_RETRY_AFTER']
+        with self._stats_lock:
+            self.provider_429s += 1
+        for bucket in (self.requests, self.tokens):
+            if bucket:
+                bucket.pause(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "rpm": int(self.requests.capacity) if self.requests else None,
+                "tpm": int(self.tokens.capacity) if self.tokens else None,
+                "available_requests": self.requests.available() if self.requests else None,
+                "available_tokens": self.tokens.available() if self.tokens else None,
+                "queue_depth": len(self._queue),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "provider_429s": self.provider_429s,
+                "mean_wait_ms": int(self.total_wait / self.admitted * 1000) if self.admitted else 0,
+                "max_wait_ms": int(self.max_wait_seen * 1000),
+            }
+
+class RateLimiterRegistry:
+    """Lazily created limiters, one per provider name, configured by LLM_RATE_LIMITS."""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> ProviderLimiter:
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                limits = settings.LLM_RATE_LIMITS.get(name, {})
+                queue = settings.LLM_RATE_LIMIT_QUEUE
+                limiter = ProviderLimiter(
+                    name,
+                    rpm=limits.get('RPM'),
+                    tpm=limits.get('TPM'),
+                    max_depth=queue['MAX_DEPTH'],
+                    max_wait=queue['MAX_WAIT_SECONDS'],
+                )
+                self._limiters[name] = limiter
+            return limiter
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {name: limiter.snapshot() for name, limiter in limiters.items()}
+
+# Global instance
+rate_limiters = RateLimiterRegistry()
@@ -0,0 +1,297 @@
+import json
+import os
+import re
+import threading
+import zlib
+from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from utils.llm_cache import normalize_message, prior_history
+
+class HashedNgramVectorizer:
+    """
+    Stateless text embedding: word uni/bigrams and character n-grams (unless
+    char_ngrams is None) hashed into a fixed-size vector, L2-normalized so a
+    dot product is cosine similarity.
+    """
+
+    def __init__(self, n_features: int = 4096, char_ngrams: Optional[Tuple[int, int]] = (3, 5)):
+        self.n_features = n_features
+        self.char_ngrams = char_ngrams
+
+    def _features(self, text: str) -> List[str]:
+        words = re.findall(r"[a-z0-9']+", text.lower())
+        features = [f"w:{word}" for word in words]
+        features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        if not self.char_ngrams:
+            return features
+
+        padded = f" {' '.join(words)} "
+        low, high = self.char_ngrams
+        for n in range(low, high + 1):
+            features += [f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1)]
+        return features
+
+    def transform(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.n_features, dtype=np.float32)
+        for feature in self._features(text):
+            # crc32 is stable across processes, unlike hash()
+            h = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vector[h % self.n_features] += sign
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+# Words that flip the meaning of a question ("is it normal to not bleed")
+NEGATIONS = frozenset({
+    "no", "not", "never", "without", "none", "nothing", "neither", "nor", "cannot", "stop", "stopped",
+})
+
+# Clinical term prefixes; a question about periods must not match one about pregnancy
+CLINICAL_TERMS = (
+    "pregnan", "period", "menstrua", "menopaus", "bleed", "blood", "spotting", "clot", "pain", "cramp",
+    "discharge", "itch", "burn", "odor", "smell", "fever", "lump", "pill", "contracept", "iud",
+    "ovulat", "miscarr", "abort", "cyst", "infect", "yeast", "std", "sti", "hpv", "herpes", "pap",
+    "smear", "breast", "vagin", "vulv", "uter", "ovar", "cervi", "sex", "intercourse", "fertil",
+    "endometrio", "pcos", "fibroid", "nause", "vomit", "urin", "hormon", "test", "baby", "birth",
+)
+
+def guard_terms(text: str) -> frozenset:
+    """Negations and clinical terms in a question; cached answers are only reused when these match exactly."""
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    terms = {"neg" for word in words if word in NEGATIONS or word.endswith("n't")}
+    terms.update(prefix for prefix in CLINICAL_TERMS for word in words if word.startswith(prefix))
+    return frozenset(terms)
+
+class SemanticIndex:
+    """
+    Brute-force nearest-neighbour index over normalized vectors, oldest
+    entries evicted first. Storage grows with the entries, up to max_entries.
+    """
+
+    initial_capacity = 64
+
+    def __init__(self, dimensions: int, max_entries: int):
+        self.max_entries = max_entries
+        self.dimensions = dimensions
+        self._vectors = np.zeros((min(max_entries, self.initial_capacity), dimensions), dtype=np.float32)
+        self._entries: List[Optional[Dict[str, Any]]] = []
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, vector: np.ndarray, entry: Dict[str, Any]):
+        with self._lock:
+            capacity = len(self._vectors)
+            if self._next == capacity and capacity < self.max_entries:
+                grown = np.zeros((min(capacity * 2, self.max_entries), self.dimensions), dtype=np.float32)
+                grown[:capacity] = self._vectors
+                self._vectors = grown
+            elif self._next == capacity:
+                self._next = 0
+
+            self._vectors[self._next] = vector
+            if self._next < len(self._entries):
+                self._entries[self._next] = entry
+            else:
+                self._entries.append(entry)
+            self._next += 1
+            self._count = min(self._count + 1, self.max_entries)
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[Tuple[float, Dict[str, Any]]]:
+        """Up to k (score, entry) pairs, most similar first."""
+        with self._lock:
+            if not self._count:
+                return []
+            scores = self._vectors[:self._count] @ vector
+            best = np.argsort(-scores)[:k]
+            return [(float(scores[i]), self._entries[i]) for i in best]
+
+    def save(self, path: str):
+        with self._lock:
+            np.savez_compressed(
+                path,
+                vectors=self._vectors[:self._count],
+                entries=np.array(json.dumps(self._entries[:self._count])),
+            )
+
+    def load(self, path: str):
+        data = np.load(path)
+        vectors = data["vectors"]
+        entries = json.loads(str(data["entries"]))
+        for vector, entry in zip(vectors, entries):
+            self.add(vector, entry)
+
+class SemanticCache:
+    """
+    Reuses evaluated answers for paraphrased first-turn questions.
+
+    Only questions asked with no prior conversation are looked up, since
+    an answer that depends on earlier turns cannot be safely reused. Entries
+    come only from `seed_semantic_cache`, never from live answers, and a
+    match must also have the same negations and clinical terms: n-gram
+    similarity alone rates "bleed during pregnancy" and "not bleed during
+    pregnancy" as near duplicates.
+    """
+
+    candidates = 5
+
+    def __init__(self, threshold: float, max_entries: int, n_features: int):
+        self.threshold = threshold
+        self.vectorizer = HashedNgramVectorizer(n_features)
+        self.index = SemanticIndex(n_features, max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, user_message: str, chat_history: List[Any]) -> Optional[Dict[str, Any]]:
+        if prior_history(chat_history, user_message):
+            return None
+
+        terms = guard_terms(user_message)
+        match = None
+        for score, entry in self.index.search(self.vectorizer.transform(normalize_message(user_message)), self.candidates):
+            if score < self.threshold:
+                break
+            if guard_terms(entry["question"]) == terms:
+                match = score, entry
+                break
+        if match is None:
+            self.misses += 1
+            return None
+
+        score, entry = match
+        self.hits += 1
+        result = dict(entry["result"])
+        result["semantic_match"] = {"question": entry["question"], "similarity": round(score, 3)}
+        return result
+
+    def remember(self, question: str, result: Dict[str, Any]):
+        """Index a vetted first-turn answer (used when seeding)."""
+        self.index.add(
+            self.vectorizer.transform(normalize_message(question)),
+            {"question": question, "result": result}
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.index),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+def _first_turn_result(content: str, model_name: str, explanation: str) -> Dict[str, Any]:
+    return {
+        "all_responses": {model_name: content},
+        "best_model": model_name,
+        "best_response": content,
+        "explanation": explanation,
+    }
+
+def _real_providers() -> set:
+    """Providers whose answers may be seeded: mock replies embed the asker's question text."""
+    from utils.llm_utils import real_provider_priority
+
+    return set(real_provider_priority())
+
+def seed_from_django(cache: SemanticCache, limit: Optional[int] = None) -> int:
+    """Seed from conversations whose first assistant answer, from a real provider, passed evaluation."""
+    from apps.chatbot.models import Message
+
+    real_providers = _real_providers()
+    seeded = 0
+    conversation_ids = (
+        Message.objects.filter(message_type='assistant', metadata__evaluated=True)
+        .values_list('conversation_id', flat=True).distinct()
+    )
+    for conversation_id in conversation_ids:
+        first_turn = list(Message.objects.filter(conversation_id=conversation_id).order_by('created_at')[:2])
+        if len(first_turn) < 2:
+            continue
+        question, answer = first_turn
+        if question.message_type != 'user' or answer.message_type != 'assistant':
+            continue
+        if not answer.metadata.get('evaluated') or answer.model_name not in real_providers:
+            continue
+
+        cache.remember(question.content, _first_turn_result(
+            answer.content, answer.model_name, answer.metadata.get('explanation', '')
+        ))
+        seeded += 1
+        if limit and seeded >= limit:
+            break
+    return seeded
+
+def seed_from_firestore(cache: SemanticCache, limit: Optional[int] = None) -> int:
+    """Seed from Firestore conversations whose first assistant answer, from a real provider, passed evaluation."""
+    from utils.firestore_client import firestore_client
+
+    real_providers = _real_providers()
+    seeded = 0
+    answers = firestore_client.query_collection('messages', filters=[
+        ('message_type', '==', 'assistant'),
+        ('metadata.evaluated', '==', True),
+    ])
+    conversation_ids = {answer.get('conversation_id') for answer in answers}
+
+    for conversation_id in conversation_ids:
+        first_turn = firestore_client.query_collection(
+            'messages',
+            filters=[('conversation_id', '==', conversation_id)],
+            order_by='created_at',
+            limit=2
+        )
+        if len(first_turn) < 2:
+            continue
+        question, answer = first_turn
+        if question.get('message_type') != 'user' or answer.get('message_type') != 'assistant':
+            continue
+        metadata = answer.get('metadata', {})
+        if not metadata.get('evaluated') or answer.get('model_name') not in real_providers:
+            continue
+
+        cache.remember(question.get('content', ''), _first_turn_result(
+            answer.get('content', ''), answer.get('model_name'), metadata.get('explanation', '')
+        ))
+        seeded += 1
+        if limit and seeded >= limit:
+            break
+    return seeded
+
+def build_semantic_cache() -> SemanticCache:
+    config = settings.LLM_SEMANTIC_CACHE
+    return SemanticCache(
+        threshold=config.get('THRESHOLD', 0.97),
+        max_entries=config.get('MAX_ENTRIES', 5000),
+        n_features=config.get('N_FEATURES', 4096),
+    )
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """Return the process-wide semantic cache, loading the seeded index on first use."""
+    global _semantic_cache
+    config = settings.LLM_SEMANTIC_CACHE
+    if not config.get('ENABLED', True):
+        return None
+
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = build_semantic_cache()
+            path = config.get('PATH')
+            if path and os.path.exists(path):
+                try:
+                    _semantic_cache.index.load(path)
+                    print(f"Loaded {len(_semantic_cache.index)} semantic cache entries from {path}")
+                except Exception as e:
+                    print(f"Error loading semantic cache index: {str(e)}")
+    return _semantic_cache
@@ -0,0 +1,287 @@
+import os
+import re
+import threading
+import zlib
+from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from utils.semantic_cache import HashedNgramVectorizer
+from utils.llm_utils import Deadline, run_sync, run_fallback_ladder, real_provider_priority
+from utils.rate_limit import PRIORITY_BACKGROUND
+
+SEVERITY_PROMPT = """
+As a medical assessment system, analyze the following gynecological health response and rate its severity on a scale of 1-10.
+1 = Completely routine, no concerns
+5 = Moderate concern that needs attention but isn't urgent
+10 = Very serious, requires immediate medical attention
+
+Provide ONLY a single number (1-10) as your response, no explanation.
+
+Response to assess:
+{text}
+"""
+
+SCORES = np.arange(1, 11, dtype=np.float32)
+
+# Phrase rules: (pattern, minimum score). A match raises the score to at
+# least that value; the highest matching rule wins
+SEVERITY_RULES = [
+    (re.compile(
+        r"\b(call (911|an ambulance|emergency services)|emergency room|go to (the )?(er|emergency)"
+        r"|seek (immediate|emergency|urgent) (medical )?(care|attention|help)|ectopic pregnancy"
+        r"|hemorrhag\w*|sepsis|septic|loss of consciousness|faint(ed|ing)|suicid\w*)\b"
+    ), 8),
+    (re.compile(
+        r"\b(severe (pain|bleeding|cramp\w*)|heavy bleeding|soaking (through )?(a|one) pad|high fever"
+        r"|postmenopausal bleeding|bleeding after menopause|abnormal (bleeding|discharge)|lump"
+        r"|(see|consult|contact|visit) (a|your) (doctor|gynecologist|healthcare provider) "
+        r"(soon|promptly|as soon as possible|within))\b"
+    ), 5),
+]
+
+# Phrases that mark a routine answer when no rule above matches
+ROUTINE_PATTERN = re.compile(
+    r"\b(completely normal|perfectly normal|very common|nothing to worry about|usually harmless"
+    r"|normal part of)\b"
+)
+
+def parse_severity(text: str) -> Optional[int]:
+    """First score from 1 to 10 in an LLM answer, or None."""
+    match = re.search(r"\b(10|[1-9])\b", text or "")
+    return int(match.group(1)) if match else None
+
+def holdout(row_id: Any, fraction: float) -> bool:
+    """Stable train/evaluation split: the same rows are held out on every run."""
+    return zlib.crc32(str(row_id).encode("utf-8")) % 1000 < fraction * 1000
+
+class SeverityClassifier:
+    """
+    Local severity scorer: phrase rules plus a softmax regression over hashed
+    word n-grams, trained from stored LLM and doctor severity scores.
+
+    The score is the probability-weighted mean of the ten classes. The
+    confidence is the probability mass within one point of it; rule matches
+    are treated as confident. Without a trained model only the rules apply.
+    """
+
+    def __init__(self, n_features: int):
+        self.vectorizer = HashedNgramVectorizer(n_features, char_ngrams=None)
+        self.weights: Optional[np.ndarray] = None
+        self.bias: Optional[np.ndarray] = None
+        self.trained_on = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.weights is not None
+
+    def _probabilities(self, matrix: np.ndarray) -> np.ndarray:
+        logits = matrix @ self.weights + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict(self, text: str) -> Tuple[int, float, str]:
+        """Return (score 1-10, confidence 0-1, method)."""
+        lowered = (text or "").lower()
+        floor = 0
+        for pattern, minimum in SEVERITY_RULES:
+            if minimum > floor and pattern.search(lowered):
+                floor = minimum
+
+        if not self.trained:
+            if floor:
+                return floor, 1.0, "rules"
+            if ROUTINE_PATTERN.search(lowered):
+                return 2, 0.7, "rules"
+            return 3, 0.0, "default"
+
+        probabilities = self._probabilities(self.vectorizer.transform(lowered)[None, :])[0]
+        expected = float(probabilities @ SCORES)
+        score = int(round(expected))
+        confidence = float(probabilities[max(0, score - 2):score + 1].sum())
+        if floor > score:
+            return floor, 1.0, "rules"
+        return score, confidence, "model"
+
+    def fit(self, texts: List[str], scores: List[int], epochs: int = 60,
+            learning_rate: float = 2.0, l2: float = 1e-4, batch_size: int = 256, seed: int = 0):
+        """Train by mini-batch gradient descent on the softmax cross-entropy."""
+        matrix = np.stack([self.vectorizer.transform(text.lower()) for text in texts])
+        labels = np.clip(np.asarray(scores, dtype=np.int64), 1, 10) - 1
+        targets = np.eye(10, dtype=np.float32)[labels]
+
+        rng = np.random.default_rng(seed)
+        self.weights = np.zeros((matrix.shape[1], 10), dtype=np.float32)
+        # Start from the class frequencies so rare scores are not over-predicted
+        counts = np.bincount(labels, minlength=10).astype(np.float32) + 1.0
+        self.bias = np.log(counts / counts.sum())
+
+        for _ in range(epochs):
+            order = rng.permutation(len(matrix))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                error = self._probabilities(matrix[batch]) - targets[batch]
+                self.weights -= learning_rate * (matrix[batch].T @ error / len(batch) + l2 * self.weights)
+                self.bias -= learning_rate * error.mean(axis=0)
+        self.trained_on = len(texts)
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            trained_on=np.array(self.trained_on),
+        )
+
+    def load(self, path: str):
+        data = np.load(path)
+        if data["weights"].shape[0] != self.vectorizer.n_features:
+            raise ValueError(f"Model has {data['weights'].shape[0]} features, expected {self.vectorizer.n_features}")
+        self.weights = data["weights"]
+        self.bias = data["bias"]
+        self.trained_on = int(data["trained_on"])
+
+def llm_severity(text: str, timeout: Optional[float] = None) -> Optional[int]:
+    """Score with the first real LLM provider that answers, or None. Mock providers are skipped."""
+    ladder = real_provider_priority()
+    if not ladder:
+        return None
+    deadline = Deadline(timeout or settings.LLM_SEVERITY['LLM_TIMEOUT'])
+    responses, _, _ = run_sync(
+        run_fallback_ladder(SEVERITY_PROMPT.format(text=text), [], deadline, ladder,
+                            priority=PRIORITY_BACKGROUND),
+        timeout=deadline.remaining() + 1
+    )
+    return parse_severity(next(iter(responses.values()), None))
+
+class SeverityAssessor:
+    """
+    Scores locally and escalates to the LLM only below CONFIDENCE_THRESHOLD.
+
+    Nothing is escalated until a model is trained: the untrained fallback has
+    no confidence, so a fresh deploy would otherwise send every turn to the
+    LLM. Doctor-reviewed queries provide the first training labels.
+    """
+
+    def __init__(self, classifier: SeverityClassifier, threshold: float, escalate: bool):
+        self.classifier = classifier
+        self.threshold = threshold
+        self.escalate = escalate
+        self._lock = threading.Lock()
+        self.local = 0
+        self.escalated = 0
+        self.llm_failures = 0
+
+    def score_locally(self, text: str) -> Dict[str, Any]:
+        """Rules and model only; takes microseconds."""
+        score, confidence, method = self.classifier.predict(text)
+        with self._lock:
+            self.local += 1
+        return {"score": score, "confidence": round(confidence, 3), "method": method}
+
+    def needs_escalation(self, assessment: Dict[str, Any]) -> bool:
+        return (
+            self.escalate and self.classifier.trained
+            and assessment["method"] != "llm" and assessment["confidence"] < self.threshold
+        )
+
+    def escalate_assessment(self, text: str, assessment: Dict[str, Any]) -> Dict[str, Any]:
+        """Ask the LLM; keeps the local assessment if it does not answer."""
+        with self._lock:
+            self.escalated += 1
+        try:
+            llm_score = llm_severity(text)
+        except Exception as e:
+            print(f"Error escalating severity assessment: {str(e)}")
+            llm_score = None
+
+        if llm_score is None:
+            with self._lock:
+                self.llm_failures += 1
+            return assessment
+        return {"score": llm_score, "confidence": 1.0, "method": "llm", "local_score": assessment["score"]}
+
+    def assess(self, text: str) -> Dict[str, Any]:
+        assessment = self.score_locally(text)
+        if self.needs_escalation(assessment):
+            return self.escalate_assessment(text, assessment)
+        return assessment
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "trained_on": self.classifier.trained_on,
+                "threshold": self.threshold,
+                "local": self.local,
+                "escalated": self.escalated,
+                "llm_failures": self.llm_failures,
+                "escalation_rate": round(self.escalated / self.local, 3) if self.local else None,
+            }
+
+def labeled_from_django(limit: Optional[int] = None) -> List[Tuple[Any, str, int]]:
+    """
+    (id, assistant response, severity score) for patient queries scored by
+    the LLM or reviewed by a doctor. Locally scored rows are left out so the
+    model is never trained or evaluated on its own output.
+    """
+    from django.db.models import Q
+    from doctors.models import PatientQuery
+
+    rows = (
+        PatientQuery.objects.exclude(ai_response='')
+        .filter(Q(severity_method='llm') | Q(doctor_reviewed=True))
+        .order_by('id').values_list('id', 'ai_response', 'severity_score')
+    )
+    if limit:
+        rows = rows[:limit]
+    return list(rows)
+
+def labeled_from_firestore(limit: Optional[int] = None) -> List[Tuple[Any, str, int]]:
+    """(id, assistant response, severity score) for LLM-scored or doctor-reviewed Firestore patient queries."""
+    from utils.firestore_client import firestore_client
+
+    docs = {}
+    for filters in ([('severity_method', '==', 'llm')], [('doctor_reviewed', '==', True)]):
+        for doc in firestore_client.query_collection('patient_queries', filters=filters, limit=limit):
+            docs[doc['id']] = doc
+    rows = [
+        (doc['id'], doc.get('ai_response', ''), doc.get('severity_score', 3))
+        for doc in docs.values() if doc.get('ai_response')
+    ]
+    return rows[:limit] if limit else rows
+
+def build_severity_classifier() -> SeverityClassifier:
+    return SeverityClassifier(settings.LLM_SEVERITY['N_FEATURES'])
+
+_assessor = None
+_assessor_lock = threading.Lock()
+
+def get_severity_assessor() -> SeverityAssessor:
+    """Return the process-wide assessor, loading the trained model on first use."""
+    global _assessor
+    config = settings.LLM_SEVERITY
+
+    with _assessor_lock:
+        if _assessor is None:
+            classifier = build_severity_classifier()
+            path = config.get('MODEL_PATH')
+            if path and os.path.exists(path):
+                try:
+                    classifier.load(path)
+                    print(f"Loaded severity model trained on {classifier.trained_on} scored responses")
+                except Exception as e:
+                    print(f"Error loading severity model: {str(e)}")
+            _assessor = SeverityAssessor(classifier, config['CONFIDENCE_THRESHOLD'], config['ESCALATE'])
+    return _assessor
+
+def assess_severity(text: str) -> Dict[str, Any]:
+    """Severity of an assistant response: {"score", "confidence", "method"}."""
+    return get_severity_assessor().assess(text)
+
+def score_severity_locally(text: str) -> Dict[str, Any]:
+    """Severity without LLM escalation, cheap enough for the chat request path."""
+    return get_severity_assessor().score_locally(text)
+
+def severity_stats() -> Optional[Dict[str, Any]]:
+    """Assessor counters for the status endpoint, or None before the first assessment."""
+    return _assessor.stats() if _assessor else None
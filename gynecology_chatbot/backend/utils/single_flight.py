@@ -0,0 +1,79 @@
+import threading
+from typing import Callable, Dict, Any, Optional, Tuple
+
+class _Call:
+    """One in-flight generation and the requests waiting for it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests within this process: the first
+    caller for a key runs the work, later callers with the same key block
+    until it finishes and receive the same result.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None,
+           rerun_on: Tuple[type, ...] = ()) -> Tuple[Any, bool]:
+        """
+        Return (result, shared). shared is True when the result came from
+        another caller's run. A waiter that times out, or whose leader raised
+        one of rerun_on (e.g. its client cancelled), runs fn itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            finished = call.done.wait(timeout)
+            with self._lock:
+                call.waiters -= 1
+                if not finished:
+                    self.timeouts += 1
+            if not finished or isinstance(call.error, rerun_on):
+                return fn(), False
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "waiting": sum(call.waiters for call in self._calls.values()),
+                "leaders": self.leaders,
+                "coalesced_waiters": self.coalesced,
+                "wait_timeouts": self.timeouts,
+            }
+
+# Global instance
+single_flight = SingleFlight()
@@ -0,0 +1,179 @@
+import atexit
+import concurrent.futures
+import threading
+from typing import Dict, List, Any, Optional
+from django.conf import settings
+from django.db import close_old_connections
+from utils.severity import get_severity_assessor
+
+class PatientQueryWriter:
+    """
+    Buffers scored chat turns and writes them as patient queries in bulk.
+
+    Turns are flushed by a background thread every FLUSH_INTERVAL seconds or
+    as soon as BATCH_SIZE are waiting. Turns the local classifier was unsure
+    about are first escalated to the LLM by a pool of ESCALATION_WORKERS
+    threads, off the request path, so the doctor triage queue gets the
+    refined score without a slow provider holding up the other writes.
+    Turns scoring below min_score, after any escalation, are dropped.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, min_score: int, escalation_workers: int):
+        self.batch_size = batch_size
+        self.min_score = min_score
+        self.flush_interval = flush_interval
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._escalations = concurrent.futures.ThreadPoolExecutor(
+            max_workers=escalation_workers, thread_name_prefix="patient-query-escalation"
+        )
+        self.escalating = 0
+        self.written = 0
+        self.escalated = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name="patient-query-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, record: Dict[str, Any]):
+        if get_severity_assessor().needs_escalation(record["severity"]):
+            with self._lock:
+                self.escalating += 1
+            try:
+                self._escalations.submit(self._escalate, record)
+                return
+            except RuntimeError:
+                # Interpreter shutting down: keep the local score
+                with self._lock:
+                    self.escalating -= 1
+        self._enqueue(record)
+
+    def _enqueue(self, record: Dict[str, Any]):
+        if record["severity"]["score"] < self.min_score:
+            return
+        with self._lock:
+            self._pending.append(record)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _escalate(self, record: Dict[str, Any]):
+        try:
+            record["severity"] = get_severity_assessor().escalate_assessment(record["ai_response"], record["severity"])
+        finally:
+            with self._lock:
+                self.escalating -= 1
+                self.escalated += 1
+            self._enqueue(record)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write every pending record; safe to call from any thread."""
+        with self._flush_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if not records:
+                return
+
+            django_records = [record for record in records if record["backend"] == "django"]
+            firestore_records = [record for record in records if record["backend"] == "firestore"]
+            try:
+                if django_records:
+                    _write_django(django_records)
+                if firestore_records:
+                    _write_firestore(firestore_records)
+                with self._lock:
+                    self.written += len(records)
+            except Exception as e:
+                with self._lock:
+                    self.failed += len(records)
+                print(f"Error writing {len(records)} patient queries: {str(e)}")
+            finally:
+                close_old_connections()
+
+    def close(self):
+        """Wait for running escalations, then write everything still pending."""
+        self._escalations.shutdown(wait=True)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "escalating": self.escalating,
+                "written": self.written,
+                "escalated": self.escalated,
+                "failed": self.failed,
+            }
+
+def _write_django(records: List[Dict[str, Any]]):
+    from doctors.models import PatientQuery
+
+    PatientQuery.objects.bulk_create([
+        PatientQuery(
+            patient_id=record["patient_id"],
+            conversation_id=record["conversation_id"],
+            query_text=record["query_text"],
+            ai_response=record["ai_response"],
+            severity_score=record["severity"]["score"],
+            severity_method=record["severity"]["method"],
+            severity_confidence=record["severity"]["confidence"],
+        )
+        for record in records
+    ])
+
+def _write_firestore(records: List[Dict[str, Any]]):
+    from utils.firestore_client import firestore_client
+
+    firestore_client.batch_create('patient_queries', [
+        {
+            'patient_id': str(record["patient_id"]),
+            'conversation_id': record["conversation_id"],
+            'query_text': record["query_text"],
+            'ai_response': record["ai_response"],
+            'severity_score': record["severity"]["score"],
+            'severity_method': record["severity"]["method"],
+            'severity_confidence': record["severity"]["confidence"],
+            'doctor_reviewed': False,
+        }
+        for record in records
+    ])
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_patient_query_writer() -> PatientQueryWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            config = settings.LLM_TRIAGE
+            _writer = PatientQueryWriter(
+                config['BATCH_SIZE'], config['FLUSH_INTERVAL'], config['MIN_SCORE'], config['ESCALATION_WORKERS']
+            )
+            atexit.register(_writer.close)
+    return _writer
+
+def record_patient_query(backend: str, patient_id: Any, conversation_id: Any, query_text: str,
+                         ai_response: str, severity: Dict[str, Any]):
+    """Queue a scored chat turn for the doctor triage queue."""
+    config = settings.LLM_TRIAGE
+    if not config['ENABLED'] or patient_id is None:
+        return
+    get_patient_query_writer().add({
+        "backend": backend,
+        "patient_id": patient_id,
+        "conversation_id": conversation_id,
+        "query_text": query_text,
+        "ai_response": ai_response,
+        "severity": severity,
+    })
+
+def triage_stats() -> Optional[Dict[str, Any]]:
+    """Writer counters for the status endpoint, or None before the first chat turn."""
+    return _writer.stats() if _writer else None
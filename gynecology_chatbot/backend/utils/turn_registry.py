@@ -0,0 +1,128 @@
+import concurrent.futures
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Set, Tuple
+
+# Response status of a turn the client cancelled (as nginx logs a client
+# that closed the connection before the response was sent)
+TURN_CANCELLED_STATUS = 499
+
+class TurnCancelled(Exception):
+    """The chat turn was cancelled by its client."""
+
+class Turn:
+    """
+    One chat turn in flight. The futures of its provider calls on the shared
+    LLM event loop are attached here so cancel() can stop them.
+    """
+
+    def __init__(self, turn_id: str, owner: str):
+        self.id = turn_id
+        self.owner = owner
+        self.started = time.monotonic()
+        self._cancelled = threading.Event()
+        self._futures: Set[concurrent.futures.Future] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def attach(self, future: concurrent.futures.Future):
+        """Track a future; it is cancelled at once if the turn already was."""
+        with self._lock:
+            if not self.cancelled:
+                self._futures.add(future)
+                return
+        future.cancel()
+
+    def detach(self, future: concurrent.futures.Future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            futures, self._futures = self._futures, set()
+        for future in futures:
+            future.cancel()
+
+    def check(self):
+        """Raise TurnCancelled if the turn was cancelled."""
+        if self.cancelled:
+            raise TurnCancelled(f"Turn {self.id} was cancelled")
+
+class TurnRegistry:
+    """
+    Chat turns running in this process, by owner and client turn id.
+
+    A cancel that arrives before its turn has started is remembered for
+    TOMBSTONE_SECONDS, so the turn is cancelled as soon as it starts. The
+    registry is per process: with several worker processes a cancel only
+    reaches turns served by the process that receives it.
+    """
+
+    tombstone_seconds = 60.0
+
+    def __init__(self):
+        self._turns: Dict[Tuple[str, str], Turn] = {}
+        self._tombstones: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.cancelled = 0
+
+    def start(self, owner: str, turn_id: Optional[str] = None) -> Turn:
+        turn = Turn(turn_id or uuid.uuid4().hex, owner)
+        key = (owner, turn.id)
+        with self._lock:
+            self._turns[key] = turn
+            self.started += 1
+            cancelled_early = self._tombstones.pop(key, None) is not None
+        if cancelled_early:
+            turn.cancel()
+        return turn
+
+    def finish(self, turn: Turn):
+        with self._lock:
+            if self._turns.get((turn.owner, turn.id)) is turn:
+                del self._turns[(turn.owner, turn.id)]
+
+    def cancel(self, owner: str, turn_id: str) -> bool:
+        """Cancel a running turn. Returns False if it is not running (yet)."""
+        key = (owner, turn_id)
+        now = time.monotonic()
+        with self._lock:
+            turn = self._turns.get(key)
+            if turn is None:
+                self._tombstones = {
+                    k: expires for k, expires in self._tombstones.items() if expires > now
+                }
+                self._tombstones[key] = now + self.tombstone_seconds
+            else:
+                self.cancelled += 1
+        if turn is None:
+            return False
+        turn.cancel()
+        return True
+
+    @contextmanager
+    def track(self, owner: str, turn_id: Optional[str] = None):
+        """Register a turn for the duration of the block."""
+        turn = self.start(owner, turn_id)
+        try:
+            yield turn
+        finally:
+            self.finish(turn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": len(self._turns),
+                "started": self.started,
+                "cancelled": self.cancelled,
+            }
+
+# Global instance
+turn_registry = TurnRegistry()
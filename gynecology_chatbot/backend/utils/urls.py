@@ -1,7 +1,8 @@
 from django.urls import path
-from .views import health_check, redirect_to_admin, redirect_to_appointments
+from .views import health_check, llm_status, redirect_to_admin, redirect_to_appointments
 
 urlpatterns = [
     path('health/', health_check, name='health_check'),
+    path('llm/status/', llm_status, name='llm_status'),
     path('go-to-appointments/', redirect_to_appointments, name='go_to_appointments'),
 ]
@@ -1,10 +1,55 @@
+import hmac
+from django.conf import settings
 from django.http import JsonResponse
 from django.shortcuts import redirect
+from apps.chatbot.clients import provider_clients
+from apps.chatbot.providers import provider_registry
+from utils.llm_cache import get_response_cache
+from utils.semantic_cache import get_semantic_cache
+from utils.circuit_breaker import circuit_breakers
+from utils.provider_router import get_router
+from utils.chat_history import history_cache
+from utils.single_flight import single_flight
+from utils.turn_registry import turn_registry
+from utils.rate_limit import rate_limiters
+from utils.job_queue import job_queue_stats
+from utils.severity import severity_stats
+from utils.triage import triage_stats
 
 def health_check(request):
     """Health check endpoint for API."""
     return JsonResponse({"status": "ok", "message": "API is running"})
 
+def _can_view_status(request):
+    """Staff users, or callers presenting LLM_STATUS_TOKEN."""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = settings.LLM_STATUS_TOKEN
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Status-Token', ''), token)
+
+def llm_status(request):
+    """Status of the LLM providers: adapters, circuit breakers, clients and caches. Staff only."""
+    if not _can_view_status(request):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    response_cache = get_response_cache()
+    semantic_cache = get_semantic_cache()
+    router = get_router()
+    return JsonResponse({
+        "providers": provider_registry.snapshot(),
+        "circuit_breakers": circuit_breakers.snapshot(),
+        "rate_limits": rate_limiters.snapshot(),
+        "router": router.snapshot() if router else None,
+        "clients": provider_clients.stats(),
+        "response_cache": response_cache.stats() if response_cache else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "history_cache": history_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "turns": turn_registry.stats(),
+        "job_queue": job_queue_stats(),
+        "severity": severity_stats(),
+        "triage": triage_stats(),
+    })
+
 def redirect_to_admin(request):
     """Redirect root URL to admin interface."""
     return redirect('admin:index')
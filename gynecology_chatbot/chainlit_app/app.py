@@ -5,12 +5,13 @@ Chainlit application with Google OAuth authentication that syncs with Django/Fir
 import os
 import chainlit as cl
 from dotenv import load_dotenv
-from services.api_client import DjangoAPIClient
+from services.api_client import DjangoAPIClient, StreamUnavailable, get_shared_session, close_shared_session
+from contextlib import asynccontextmanager
+from chainlit.server import app as chainlit_server
 import uuid
 import google.generativeai as genai
 import webbrowser
 import asyncio
-import aiohttp
 
 # Load environment variables
 load_dotenv()
@@ -19,10 +20,32 @@ load_dotenv()
 if os.getenv("GEMINI_API_KEY"):
     genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-# Initialize API client
-api_client = DjangoAPIClient(
-    base_url=os.getenv("DJANGO_API_URL", "http://localhost:9000/api")
-)
+# Seconds to wait for the severity score before giving up on the booking action
+SEVERITY_TIMEOUT = float(os.getenv("SEVERITY_TIMEOUT", "10"))
+
+BACKEND_URL = os.getenv("DJANGO_API_URL", "http://localhost:9000/api")
+
+# Session-independent client for unauthenticated calls such as the health check
+backend_client = DjangoAPIClient(base_url=BACKEND_URL)
+
+def get_api_client() -> DjangoAPIClient:
+    """Return this chat session's API client, which carries the session's own token"""
+    client = cl.user_session.get("api_client")
+    if client is None:
+        client = DjangoAPIClient(base_url=BACKEND_URL, token=cl.user_session.get("jwt_token"))
+        cl.user_session.set("api_client", client)
+    return client
+
+_chainlit_lifespan = chainlit_server.router.lifespan_context
+
+@asynccontextmanager
+async def lifespan(app):
+    """Run Chainlit's own lifespan, then close the shared backend connection pool"""
+    async with _chainlit_lifespan(app) as state:
+        yield state
+    await close_shared_session()
+
+chainlit_server.router.lifespan_context = lifespan
 
 @cl.oauth_callback
 def oauth_callback(
@@ -72,8 +95,6 @@ def oauth_callback(
 async def sync_user_with_backend(user_metadata):
     """Sync OAuth user with Django backend and Firestore"""
     try:
-        backend_url = os.getenv("DJANGO_API_URL", "http://localhost:9000/api")
-        
         user_payload = {
             "provider": user_metadata.get("provider", "google"),
             "email": user_metadata.get("email", ""),
@@ -87,28 +108,29 @@ async def sync_user_with_backend(user_metadata):
         
         print(f"🔄 Syncing user with backend: {user_payload['email']}")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{backend_url}/oauth/sync/",
-                json=user_payload,
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    print(f"✅ User synced with backend successfully: {result}")
-                    
-                    if result.get("tokens", {}).get("access"):
-                        api_client.token = result["tokens"]["access"]
-                        cl.user_session.set("jwt_token", result["tokens"]["access"])
-                        cl.user_session.set("backend_user_id", result.get("user", {}).get("id"))
-                        cl.user_session.set("backend_synced", True)
-                    
-                    return result
-                else:
-                    print(f"❌ Failed to sync user with backend: {response.status}")
-                    error_text = await response.text()
-                    print(f"❌ Error details: {error_text}")
-                    return None
+        session = get_shared_session()
+        async with session.post(
+            f"{BACKEND_URL}/oauth/sync/",
+            json=user_payload,
+            headers={"Content-Type": "application/json"}
+        ) as response:
+            if response.status == 200:
+                result = await response.json()
+                print(f"✅ User synced with backend successfully: {result}")
+                
+                if result.get("tokens", {}).get("access"):
+                    # Only this session's client gets the token
+                    get_api_client().token = result["tokens"]["access"]
+                    cl.user_session.set("jwt_token", result["tokens"]["access"])
+                    cl.user_session.set("backend_user_id", result.get("user", {}).get("id"))
+                    cl.user_session.set("backend_synced", True)
+                
+                return result
+            else:
+                print(f"❌ Failed to sync user with backend: {response.status}")
+                error_text = await response.text()
+                print(f"❌ Error details: {error_text}")
+                return None
                     
     except Exception as e:
         print(f"❌ Error syncing user with backend: {str(e)}")
@@ -182,66 +204,76 @@ async def on_chat_start():
         return
     
     user_email = user.metadata.get('email', 'unknown')
+    user_name = user.metadata.get('name', 'there')
     print(f"🔍 Chat started for user: {user_email}")
     
-    # Check if user needs to be synced with backend
-    if user.metadata.get("needs_sync", False) and not cl.user_session.get("backend_synced", False):
+    needs_sync = user.metadata.get("needs_sync", False) and not cl.user_session.get("backend_synced", False)
+    
+    async def no_sync():
+        return None
+    
+    # The user sync and the (cached) health check are independent, so they
+    # share one round-trip; the conversation is created with the first message
+    if needs_sync:
         print(f"🔄 Silently syncing user with backend: {user_email}")
+    sync_result, backend_status = await asyncio.gather(
+        sync_user_with_backend(user.metadata) if needs_sync else no_sync(),
+        backend_client.check_health()
+    )
+    
+    if not needs_sync:
+        # User already synced
+        await cl.Message(
+            content=f"👋 Welcome back, {user_name}! How can I help you with your gynecological health concerns today?"
+        ).send()
+    elif sync_result:
+        cl.user_session.set("backend_synced", True)
+        cl.user_session.set("user_id", sync_result.get("user", {}).get("id"))
         
-        # Sync with Django backend/Firestore
-        sync_result = await sync_user_with_backend(user.metadata)
-        
-        if sync_result:
-            cl.user_session.set("backend_synced", True)
-            cl.user_session.set("user_id", sync_result.get("user", {}).get("id"))
-            
-            user_name = user.metadata.get('name', 'there')
-            if sync_result.get("created"):
-                welcome_msg = f"Welcome, {user_name}! \nI'm your Gynecology Assistant. \nHow can I help you today?"
-            else:
-                welcome_msg = f"Welcome back, {user_name}!\nHow can I help you today?"
-            
-            await cl.Message(content=welcome_msg).send()
+        if sync_result.get("created"):
+            welcome_msg = f"Welcome, {user_name}! \nI'm your Gynecology Assistant. \nHow can I help you today?"
         else:
-            await cl.Message(
-                content="⚠️ There was an issue setting up your account, but you can still use the chat. However, your conversations may not be saved."
-            ).send()
+            welcome_msg = f"Welcome back, {user_name}!\nHow can I help you today?"
+        
+        await cl.Message(content=welcome_msg).send()
     else:
-        # User already synced
-        user_name = user.metadata.get('name', 'there')
         await cl.Message(
-            content=f"👋 Welcome back, {user_name}! How can I help you with your gynecological health concerns today?"
+            content="⚠️ There was an issue setting up your account, but you can still use the chat. However, your conversations may not be saved."
         ).send()
     
-    # Check backend connection
-    backend_status = await api_client.check_health()
     if not backend_status:
         await cl.Message(
             content="⚠️ Could not connect to the backend server. Please refresh and try again."
         ).send()
-        return
+
+async def ensure_conversation():
+    """Return the session's conversation id, creating the conversation on first use"""
+    conversation_id = cl.user_session.get("conversation_id")
+    if conversation_id:
+        return conversation_id
     
-    # Create conversation
     try:
-        conversation = await api_client.create_conversation("New Conversation")
+        conversation = await get_api_client().create_conversation("New Conversation")
         if conversation:
-            cl.user_session.set("conversation_id", conversation.get("id"))
-            print(f"✅ Created conversation: {conversation.get('id')}")
+            conversation_id = conversation.get("id")
+            print(f"✅ Created conversation: {conversation_id}")
         else:
-            cl.user_session.set("conversation_id", str(uuid.uuid4()))
+            conversation_id = str(uuid.uuid4())
             print("⚠️ Using fallback conversation ID")
     except Exception as e:
         print(f"❌ Error creating conversation: {str(e)}")
-        cl.user_session.set("conversation_id", str(uuid.uuid4()))
+        conversation_id = str(uuid.uuid4())
+    
+    cl.user_session.set("conversation_id", conversation_id)
+    return conversation_id
 
-def assess_severity(response_text):
-    """Assess the severity of a health-related response on a scale of 1-10"""
-    try:
-        if not os.getenv("GEMINI_API_KEY"):
-            print("Gemini API key is missing!")
-            return 3
-        
-        model = genai.GenerativeModel(
+_severity_model = None
+
+def get_severity_model():
+    """Get the process-wide Gemini model used for severity scoring"""
+    global _severity_model
+    if _severity_model is None:
+        _severity_model = genai.GenerativeModel(
             model_name='gemini-1.5-flash',
             generation_config=genai.GenerationConfig(
                 temperature=0.1,
@@ -250,6 +282,21 @@ def assess_severity(response_text):
                 top_p=0.1,
             )
         )
+    return _severity_model
+
+async def assess_severity(response_text):
+    """Assess the severity of a health-related response on a scale of 1-10"""
+    # The backend scores most responses locally and only asks an LLM when unsure
+    assessment = await get_api_client().assess_severity(response_text)
+    if assessment and assessment.get("score"):
+        return max(1, min(10, int(assessment["score"])))
+    
+    try:
+        if not os.getenv("GEMINI_API_KEY"):
+            print("Gemini API key is missing!")
+            return 3
+        
+        model = get_severity_model()
         
         prompt = f"""
         As a medical assessment system, analyze the following gynecological health response and rate its severity on a scale of 1-10.
@@ -263,7 +310,9 @@ def assess_severity(response_text):
         {response_text}
         """
         
-        severity_response = model.generate_content(prompt)
+        severity_response = await asyncio.wait_for(
+            model.generate_content_async(prompt), SEVERITY_TIMEOUT
+        )
         severity_text = severity_response.text.strip()
         
         severity = 1
@@ -274,10 +323,54 @@ def assess_severity(response_text):
                 
         return max(1, min(10, severity))
         
+    except asyncio.TimeoutError:
+        print(f"Severity assessment timed out after {SEVERITY_TIMEOUT}s")
+        return 3
     except Exception as e:
         print(f"Error assessing severity: {str(e)}")
         return 3
 
+# Keep references to background tasks so they are not garbage collected mid-run
+_background_tasks = set()
+
+def run_in_background(coro):
+    """Run a coroutine alongside the current handler without awaiting it"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def cancel_active_turn():
+    """Ask the backend to stop generating the reply in flight for this session, if any"""
+    turn_id = cl.user_session.get("active_turn")
+    if not turn_id:
+        return
+    cl.user_session.set("active_turn", None)
+    try:
+        await get_api_client().cancel_turn(turn_id)
+    except Exception as e:
+        print(f"❌ Error cancelling turn {turn_id}: {str(e)}")
+
+async def attach_booking_action(response_message, response_text, user_email, message_sent, severity=None):
+    """Score the response unless the backend already did and, once it is sent, offer booking if the severity is 4 or more"""
+    if severity is None:
+        severity = await assess_severity(response_text)
+    print(f"Response severity assessment: {severity}/10 for user: {user_email}")
+    
+    # Add appointment booking button if severity >= 4
+    if severity >= 4:
+        await message_sent.wait()
+        action = cl.Action(
+            name="book_appointment", 
+            icon="calendar",
+            payload={"severity": severity, "user_email": user_email},
+            value="book_appointment", 
+            label="🩺 Book Doctor's Appointment",
+            description="Schedule a consultation with a gynecologist"
+        )
+        response_message.actions = [action]
+        await action.send(for_id=response_message.id)
+
 @cl.on_message
 async def on_message(message: cl.Message):
     """Process user messages and generate responses"""
@@ -290,55 +383,105 @@ async def on_message(message: cl.Message):
         return
     
     user_email = user.metadata.get('email', 'unknown')
-    conversation_id = cl.user_session.get("conversation_id")
-    
-    if not conversation_id:
-        conversation_id = str(uuid.uuid4())
-        cl.user_session.set("conversation_id", conversation_id)
     
     try:
-        response_data = await api_client.send_message(
-            conversation_id=conversation_id,
-            message=message.content
-        )
+        conversation_id = await ensure_conversation()
         
-        if not response_data:
-            await cl.Message(
-                content="I apologize, but I'm experiencing technical difficulties. Please try again in a moment."
-            ).send()
-            return
+        # Lets a stop or disconnect cancel the backend generation for this turn
+        turn_id = uuid.uuid4().hex
+        cl.user_session.set("active_turn", turn_id)
         
-        best_response = response_data.get("content", "No response generated.")
+        response_message = cl.Message(content="")
+        best_response = None
+        # Scored by the backend alongside the answer when available
+        severity = None
+        stream_error = None
+        stream_unavailable = False
         
-        # Assess severity
-        severity = assess_severity(best_response)
-        print(f"Response severity assessment: {severity}/10 for user: {user_email}")
+        # Stream tokens into the message as the backend generates them
+        try:
+            async for event in get_api_client().stream_message(
+                conversation_id=conversation_id,
+                message=message.content,
+                turn_id=turn_id
+            ):
+                if event.get("type") == "token":
+                    await response_message.stream_token(event.get("content", ""))
+                elif event.get("type") == "done":
+                    best_response = event.get("content", response_message.content)
+                    severity = (event.get("severity") or {}).get("score")
+                elif event.get("type") == "error":
+                    print(f"❌ Streaming error: {event.get('error')}")
+                    stream_error = event.get("error")
+        except StreamUnavailable as e:
+            print(f"⚠️ Streaming unavailable, using the blocking call: {str(e)}")
+            stream_unavailable = True
+        except Exception as e:
+            print(f"❌ Streaming failed: {str(e)}")
+            stream_error = "The response was interrupted. Please try again."
         
-        # Add appointment booking button if severity >= 4
-        if severity >= 4:
-            actions = [
-                cl.Action(
-                    name="book_appointment", 
-                    icon="calendar",
-                    payload={"severity": severity, "user_email": user_email},
-                    value="book_appointment", 
-                    label="🩺 Book Doctor's Appointment",
-                    description="Schedule a consultation with a gynecologist"
-                )
-            ]
-            await cl.Message(content=best_response, actions=actions).send()
-        else:
-            await cl.Message(content=best_response).send()
+        if stream_unavailable:
+            # Nothing reached the backend's stream endpoint, so the blocking call cannot duplicate the turn
+            response_data = await get_api_client().send_message(
+                conversation_id=conversation_id,
+                message=message.content,
+                turn_id=turn_id
+            )
+            cl.user_session.set("active_turn", None)
+            
+            if not response_data:
+                await cl.Message(
+                    content="I apologize, but I'm experiencing technical difficulties. Please try again in a moment."
+                ).send()
+                return
+            
+            best_response = response_data.get("content", "No response generated.")
+            severity = (response_data.get("severity") or {}).get("score")
+            response_message.content = best_response
+        elif best_response is None:
+            cl.user_session.set("active_turn", None)
+            if stream_error or not response_message.content:
+                # The backend already took the turn (or turned it away): show
+                # what arrived and the error rather than sending it again
+                if response_message.content:
+                    await response_message.send()
+                await cl.Message(
+                    content=stream_error or "I apologize, but I'm experiencing technical difficulties. Please try again in a moment."
+                ).send()
+                return
+            best_response = response_message.content
+        cl.user_session.set("active_turn", None)
+        
+        # Assess severity concurrently; the answer is sent without waiting for it
+        message_sent = asyncio.Event()
+        run_in_background(attach_booking_action(response_message, best_response, user_email, message_sent, severity))
         
+        try:
+            await response_message.send()
+        finally:
+            message_sent.set()
+        
+    except asyncio.CancelledError:
+        # Stopped by the user: the open request is aborted, and the backend is told as well
+        run_in_background(cancel_active_turn())
+        raise
     except Exception as e:
         error_message = f"I apologize, but I encountered an error: {str(e)}. For immediate health concerns, please contact a healthcare provider directly."
         await cl.Message(content=error_message).send()
         print(f"❌ Error processing message: {str(e)}")
 
+@cl.on_stop
+async def on_stop():
+    """The user stopped the reply: stop the backend generation too"""
+    await cancel_active_turn()
+
 @cl.on_chat_end
 async def on_chat_end():
-    """Clean up resources when chat ends"""
-    await api_client.close()
+    """Cancel any reply in flight and clean up the session's client; the shared connection pool stays open"""
+    await cancel_active_turn()
+    client = cl.user_session.get("api_client")
+    if client:
+        await client.close()
 
 @cl.action_callback("book_appointment")
 async def on_book_appointment(action):
@@ -3,23 +3,106 @@ API client for communicating with the Django backend using Firestore.
 """
 
 import aiohttp
+import asyncio
+import json
 import os
-from typing import Dict, Any, Optional, List
+import random
+import time
+import uuid
+from typing import Dict, Any, Optional, AsyncIterator
+
+# Seconds a backend health result is reused by every session in this process
+HEALTH_TTL = float(os.getenv("BACKEND_HEALTH_TTL", "30"))
+
+# Connection pool shared by every chat session in this process
+POOL_LIMIT = int(os.getenv("BACKEND_POOL_LIMIT", "100"))
+POOL_KEEPALIVE_SECONDS = float(os.getenv("BACKEND_POOL_KEEPALIVE", "30"))
+DNS_CACHE_SECONDS = 300
+
+# send_message: seconds per attempt and retries after a timeout, connection
+# error or retryable status. Retries back off exponentially with full jitter
+SEND_TIMEOUT = float(os.getenv("BACKEND_SEND_TIMEOUT", "60"))
+SEND_RETRIES = int(os.getenv("BACKEND_SEND_RETRIES", "2"))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+# 409: the first request with this key is still running
+RETRYABLE_STATUSES = {409, 429, 500, 502, 503, 504}
+# stream_message: statuses meaning the backend does not serve the stream endpoint
+STREAM_UNSUPPORTED_STATUSES = {404, 405}
+
+class StreamUnavailable(Exception):
+    """The stream endpoint is unreachable or not served; nothing was sent, so send_message may be used instead."""
+
+_health_status = None
+_health_checked_at = 0.0
+_health_lock = asyncio.Lock()
+
+_shared_session = None
+
+def get_shared_session() -> aiohttp.ClientSession:
+    """Return the process-wide aiohttp session and its pooled connector, creating them on first use."""
+    global _shared_session
+    if _shared_session is None or _shared_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT,
+            keepalive_timeout=POOL_KEEPALIVE_SECONDS,
+            ttl_dns_cache=DNS_CACHE_SECONDS,
+        )
+        _shared_session = aiohttp.ClientSession(connector=connector)
+    return _shared_session
+
+async def close_shared_session():
+    """Close the shared session and its connections; call once when the app shuts down."""
+    global _shared_session
+    if _shared_session is not None and not _shared_session.closed:
+        await _shared_session.close()
+    _shared_session = None
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> Optional[float]:
+    """
+    Seconds to wait before retry number attempt + 1, or None when the
+    server's Retry-After asks for longer than RETRY_MAX_DELAY.
+    """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    if retry_after:
+        try:
+            requested = float(retry_after)
+        except ValueError:
+            return delay
+        if requested > RETRY_MAX_DELAY:
+            return None
+        delay = max(delay, requested)
+    return delay
+
+def _error_message(status: int, body: str) -> str:
+    """The backend's own error message from a JSON error body, or a generic one."""
+    try:
+        error = json.loads(body).get("error")
+    except (ValueError, AttributeError):
+        error = None
+    if error:
+        return error
+    if status == 429:
+        return "The AI service is busy right now. Please try again shortly."
+    return "I apologize, but I'm experiencing technical difficulties. Please try again in a moment."
 
 class DjangoAPIClient:
-    """Client for Django backend API interactions."""
+    """
+    Client for Django backend API interactions.
+    
+    Instances are cheap: each chat session gets its own client carrying its
+    own token, while all of them send requests through the shared pool.
+    """
     
-    def __init__(self, base_url: str):
-        """Initialize the API client with base URL."""
+    def __init__(self, base_url: str, token: Optional[str] = None):
+        """Initialize the API client with base URL and the session's token."""
         self.base_url = base_url
-        self.token = os.getenv("DJANGO_API_TOKEN", "")
-        self.session = None
+        self.token = token if token is not None else os.getenv("DJANGO_API_TOKEN", "")
     
     async def _get_session(self) -> aiohttp.ClientSession:
-        """Get or create an aiohttp session."""
-        if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
-        return self.session
+        """Get the shared aiohttp session."""
+        return get_shared_session()
     
     async def _request(
         self, 
@@ -66,7 +149,19 @@ class DjangoAPIClient:
             return None
     
     async def check_health(self) -> bool:
-        """Check if the backend is available."""
+        """Check if the backend is available, reusing a result younger than HEALTH_TTL."""
+        global _health_status, _health_checked_at
+        
+        # Concurrent new sessions share one check instead of each sending their own
+        async with _health_lock:
+            if _health_status is not None and time.monotonic() - _health_checked_at < HEALTH_TTL:
+                return _health_status
+            _health_status = await self._check_health()
+            _health_checked_at = time.monotonic()
+            return _health_status
+    
+    async def _check_health(self) -> bool:
+        """Ask the backend health endpoints."""
         try:
             session = await self._get_session()
             # Try Firestore health endpoint first
@@ -94,28 +189,120 @@ class DjangoAPIClient:
         self,
         conversation_id: str,
         message: str,
+        idempotency_key: Optional[str] = None,
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        turn_id: Optional[str] = None,
     ) -> Optional[Dict[str, Any]]:
-        """Send a message to the conversation and get AI response."""
-        data = {"message": message}
+        """
+        Send a message to the conversation and get AI response.
         
-        result = await self._request(
-            "POST", 
-            f"chatbot/conversations/{conversation_id}/send_message/", 
-            data=data
-        )
+        Every attempt carries the same Idempotency-Key, so a retry after a
+        timeout or server error gets the stored reply instead of starting a
+        second generation. Only a 401 switches to the unauthenticated call.
+        turn_id lets cancel_turn stop the generation.
+        """
+        url = f"{self.base_url}/chatbot/conversations/{conversation_id}/send_message/"
+        idempotency_key = idempotency_key or turn_id or str(uuid.uuid4())
+        retries = SEND_RETRIES if retries is None else retries
+        client_timeout = aiohttp.ClientTimeout(total=timeout or SEND_TIMEOUT)
+        session = await self._get_session()
+        authenticate = True
+        attempt = 0
         
-        if not result:
-            # Try without authentication
-            result = await self._request(
-                "POST", 
-                f"chatbot/conversations/{conversation_id}/send_message/", 
-                data=data,
-                authenticate=False
-            )
+        while True:
+            headers = {"Content-Type": "application/json", "Idempotency-Key": idempotency_key}
+            if turn_id:
+                headers["X-Turn-Id"] = turn_id
+            if authenticate and self.token:
+                headers["Authorization"] = f"Bearer {self.token}"
+            
+            retry_after = None
+            try:
+                async with session.post(url, json={"message": message}, headers=headers,
+                                        timeout=client_timeout) as response:
+                    if response.status in (200, 201):
+                        return await response.json()
+                    if response.status == 401 and authenticate:
+                        print(f"Authentication failed: {response.status}")
+                        # Try without authentication for Firestore endpoints
+                        authenticate = False
+                        continue
+                    error_text = await response.text()
+                    print(f"API Error: {response.status} - {error_text}")
+                    if response.status not in RETRYABLE_STATUSES:
+                        return None
+                    retry_after = response.headers.get("Retry-After")
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                print(f"API request error: {type(e).__name__} {str(e)}")
+            
+            if attempt >= retries:
+                return None
+            delay = retry_delay(attempt, retry_after)
+            if delay is None:
+                return None
+            attempt += 1
+            print(f"Retrying send_message in {delay:.1f}s (attempt {attempt + 1} of {retries + 1})")
+            await asyncio.sleep(delay)
+    
+    async def stream_message(
+        self,
+        conversation_id: str,
+        message: str,
+        turn_id: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Send a message and yield the streamed response events as they arrive.
+        Cancelling the consumer closes the connection; turn_id also lets
+        cancel_turn stop the generation.
         
-        return result
+        Raises StreamUnavailable if the backend cannot be reached or does not
+        serve the endpoint. Any other failure status is yielded as an error
+        event, since the backend may already have started on the turn.
+        """
+        url = f"{self.base_url}/chatbot/conversations/{conversation_id}/stream_message/"
+        session = await self._get_session()
+        
+        for authenticate in (True, False):
+            headers = {"Content-Type": "application/json"}
+            if turn_id:
+                headers["X-Turn-Id"] = turn_id
+            if authenticate and self.token:
+                headers["Authorization"] = f"Bearer {self.token}"
+            
+            try:
+                response = await session.post(url, json={"message": message}, headers=headers)
+            except aiohttp.ClientConnectionError as e:
+                raise StreamUnavailable(str(e)) from e
+            
+            async with response:
+                if response.status == 401 and authenticate:
+                    print(f"Authentication failed: {response.status}")
+                    # Try without authentication for Firestore endpoints
+                    continue
+                if response.status in STREAM_UNSUPPORTED_STATUSES:
+                    raise StreamUnavailable(f"Stream endpoint returned {response.status}")
+                if response.status != 200:
+                    error_text = await response.text()
+                    print(f"API Error: {response.status} - {error_text}")
+                    yield {"type": "error", "status": response.status, "error": _error_message(response.status, error_text)}
+                    return
+                
+                # One JSON event per line: token, error, then done
+                async for line in response.content:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+                return
+    
+    async def cancel_turn(self, turn_id: str) -> Optional[Dict[str, Any]]:
+        """Ask the backend to stop generating the reply for a turn sent with this turn_id."""
+        return await self._request("POST", f"chatbot/turns/{turn_id}/cancel/")
+    
+    async def assess_severity(self, text: str) -> Optional[Dict[str, Any]]:
+        """Score an assistant response with the backend severity classifier (signed-in sessions only)."""
+        return await self._request("POST", "chatbot/severity/", data={"text": text})
     
     async def close(self):
-        """Close the aiohttp session."""
-        if self.session and not self.session.closed:
-            await self.session.close()
+        """Forget the session's token; the shared pool stays open for other sessions."""
+        self.token = ""
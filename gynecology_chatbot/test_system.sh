@@ -101,9 +101,10 @@ import os
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gynecology_chatbot_project.settings')
 import django
 django.setup()
-from apps.chatbot.api import get_grok_response_sync
-response = get_grok_response_sync('test')
-exit(0 if response else 1)
+from apps.chatbot.providers import provider_registry
+from utils.llm_utils import run_sync
+response = run_sync(provider_registry.get('grok').call('test', []))
+exit(0 if response and 'Error' not in response else 1)
 " > /dev/null 2>&1
 test_result $? "Grok integration"
 